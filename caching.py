@@ -0,0 +1,278 @@
+"""Small caching helpers shared by the app, report jobs and headless scripts.
+
+Each cache entry records its approximate size when it is stored, and the owners
+(e.g. Streamlit sessions, see set_owner_resolver) that stored or read it, so a
+memory budget can account for and evict one owner's entries without touching
+what other owners hold.
+"""
+import functools
+import hashlib
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Set, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from config import RENDER_CACHE_SIZE, STATS_CACHE_SIZE
+
+
+# Every cache registers itself here so the memory budget (memory.py) can see them all
+_caches: "weakref.WeakSet[LRUCache]" = weakref.WeakSet()
+
+# Returns the owner of the calling code; the headless default has none
+_owner_resolver: Callable[[], Optional[Hashable]] = lambda: None
+
+
+def set_owner_resolver(resolver: Callable[[], Optional[Hashable]]) -> None:
+    """Install the function that names the owner of cache calls from this thread.
+
+    The Streamlit adapter installs one returning the session ID; callers with no
+    owner (report threads, scripts) leave their entries untagged.
+    """
+    global _owner_resolver
+    _owner_resolver = resolver
+
+
+def current_owner() -> Optional[Hashable]:
+    return _owner_resolver()
+
+
+def estimate_nbytes(obj: Any, _seen: Optional[set] = None) -> int:
+    """Approximate memory held by a cached value.
+
+    Frames and arrays are measured exactly; containers are summed over their
+    items. Objects reachable twice are counted once. Called once per entry, when
+    it is stored.
+    """
+    if _seen is None:
+        _seen = set()
+    if id(obj) in _seen:
+        return 0
+    _seen.add(id(obj))
+
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(index=True, deep=True).sum())
+    if isinstance(obj, pd.Series):
+        return int(obj.memory_usage(index=True, deep=True))
+    if isinstance(obj, np.ndarray):
+        # Views and memory-mapped arrays do not own their buffer
+        return obj.nbytes if obj.flags.owndata and not isinstance(obj, np.memmap) else 0
+    if isinstance(obj, (bytes, bytearray)):
+        return len(obj)
+    if isinstance(obj, dict):
+        return sum(estimate_nbytes(v, _seen) for v in obj.values())
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return sum(estimate_nbytes(v, _seen) for v in obj)
+    nbytes = getattr(obj, 'nbytes', None)
+    if isinstance(nbytes, (int, np.integer)):
+        return int(nbytes)
+    return 0
+
+
+class LRUCache:
+    """Thread-safe least-recently-used cache with a fixed number of entries.
+
+    Alongside each value it keeps the value's estimated size and the set of
+    owners that stored or read it.
+    """
+
+    def __init__(self, maxsize: int = 128, name: str = "cache"):
+        self.maxsize = maxsize
+        self.name = name
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._nbytes: Dict[Hashable, int] = {}
+        self._owners: Dict[Hashable, Set[Hashable]] = {}
+        self._lock = threading.RLock()
+        _caches.add(self)
+
+    def _claim(self, key: Hashable) -> None:
+        owner = current_owner()
+        if owner is not None:
+            self._owners[key].add(owner)
+
+    def _remove(self, key: Hashable) -> None:
+        del self._data[key]
+        del self._nbytes[key]
+        del self._owners[key]
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            self._claim(key)
+            return self._data[key]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        nbytes = estimate_nbytes(value)
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            self._nbytes[key] = nbytes
+            self._owners.setdefault(key, set())
+            self._claim(key)
+            while len(self._data) > self.maxsize:
+                self._remove(next(iter(self._data)))
+
+    def get_or_create(self, key: Hashable, factory: Callable[[], Any]) -> Any:
+        """Return the cached value for key, building and storing it on a miss."""
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self._claim(key)
+                return self._data[key]
+        # Build outside the lock so slow factories don't block other readers
+        value = factory()
+        self.put(key, value)
+        return value
+
+    def owned_nbytes(self, owner: Hashable) -> Tuple[int, int]:
+        """(entries, estimated bytes) held by owner."""
+        with self._lock:
+            sizes = [self._nbytes[k] for k, owners in self._owners.items() if owner in owners]
+            return len(sizes), sum(sizes)
+
+    def release_oldest(self, owner: Hashable) -> Optional[int]:
+        """Drop owner's claim on its least recently used entry; returns that entry's size.
+
+        The entry itself is removed once no owner holds it. None if owner holds nothing.
+        """
+        with self._lock:
+            for key in self._data:
+                owners = self._owners[key]
+                if owner in owners:
+                    owners.discard(owner)
+                    nbytes = self._nbytes[key]
+                    if not owners:
+                        self._remove(key)
+                    return nbytes
+            return None
+
+    def discard_where(self, predicate: Callable[[Hashable], bool]) -> int:
+        """Remove every entry whose key satisfies predicate; returns how many went."""
+        with self._lock:
+            stale = [k for k in self._data if predicate(k)]
+            for k in stale:
+                self._remove(k)
+            return len(stale)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._nbytes.clear()
+            self._owners.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._data
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._data)
+
+
+def all_caches() -> List[LRUCache]:
+    """Every live LRUCache, sorted by name."""
+    return sorted(_caches, key=lambda c: c.name)
+
+
+# Fingerprints are remembered per DataFrame object so repeated lookups are free.
+_fingerprints: Dict[int, Tuple[weakref.ref, str]] = {}
+_fingerprint_lock = threading.Lock()
+
+
+def dataset_fingerprint(df: Optional[pd.DataFrame]) -> str:
+    """Return a stable content hash for a DataFrame.
+
+    The hash covers column names, dtypes, index and values, so two frames with the
+    same content share a fingerprint. The result is memoized on the object itself;
+    call forget_fingerprint() after mutating a frame in place.
+    """
+    if df is None:
+        return "none"
+    key = id(df)
+    with _fingerprint_lock:
+        entry = _fingerprints.get(key)
+        if entry is not None and entry[0]() is df:
+            return entry[1]
+
+    h = hashlib.sha1()
+    h.update(repr(list(df.columns)).encode())
+    h.update(repr([str(t) for t in df.dtypes]).encode())
+    h.update(pd.util.hash_pandas_object(df, index=True).values.tobytes())
+    fp = h.hexdigest()
+
+    with _fingerprint_lock:
+        _fingerprints[key] = (weakref.ref(df, lambda _ref, k=key: _fingerprints.pop(k, None)), fp)
+    return fp
+
+
+def forget_fingerprint(df: pd.DataFrame) -> None:
+    """Drop the memoized fingerprint for a frame that was modified in place."""
+    with _fingerprint_lock:
+        _fingerprints.pop(id(df), None)
+
+
+def mapping_key(mapping: Optional[Dict]) -> Tuple:
+    """Hashable, order-independent key for a dict such as a colour or name mapping."""
+    if not mapping:
+        return ()
+    return tuple(sorted(((str(k), str(v)) for k, v in dict(mapping).items())))
+
+
+# Shared cache of finished report files (bytes), see reports.build_report()
+RENDER_CACHE = LRUCache(maxsize=RENDER_CACHE_SIZE, name="render")
+
+# Shared cache of statistics results, see memoize()
+STATS_CACHE = LRUCache(maxsize=STATS_CACHE_SIZE, name="statistics")
+
+
+def source_fingerprint(source: Any) -> Optional[str]:
+    """Fingerprint of a DataFrame, or the fingerprint attribute of a derived
+    structure such as a StandCube; None if the source has no stable identity."""
+    if source is None or isinstance(source, pd.DataFrame):
+        return dataset_fingerprint(source)
+    return getattr(source, "fingerprint", None)
+
+
+def memoize(cache: LRUCache = STATS_CACHE, name: Optional[str] = None):
+    """Decorator caching f(source, *args, **kwargs) by the source's fingerprint.
+
+    The key is the function name, source_fingerprint(source) and the remaining
+    arguments, which must be hashable. Sources without a fingerprint are computed
+    without caching. Results are shared between callers, so treat them as
+    read-only. The undecorated function stays available as .uncached.
+    """
+    def decorator(func: Callable) -> Callable:
+        label = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(source, *args, **kwargs):
+            fp = source_fingerprint(source)
+            if fp is None:
+                return func(source, *args, **kwargs)
+            key = (label, fp, args, tuple(sorted(kwargs.items())))
+            return cache.get_or_create(key, lambda: func(source, *args, **kwargs))
+
+        wrapper.uncached = func
+        return wrapper
+    return decorator
+
+
+def invalidate_dataset(source: Union[pd.DataFrame, str]) -> int:
+    """Drop every cached entry built from a dataset, in all caches.
+
+    Accepts the DataFrame or its fingerprint. Call it when a dataset is replaced
+    or modified in place; returns the number of entries removed.
+    """
+    fp = source if isinstance(source, str) else dataset_fingerprint(source)
+
+    def built_from(key: Hashable) -> bool:
+        return key == fp or (isinstance(key, tuple) and fp in key)
+
+    removed = sum(cache.discard_where(built_from) for cache in all_caches())
+    if isinstance(source, pd.DataFrame):
+        forget_fingerprint(source)
+    return removed
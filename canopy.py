@@ -0,0 +1,157 @@
+"""Canopy cover from crown disks rasterized onto a grid over each plot.
+
+Crown radius comes from a per-species linear allometry on DBH
+(Data/CrownAllometry.csv, alongside TreeDict.csv), scaled by crown class.
+Each live stem's crown is stamped onto the plot grid as a disk, and each cell
+counts the crowns above it. Cover is the share of the plot under at least one
+crown, overlap the share under two or more, and gap fraction the uncovered
+remainder. Every plot census is stamped in the same vectorized pass, in chunks
+bounded by CANOPY_CHUNK_CELLS.
+"""
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from caching import memoize
+from config import (
+    DIAMETER_COL, SPECIES_COL, STATUS_COL, CROWN_COL, PLOTID_COL, YEAR_COL, DEAD_STATUS_CODES,
+    PLOT_SIZE_METERS, CROWN_ALLOMETRY_PATH, DEFAULT_CROWN_ALLOMETRY, CROWN_CLASS_FACTORS,
+    CANOPY_CELL_M, CANOPY_CHUNK_CELLS
+)
+
+ALL_CLASSES = "All"
+CANOPY_COLUMNS = [PLOTID_COL, YEAR_COL, CROWN_COL, "Cover", "Overlap", "Gap"]
+
+
+def load_crown_allometry(filepath: str = CROWN_ALLOMETRY_PATH) -> Dict[str, Tuple[float, float]]:
+    """Load species abbreviation to (intercept, slope) of crown radius (m) on DBH (cm).
+    """
+    try:
+        table = pd.read_csv(filepath)
+        return {abbr: (float(a), float(b)) for abbr, a, b in zip(table["Abbreviation"], table["Intercept"], table["Slope"])}
+    except (FileNotFoundError, KeyError, ValueError, pd.errors.ParserError):
+        # Missing or malformed table: every species uses DEFAULT_CROWN_ALLOMETRY
+        return {}
+
+
+def crown_radii(df: pd.DataFrame, allometry: Optional[Dict[str, Tuple[float, float]]] = None) -> np.ndarray:
+    """Crown radius in metres for each row; NaN where DBH is missing."""
+    if allometry is None:
+        allometry = load_crown_allometry()
+    dbh = pd.to_numeric(df[DIAMETER_COL], errors='coerce').to_numpy(dtype=float)
+    default_a, default_b = DEFAULT_CROWN_ALLOMETRY
+    if SPECIES_COL in df.columns:
+        species = df[SPECIES_COL]
+        a = species.map({k: v[0] for k, v in allometry.items()}).to_numpy(dtype=float, na_value=default_a)
+        b = species.map({k: v[1] for k, v in allometry.items()}).to_numpy(dtype=float, na_value=default_b)
+    else:
+        a, b = default_a, default_b
+    radius = a + b * dbh
+    if CROWN_COL in df.columns:
+        factor = pd.to_numeric(df[CROWN_COL], errors='coerce').map(CROWN_CLASS_FACTORS)
+        radius = radius * factor.to_numpy(dtype=float, na_value=1.0)
+    return np.clip(radius, 0, None)
+
+
+def _class_label(value):
+    # Crown classes read as floats when the column has gaps; report 2.0 as 2
+    if isinstance(value, (float, np.floating)) and float(value).is_integer():
+        return int(value)
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def rasterize_crowns(x: np.ndarray, y: np.ndarray, radius: np.ndarray, layer: np.ndarray, n_layers: int,
+                     shape: Tuple[int, int], cell: float) -> np.ndarray:
+    """Number of crowns covering each cell, as a (n_layers, ny, nx) stack.
+
+    A cell is covered when its centre lies within the crown disk; crowns are
+    clipped at the plot edge. Each disk is stamped as one run of cells per grid
+    row: +1 where the run starts and -1 past its end, summed along the rows
+    afterwards. Stems are processed in order of radius so each chunk spans only
+    the rows of its own largest crown.
+    """
+    ny, nx = shape
+    order = np.argsort(radius, kind='stable')
+    x, y, layer = x[order] / cell, y[order] / cell, layer[order]
+    radius = radius[order] / cell
+    cy = np.clip(y.astype(int), 0, ny - 1)
+    reach = np.ceil(radius).astype(int)
+    rows = 2 * reach + 1
+
+    size = n_layers * ny * (nx + 1)
+    edges = np.zeros(size)
+    start = 0
+    while start < len(x):
+        # Longest run of stems whose count x rows of the largest crown stays within CANOPY_CHUNK_CELLS
+        window = rows[start:start + max(CANOPY_CHUNK_CELLS // rows[start], 1)]
+        fits = np.arange(1, len(window) + 1) * window <= CANOPY_CHUNK_CELLS
+        stop = start + max(int(np.count_nonzero(fits)), 1)
+        chunk = slice(start, stop)
+        span = np.arange(-reach[stop - 1], reach[stop - 1] + 1)
+        iy = cy[chunk, None] + span[None]
+        dy = iy + 0.5 - y[chunk, None]
+        half = np.sqrt(np.clip(radius[chunk, None] ** 2 - dy ** 2, 0, None))
+        # Columns whose centres lie within half a chord of the stem
+        first = np.maximum(np.ceil(x[chunk, None] - half - 0.5), 0).astype(int)
+        last = np.minimum(np.floor(x[chunk, None] + half - 0.5), nx - 1).astype(int)
+        valid = (np.abs(dy) <= radius[chunk, None]) & (iy >= 0) & (iy < ny) & (first <= last)
+        row_start = ((layer[chunk, None] * ny + iy) * (nx + 1))[valid]
+        edges += np.bincount(row_start + first[valid], minlength=size)
+        edges -= np.bincount(row_start + last[valid] + 1, minlength=size)
+        start = stop
+    counts = np.cumsum(edges.reshape(n_layers, ny, nx + 1), axis=2)[:, :, :nx]
+    return np.rint(counts).astype(np.int32)
+
+
+def canopy_cover(df: pd.DataFrame, geometry: Tuple[float, float] = (PLOT_SIZE_METERS, PLOT_SIZE_METERS),
+                 cell: float = CANOPY_CELL_M, by: Optional[str] = CROWN_COL,
+                 allometry_path: str = CROWN_ALLOMETRY_PATH) -> pd.DataFrame:
+    """Percent canopy cover, overlap and gap fraction for every plot and census year.
+
+    Returns one row per PlotID, Year and crown class (when `by` is present),
+    plus a row with class ALL_CLASSES for all live stems together.
+    Dead stems (DEAD_STATUS_CODES) have no crown.
+    """
+    if YEAR_COL not in df.columns:
+        raise ValueError(f"DataFrame must contain '{YEAR_COL}' column")
+    stems = df
+    if STATUS_COL in stems.columns:
+        stems = stems[~stems[STATUS_COL].isin(DEAD_STATUS_CODES)]
+    x = pd.to_numeric(stems["X"], errors='coerce').to_numpy(dtype=float)
+    y = pd.to_numeric(stems["Y"], errors='coerce').to_numpy(dtype=float)
+    radius = crown_radii(stems, load_crown_allometry(allometry_path))
+    plots = stems[PLOTID_COL] if PLOTID_COL in stems.columns else pd.Series('Plot', index=stems.index)
+    census_codes, censuses = pd.MultiIndex.from_arrays([plots, stems[YEAR_COL]]).factorize()
+    if by is not None and by in stems.columns:
+        class_codes, classes = pd.factorize(stems[by], sort=True)
+    else:
+        class_codes, classes = np.full(len(stems), -1), []
+    # One slot per class plus one for stems without a class, which count only towards ALL_CLASSES
+    n_slots = len(classes) + 1
+    class_codes = np.where(class_codes < 0, len(classes), class_codes)
+    keep = np.isfinite(x) & np.isfinite(y) & np.isfinite(radius) & (census_codes >= 0)
+
+    width, length = geometry
+    shape = (max(int(np.ceil(length / cell)), 1), max(int(np.ceil(width / cell)), 1))
+    batch = max(CANOPY_CHUNK_CELLS // (n_slots * shape[0] * (shape[1] + 1)), 1)
+    labels = [_class_label(c) for c in classes]
+    rows = []
+    for first in range(0, len(censuses), batch):
+        in_batch = keep & (census_codes >= first) & (census_codes < first + batch)
+        n = min(batch, len(censuses) - first)
+        layer = (census_codes[in_batch] - first) * n_slots + class_codes[in_batch]
+        counts = rasterize_crowns(x[in_batch], y[in_batch], radius[in_batch], layer, n * n_slots, shape, cell)
+        counts = counts.reshape(n, n_slots, -1)
+        # Layer 0 of each census is all classes together, then one layer per class
+        grids = np.concatenate([counts.sum(axis=1, keepdims=True), counts[:, :len(labels)]], axis=1)
+        cover = 100.0 * (grids >= 1).mean(axis=2)
+        overlap = 100.0 * (grids >= 2).mean(axis=2)
+        for i in range(n):
+            plot_id, year = censuses[first + i]
+            for j, label in enumerate([ALL_CLASSES] + labels):
+                rows.append((plot_id, year, label, cover[i, j], overlap[i, j], 100.0 - cover[i, j]))
+    return pd.DataFrame(rows, columns=CANOPY_COLUMNS)
+
+
+cached_canopy_cover = memoize(name="canopy_cover")(canopy_cover)
@@ -7,10 +7,15 @@ STATUS_COL = "Status"
 CROWN_COL = "CrownClass"
 PLOTID_COL = "PlotID"
 TREEID_COL = "StandardID"
+MATCHED_ID_COL = "MatchedID"
 YEAR_COL = "Year"
 DATE_COL = "Date"
 X_COL = "X"
 Y_COL = "Y"
+TREATMENT_COL = "Treatment"
+
+# Status codes for dead stems (see Data/StatusDict.csv)
+DEAD_STATUS_CODES = ["DS", "DB", "DF"]
 
 # Coordinate column aliases (for backward compatibility with uploaded data)
 COORD_X_ALIASES = ["CoorX", "X", "Easting", "CorX"]
@@ -19,7 +24,7 @@ COORD_Y_ALIASES = ["CoorY", "Y", "Northing", "CorY"]
 # Output paths
 OUTPUT_PATH = "output.png"
 
-# Plot dimensions
+# Default plot dimensions; datasets can override them (see tree_plots.PlotGeometry)
 PLOT_SIZE_METERS = 20
 PLOT_AREA_M2 = PLOT_SIZE_METERS ** 2
 PLOT_CENTER = PLOT_SIZE_METERS / 2
@@ -66,3 +71,70 @@ DEFAULT_GRID_WIDTH = 0.5
 
 # Statistical constants
 MIN_SAMPLES_FOR_STATS = 2
+
+# Caching and report generation
+RENDER_CACHE_SIZE = 64
+STATS_CACHE_SIZE = 256
+REPORT_FIGSIZE = (11, 8.5)
+REPORT_POLL_SECONDS = 1.0
+
+# Stem re-identification between censuses
+MATCH_MAX_DISTANCE_M = 1.0
+MATCH_ID_MAX_DISTANCE_M = 3.0
+MATCH_MAX_DBH_SHRINK_CM = 2.0
+MATCH_MAX_DBH_GROWTH_CM_PER_YEAR = 2.5
+MATCH_NEIGHBOURS = 4
+
+# Diameter growth models
+GROWTH_FORM = "quadratic"
+MIN_GROWTH_SAMPLES = 5
+GROWTH_RIDGE = 1e-8
+DEFAULT_PROJECTION_YEARS = 10
+MAX_PROJECTION_YEARS = 50
+
+# Stand-structure cube
+DBH_CLASS_WIDTH_CM = 0.5
+
+# Memory-conscious mode
+COPY_ON_WRITE = True
+MEMORY_BUDGET_MB = 512
+
+# Stem-map render worker pool
+RENDER_WORKERS = 2
+RENDER_START_METHOD = "spawn"
+RENDER_TIMEOUT_SECONDS = 60
+RENDER_DPI = 100
+PNG_CACHE_SIZE = 128
+
+# Level-of-detail stem maps
+LOD_MODES = ["auto", "markers", "density", "basal_area", "dominant"]
+LOD_STEM_THRESHOLD = 2000
+LOD_GRID_CELLS = 40
+
+# Embedded inventory store ("sqlite", "duckdb", or "auto" for DuckDB when installed).
+# The file formats differ, so each backend has its own database file.
+INVENTORY_BACKEND = "sqlite"
+INVENTORY_DB_PATHS = {"sqlite": "Data/inventory.sqlite", "duckdb": "Data/inventory.duckdb"}
+
+# Kernel density surfaces
+KERNEL_CELL_M = 0.25
+KERNEL_BANDWIDTH_M = 1.5
+
+# Canopy cover. Crown radius (m) = Intercept + Slope * DBH (cm) per species from
+# the allometry table, scaled by crown class (1 dominant ... 4 suppressed)
+CROWN_ALLOMETRY_PATH = "Data/CrownAllometry.csv"
+DEFAULT_CROWN_ALLOMETRY = (0.75, 0.10)
+CROWN_CLASS_FACTORS = {1: 1.15, 2: 1.0, 3: 0.8, 4: 0.6}
+CANOPY_CELL_M = 0.25
+CANOPY_CHUNK_CELLS = 4_000_000
+
+# Species rarefaction and accumulation curves
+RAREFACTION_POINTS = 40
+RAREFACTION_PERMUTATIONS = 200
+RAREFACTION_BATCH_CELLS = 4_000_000
+RAREFACTION_CONFIDENCE = 0.95
+RAREFACTION_SEED = 0
+RAREFACTION_WORKERS = 0
+
+# Accepted upload types; compressed files are decompressed as a stream (see csv_sources.py)
+UPLOAD_TYPES = ["csv", "gz", "xz", "zip"]
@@ -0,0 +1,81 @@
+"""Read inventory CSVs from plain, gzip, xz or zip files as a stream.
+
+The format is detected from the first bytes rather than the file name, and
+the decompressor is handed to pandas as a file object. The parser pulls
+decompressed blocks on demand, so neither the compressed source nor the
+decompressed CSV is ever held in memory as a whole. A zip archive may hold
+several CSVs (e.g. one per census); their rows are concatenated.
+"""
+import gzip
+import io
+import lzma
+import os
+import zipfile
+from contextlib import ExitStack
+from typing import IO, Iterator, Tuple, Union
+
+import pandas as pd
+
+GZIP_MAGIC = b"\x1f\x8b"
+XZ_MAGIC = b"\xfd7zXZ\x00"
+# A local file header, or the end record of an empty archive
+ZIP_MAGICS = (b"PK\x03\x04", b"PK\x05\x06")
+
+# Errors from corrupt or truncated archives, reported like CSV parser errors
+DECOMPRESSION_ERRORS = (EOFError, gzip.BadGzipFile, lzma.LZMAError, zipfile.BadZipFile)
+
+Source = Union[str, os.PathLike, IO[bytes]]
+
+
+def _peek(stream: IO[bytes], size: int = 6) -> bytes:
+    position = stream.tell()
+    head = stream.read(size)
+    stream.seek(position)
+    return head
+
+
+def _is_csv_member(info: zipfile.ZipInfo) -> bool:
+    name = info.filename
+    return not info.is_dir() and name.lower().endswith(".csv") and not name.startswith("__MACOSX/")
+
+
+def csv_streams(source: Source) -> Iterator[Tuple[str, IO[bytes]]]:
+    """Yield (name, binary stream) for each CSV in a path or binary file object.
+
+    Streams are only valid until the next item is requested. Raises ValueError
+    for a zip archive that holds no CSV.
+    """
+    with ExitStack() as stack:
+        if isinstance(source, (str, os.PathLike)):
+            stream = stack.enter_context(open(source, "rb"))
+        else:
+            stream = source
+            if not stream.seekable():
+                stream = io.BufferedReader(stream)
+        name = os.path.basename(str(getattr(source, "name", source)))
+        head = _peek(stream) if stream.seekable() else stream.peek(len(XZ_MAGIC))[:len(XZ_MAGIC)]
+
+        if head.startswith(GZIP_MAGIC):
+            yield os.path.splitext(name)[0], stack.enter_context(gzip.GzipFile(fileobj=stream, mode="rb"))
+        elif head.startswith(XZ_MAGIC):
+            yield os.path.splitext(name)[0], stack.enter_context(lzma.LZMAFile(stream))
+        elif head.startswith(ZIP_MAGICS):
+            archive = stack.enter_context(zipfile.ZipFile(stream))
+            members = [info for info in archive.infolist() if _is_csv_member(info)]
+            if not members:
+                raise ValueError(f"{name} contains no CSV files")
+            for info in members:
+                with archive.open(info) as member:
+                    yield info.filename, member
+        else:
+            yield name, stream
+
+
+def read_csv_source(source: Source, **kwargs) -> pd.DataFrame:
+    """pd.read_csv() over every CSV in source, plain or compressed.
+
+    Extra keyword arguments go to pd.read_csv(). Rows of several CSVs in one zip
+    are concatenated in archive order.
+    """
+    frames = [pd.read_csv(stream, **kwargs) for _, stream in csv_streams(source)]
+    return frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
@@ -0,0 +1,248 @@
+"""Pre-aggregated stand-structure cube for fast widget queries.
+
+The cube holds stem counts, basal area and summed DBH for every non-empty cell of
+PlotID x Year x Species x Status x CrownClass x fine DBH class. It is stored
+sparsely: one row of small integer codes per occupied cell plus the measures, with
+the category labels kept once per dimension. Widgets filter by slicing the code
+columns and aggregate with np.bincount, so their cost depends on the number of
+occupied cells rather than the number of stems.
+"""
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from caching import LRUCache, dataset_fingerprint, memoize
+from config import (
+    DIAMETER_COL, SPECIES_COL, STATUS_COL, CROWN_COL, PLOTID_COL, YEAR_COL, DBH_CLASS_WIDTH_CM
+)
+
+DBH_CLASS = "DBHClass"
+CUBE_DIMS = [PLOTID_COL, YEAR_COL, SPECIES_COL, STATUS_COL, CROWN_COL, DBH_CLASS]
+CUBE_MEASURES = ["count", "basal_area", "dbh_sum"]
+
+_cube_cache = LRUCache(maxsize=8, name="cube")
+
+
+class StandCube:
+    """Sparse cube of stand-structure measures. Build with StandCube.from_frame()."""
+
+    def __init__(self, labels: Dict[str, np.ndarray], codes: np.ndarray, measures: Dict[str, np.ndarray],
+                 dbh_class_width: float, fingerprint: Optional[str] = None):
+        self.labels = labels
+        self.codes = codes
+        self.measures = measures
+        self.dbh_class_width = dbh_class_width
+        # Fingerprint of the source frame, so results derived from the cube can be
+        # memoized; sub-cubes from select() have none
+        self.fingerprint = fingerprint
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, dbh_class_width: float = DBH_CLASS_WIDTH_CM) -> "StandCube":
+        dbh = pd.to_numeric(df[DIAMETER_COL], errors='coerce').to_numpy(dtype=float) if DIAMETER_COL in df.columns else np.full(len(df), np.nan)
+        dbh_class = np.floor(dbh / dbh_class_width)
+
+        labels, code_cols = {}, []
+        for dim in CUBE_DIMS:
+            if dim == DBH_CLASS:
+                values = dbh_class
+            elif dim in df.columns:
+                values = df[dim].to_numpy()
+            else:
+                values = np.full(len(df), np.nan)
+            codes, uniques = pd.factorize(values, sort=False, use_na_sentinel=False)
+            labels[dim] = np.asarray(uniques)
+            code_cols.append(codes)
+        stem_codes = np.column_stack(code_cols).astype(np.int64)
+
+        # Collapse stems into occupied cells via a mixed-radix key
+        key = _radix_key(stem_codes, [len(labels[d]) for d in CUBE_DIMS])
+        cell_keys, cell_of_stem = np.unique(key, return_inverse=True)
+        first = np.zeros(len(cell_keys), dtype=np.int64)
+        first[cell_of_stem[::-1]] = np.arange(len(key))[::-1]
+
+        finite = np.isfinite(dbh)
+        ba = np.where(finite, np.pi * (dbh / 200.0) ** 2, 0.0)
+        measures = {
+            "count": np.bincount(cell_of_stem, minlength=len(cell_keys)).astype(np.int64),
+            "basal_area": np.bincount(cell_of_stem, weights=ba, minlength=len(cell_keys)),
+            "dbh_sum": np.bincount(cell_of_stem, weights=np.where(finite, dbh, 0.0), minlength=len(cell_keys)),
+        }
+        small = np.int16 if max(len(v) for v in labels.values()) < np.iinfo(np.int16).max else np.int32
+        return cls(labels, stem_codes[first].astype(small), measures, dbh_class_width)
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + sum(v.nbytes for v in self.measures.values())
+
+    def _dim(self, name: str) -> int:
+        try:
+            return CUBE_DIMS.index(name)
+        except ValueError:
+            raise ValueError(f"Unknown cube dimension '{name}'. Choose from {CUBE_DIMS}")
+
+    def select(self, **filters) -> "StandCube":
+        """Sub-cube restricted to the given label(s) per dimension, e.g. select(PlotID=1, Year=[2016, 2017])."""
+        cube = self
+        filters = {k: (v if isinstance(v, (list, tuple, set, np.ndarray, pd.Index)) else [v]) for k, v in filters.items()}
+        if PLOTID_COL in filters:
+            # Cells are sorted by plot code (the leading key digit), so a plot is a
+            # contiguous slice found by binary search rather than a full scan
+            wanted = np.flatnonzero(pd.Index(self.labels[PLOTID_COL]).isin(list(filters.pop(PLOTID_COL))))
+            plot_codes = self.codes[:, 0]
+            starts = np.searchsorted(plot_codes, wanted, side='left')
+            stops = np.searchsorted(plot_codes, wanted, side='right')
+            rows = np.concatenate([np.arange(a, b) for a, b in zip(starts, stops)]) if len(wanted) else np.array([], dtype=np.int64)
+            cube = cube._take(rows)
+        if not filters:
+            return cube
+        mask = np.ones(len(cube.codes), dtype=bool)
+        for name, wanted in filters.items():
+            hit = pd.Index(cube.labels[name]).isin(list(wanted))
+            mask &= hit[cube.codes[:, cube._dim(name)]]
+        return cube._take(mask)
+
+    def _take(self, rows) -> "StandCube":
+        return StandCube(self.labels, self.codes[rows], {k: v[rows] for k, v in self.measures.items()},
+                         self.dbh_class_width)
+
+    def total(self, by: Sequence[str] = (), measure: str = "count", dropna: bool = True):
+        """Sum a measure over all dimensions not in `by`.
+
+        Returns a scalar when by is empty, otherwise a Series indexed by the labels of
+        the `by` dimensions (a MultiIndex for several). Empty cells are omitted.
+        """
+        values = self.measures[measure]
+        if not by:
+            return values.sum()
+        idx = [self._dim(b) for b in by]
+        sub = self.codes[:, idx].astype(np.int64)
+        if dropna:
+            keep = np.ones(len(sub), dtype=bool)
+            for j, b in enumerate(by):
+                keep &= ~pd.isna(self.labels[b])[sub[:, j]]
+            sub, values = sub[keep], values[keep]
+        key = _radix_key(sub, [len(self.labels[b]) for b in by])
+        cells, inverse = np.unique(key, return_inverse=True)
+        sums = np.bincount(inverse, weights=values, minlength=len(cells))
+        first = np.zeros(len(cells), dtype=np.int64)
+        first[inverse[::-1]] = np.arange(len(key))[::-1]
+        level_codes = sub[first]
+        if len(by) == 1:
+            index = pd.Index(self.labels[by[0]][level_codes[:, 0]], name=by[0])
+        else:
+            index = pd.MultiIndex.from_arrays([self.labels[b][level_codes[:, j]] for j, b in enumerate(by)], names=list(by))
+        if measure == "count":
+            sums = sums.astype(np.int64)
+        result = pd.Series(sums, index=index, name=measure)
+        try:
+            return result.sort_index()
+        except TypeError:
+            # Mixed label types (e.g. numeric and text plot IDs) cannot be ordered
+            return result
+
+    def dbh_classes(self, by: Optional[str] = None) -> Tuple[np.ndarray, Dict]:
+        """Stem counts per DBH class, overall or per label of one dimension.
+
+        Returns (class lower edges, {label: counts aligned to the edges}); the key is
+        None when by is None.
+        """
+        dims = [DBH_CLASS] if by is None else [by, DBH_CLASS]
+        counts = self.total(dims)
+        if counts.empty:
+            return np.array([]), {}
+        classes = np.sort(counts.index.get_level_values(DBH_CLASS).unique().to_numpy(dtype=float))
+        lower = classes * self.dbh_class_width
+        if by is None:
+            return lower, {None: counts.reindex(classes, fill_value=0).to_numpy()}
+        table = counts.unstack(by, fill_value=0).reindex(classes, fill_value=0)
+        return lower, {label: table[label].to_numpy() for label in table.columns}
+
+    def dbh_histogram(self, bins, by: Optional[str] = SPECIES_COL) -> Tuple[Optional[np.ndarray], Dict]:
+        """Re-bin the fine DBH classes into a histogram.
+
+        bins is a count or an array of edges, as for np.histogram. Each fine class is
+        placed at its midpoint, so edges are exact to half a class width.
+        """
+        lower, per_label = self.dbh_classes(by)
+        if len(lower) == 0:
+            return None, {}
+        mids = lower + self.dbh_class_width / 2
+        if np.ndim(bins) == 0:
+            edges = np.linspace(lower.min(), lower.max() + self.dbh_class_width, int(bins) + 1)
+        else:
+            edges = np.asarray(bins, dtype=float)
+        return edges, {label: np.histogram(mids, bins=edges, weights=c)[0] for label, c in per_label.items()}
+
+    def mean_dbh(self) -> float:
+        keep = ~pd.isna(self.labels[DBH_CLASS])[self.codes[:, self._dim(DBH_CLASS)]]
+        n = self.measures["count"][keep].sum()
+        return self.measures["dbh_sum"][keep].sum() / n if n else float('nan')
+
+    def median_dbh(self) -> float:
+        """Approximate median DBH, interpolated within the fine DBH classes.
+
+        Only accurate to a class width; StemStore.median_dbh() gives the exact value.
+        """
+        lower, per_label = self.dbh_classes()
+        if len(lower) == 0:
+            return float('nan')
+        counts = per_label[None]
+        cum = np.cumsum(counts)
+        half = cum[-1] / 2
+        i = int(np.searchsorted(cum, half))
+        before = cum[i - 1] if i > 0 else 0
+        return lower[i] + self.dbh_class_width * (half - before) / counts[i]
+
+
+def _radix_key(codes: np.ndarray, sizes: List[int]) -> np.ndarray:
+    key = np.zeros(len(codes), dtype=np.int64)
+    for j, size in enumerate(sizes):
+        key = key * max(size, 1) + codes[:, j]
+    return key
+
+
+def cached_cube(df: pd.DataFrame) -> StandCube:
+    """Build the cube once per dataset content."""
+    fp = dataset_fingerprint(df)
+
+    def build() -> StandCube:
+        cube = StandCube.from_frame(df)
+        cube.fingerprint = fp
+        return cube
+
+    return _cube_cache.get_or_create(fp, build)
+
+
+@memoize()
+def plot_year_stats(cube: StandCube, plot_id) -> Optional[dict]:
+    """Cube-backed equivalent of tree_statistics.compute_plot_year_stats().
+
+    Memoized per source dataset and plot for cubes from cached_cube(); treat the
+    returned frames as read-only.
+    """
+    plot_cube = cube.select(**{PLOTID_COL: plot_id}) if plot_id is not None else cube
+    if len(plot_cube) == 0:
+        return None
+    label = plot_id if plot_id is not None else 'Plot'
+
+    counts = plot_cube.total([YEAR_COL]).rename('Count').reset_index()
+    counts['PlotID'] = label
+    basal_area = plot_cube.total([YEAR_COL], measure="basal_area").rename('BasalArea_m2').reset_index()
+    basal_area['PlotID'] = label
+
+    def composition(col):
+        comp = plot_cube.total([YEAR_COL, col]).rename('Count').reset_index()
+        comp['Proportion'] = comp['Count'] / comp.groupby(YEAR_COL)['Count'].transform('sum')
+        comp['PlotID'] = label
+        return comp
+
+    return {
+        'counts_df': counts,
+        'basal_area_df': basal_area,
+        'species_df': composition(SPECIES_COL),
+        'status_df': composition(STATUS_COL),
+    }
@@ -0,0 +1,200 @@
+"""Diameter growth models fitted to observed DBH increments.
+
+Each species (optionally species x treatment) gets its own increment ~ f(DBH)
+curve. All groups are fitted together: the normal equations for every group are
+accumulated with np.bincount over one stacked design matrix and solved as a single
+batched np.linalg.solve, so fitting cost does not grow with a Python loop over
+species. Groups with too few remeasurements fall back to the pooled fit.
+"""
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from caching import LRUCache, dataset_fingerprint
+from config import (
+    DIAMETER_COL, SPECIES_COL, STATUS_COL, PLOTID_COL, TREEID_COL, MATCHED_ID_COL, YEAR_COL,
+    DEAD_STATUS_CODES, GROWTH_FORM, MIN_GROWTH_SAMPLES, GROWTH_RIDGE
+)
+
+# Design-matrix builders for annual increment as a function of DBH (cm)
+GROWTH_FORMS: Dict[str, Callable[[np.ndarray], np.ndarray]] = {
+    "linear": lambda d: np.column_stack([np.ones_like(d), d]),
+    "quadratic": lambda d: np.column_stack([np.ones_like(d), d, d ** 2]),
+    "loglinear": lambda d: np.column_stack([np.ones_like(d), d, np.log(d)]),
+}
+
+_model_cache = LRUCache(maxsize=16, name="growth_models")
+
+
+def _default_id_col(df: pd.DataFrame) -> str:
+    return MATCHED_ID_COL if MATCHED_ID_COL in df.columns else TREEID_COL
+
+
+def increment_table(df: pd.DataFrame, id_col: Optional[str] = None, by: Sequence[str] = (SPECIES_COL,)) -> pd.DataFrame:
+    """One row per consecutive remeasurement of a tree.
+
+    Columns are the grouping columns in `by`, the starting DBH, the years elapsed
+    and the annual increment (cm/yr).
+    """
+    if id_col is None:
+        id_col = _default_id_col(df)
+    missing = [c for c in [PLOTID_COL, id_col, YEAR_COL, DIAMETER_COL, *by] if c not in df.columns]
+    if missing:
+        raise ValueError(f"DataFrame must contain {missing} for growth modelling")
+
+    t = df[[PLOTID_COL, id_col, YEAR_COL, DIAMETER_COL, *[c for c in by if c not in (PLOTID_COL, id_col)]]].copy()
+    t[YEAR_COL] = pd.to_numeric(t[YEAR_COL], errors='coerce')
+    t[DIAMETER_COL] = pd.to_numeric(t[DIAMETER_COL], errors='coerce')
+    t = t.dropna(subset=[PLOTID_COL, id_col, YEAR_COL]).sort_values(YEAR_COL, kind='stable')
+
+    nxt = t.groupby([PLOTID_COL, id_col], sort=False)[[YEAR_COL, DIAMETER_COL]].shift(-1)
+    years = nxt[YEAR_COL] - t[YEAR_COL]
+    inc = (nxt[DIAMETER_COL] - t[DIAMETER_COL]) / years
+    keep = (years > 0) & np.isfinite(inc) & (t[DIAMETER_COL] > 0)
+
+    out = t.loc[keep, list(by)].copy()
+    out[DIAMETER_COL] = t.loc[keep, DIAMETER_COL].astype(float)
+    out['Years'] = years[keep].astype(float)
+    out['Increment'] = inc[keep].astype(float)
+    return out.reset_index(drop=True)
+
+
+def _solve_batched(xtx: np.ndarray, xty: np.ndarray) -> np.ndarray:
+    """Solve a stack of small ridge-regularised normal equations in one call."""
+    p = xtx.shape[-1]
+    # Scale the ridge per coefficient so DBH and DBH^2 terms are damped alike
+    diag = np.diagonal(xtx, axis1=-2, axis2=-1)
+    a = xtx + np.eye(p) * (GROWTH_RIDGE * diag + 1e-12)[..., None, :]
+    return np.linalg.solve(a, xty[..., None])[..., 0]
+
+
+def fit_growth_models(df: pd.DataFrame, form: str = GROWTH_FORM, by: Sequence[str] = (SPECIES_COL,),
+                      id_col: Optional[str] = None) -> pd.DataFrame:
+    """Fit increment ~ f(DBH) for every group in `by` at once.
+
+    Returns one row per group with the `by` columns, sample size n, coefficients
+    b0..b{p-1} for GROWTH_FORMS[form], residual RMSE and whether the pooled fit was
+    used. The pooled coefficients, form and grouping are kept in .attrs.
+    """
+    if form not in GROWTH_FORMS:
+        raise ValueError(f"Unknown growth form '{form}'. Choose from {sorted(GROWTH_FORMS)}")
+    by = list(by)
+    table = increment_table(df, id_col=id_col, by=by)
+    if table.empty:
+        raise ValueError("No remeasured trees with valid DBH to fit growth models")
+
+    x = GROWTH_FORMS[form](table[DIAMETER_COL].to_numpy())
+    y = table['Increment'].to_numpy()
+    grouped = table.groupby(by, sort=True, dropna=False)
+    codes = grouped.ngroup().to_numpy()
+    n_groups, p = grouped.ngroups, x.shape[1]
+
+    # Accumulate X'X and X'y for every group with one bincount per matrix entry
+    xtx = np.empty((n_groups, p, p))
+    for i in range(p):
+        for j in range(i, p):
+            xtx[:, i, j] = xtx[:, j, i] = np.bincount(codes, weights=x[:, i] * x[:, j], minlength=n_groups)
+    xty = np.stack([np.bincount(codes, weights=x[:, i] * y, minlength=n_groups) for i in range(p)], axis=1)
+    n = np.bincount(codes, minlength=n_groups)
+
+    pooled = _solve_batched(xtx.sum(axis=0), xty.sum(axis=0))
+    betas = _solve_batched(xtx, xty)
+    use_pooled = n < max(MIN_GROWTH_SAMPLES, p)
+    betas[use_pooled] = pooled
+
+    resid = y - np.einsum('np,np->n', x, betas[codes])
+    rmse = np.sqrt(np.bincount(codes, weights=resid ** 2, minlength=n_groups) / np.maximum(n, 1))
+
+    params = grouped.size().reset_index()[by]
+    params['n'] = n
+    for i in range(p):
+        params[f'b{i}'] = betas[:, i]
+    params['rmse'] = rmse
+    params['pooled'] = use_pooled
+    # Observed ranges, used to keep predictions from extrapolating off the data
+    params['dbh_min'] = grouped[DIAMETER_COL].min().to_numpy()
+    params['dbh_max'] = grouped[DIAMETER_COL].max().to_numpy()
+    params['inc_max'] = grouped['Increment'].max().clip(lower=0).to_numpy()
+    params.attrs.update({
+        # Plain floats: pandas compares attrs when propagating them, which fails for arrays
+        'form': form, 'by': by, 'pooled_coef': tuple(float(b) for b in pooled),
+        'pooled_range': (float(table[DIAMETER_COL].min()), float(table[DIAMETER_COL].max()), float(max(y.max(), 0.0))),
+    })
+    return params
+
+
+def cached_growth_models(df: pd.DataFrame, form: str = GROWTH_FORM, by: Sequence[str] = (SPECIES_COL,),
+                         id_col: Optional[str] = None) -> pd.DataFrame:
+    """fit_growth_models() cached against the dataset fingerprint and fit settings."""
+    key = (dataset_fingerprint(df), form, tuple(by), id_col or _default_id_col(df))
+    return _model_cache.get_or_create(key, lambda: fit_growth_models(df, form, by, id_col))
+
+
+def _coefficients_for(params: pd.DataFrame, keys: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+    """Coefficients and (dbh_min, dbh_max, inc_max) for each row of keys.
+
+    Stems whose group was not fitted get the pooled coefficients and ranges.
+    """
+    by = params.attrs['by']
+    coef_cols = [c for c in params.columns if c.startswith('b') and c[1:].isdigit()]
+    range_cols = ['dbh_min', 'dbh_max', 'inc_max']
+    matched = keys[by].merge(params[by + coef_cols + range_cols], on=by, how='left')
+    coef = matched[coef_cols].to_numpy(dtype=float)
+    ranges = matched[range_cols].to_numpy(dtype=float)
+    unknown = np.isnan(coef).any(axis=1)
+    coef[unknown] = params.attrs['pooled_coef']
+    ranges[unknown] = params.attrs['pooled_range']
+    return coef, ranges
+
+
+def _increment(build: Callable, dbh: np.ndarray, coef: np.ndarray, ranges: np.ndarray) -> np.ndarray:
+    # The curve is held flat outside the observed DBH range and capped at the
+    # largest observed increment, so projections cannot run away
+    d = np.clip(dbh, ranges[:, 0], ranges[:, 1])
+    return np.clip(np.einsum('np,np->n', build(d), coef), 0, ranges[:, 2])
+
+
+def predict_increment(params: pd.DataFrame, keys: pd.DataFrame, dbh: np.ndarray) -> np.ndarray:
+    """Predicted annual DBH increment (cm/yr) for each stem."""
+    coef, ranges = _coefficients_for(params, keys)
+    return _increment(GROWTH_FORMS[params.attrs['form']], np.asarray(dbh, dtype=float), coef, ranges)
+
+
+def project_basal_area(df: pd.DataFrame, plot_id, years: int, params: Optional[pd.DataFrame] = None,
+                       form: str = GROWTH_FORM, by: Sequence[str] = (SPECIES_COL,)) -> Optional[pd.DataFrame]:
+    """Project living basal area of a plot forward from its last census.
+
+    Each living stem in the last census grows by its group's fitted increment every
+    year. Returns Year and BasalArea_m2 for the last census year and each projected
+    year, or None if the plot has no living stems with DBH.
+    """
+    if params is None:
+        params = cached_growth_models(df, form, by)
+    plot_df = df[df[PLOTID_COL] == plot_id] if plot_id is not None else df
+    years_col = pd.to_numeric(plot_df[YEAR_COL], errors='coerce')
+    if years_col.isna().all():
+        return None
+    last_year = int(years_col.max())
+
+    stems = plot_df[years_col == last_year]
+    if STATUS_COL in stems.columns:
+        stems = stems[~stems[STATUS_COL].isin(DEAD_STATUS_CODES)]
+    dbh = pd.to_numeric(stems[DIAMETER_COL], errors='coerce').to_numpy(dtype=float)
+    alive = np.isfinite(dbh) & (dbh > 0)
+    if not alive.any():
+        return None
+    stems, dbh = stems[alive], dbh[alive]
+
+    coef, ranges = _coefficients_for(params, stems.reset_index(drop=True))
+    build = GROWTH_FORMS[params.attrs['form']]
+    basal_area = [np.pi * np.sum((dbh / 200.0) ** 2)]
+    for _ in range(years):
+        dbh = dbh + _increment(build, dbh, coef, ranges)
+        basal_area.append(np.pi * np.sum((dbh / 200.0) ** 2))
+
+    return pd.DataFrame({
+        YEAR_COL: np.arange(last_year, last_year + years + 1),
+        'BasalArea_m2': basal_area,
+        'PlotID': plot_id if plot_id is not None else 'Plot',
+    })
@@ -0,0 +1,296 @@
+"""Optional embedded store of census inventories with indexed queries.
+
+Inventories are imported once into a local database file and then queried by
+plot, year or species, so opening the app and selecting plots reads only the rows
+a page needs rather than re-parsing every CSV. SQLite (standard library) is the
+default backend; DuckDB is used instead when requested, or with "auto" when it is
+installed. The two file formats are not interchangeable, so each backend keeps
+its own file (INVENTORY_DB_PATHS). Both hold the same single `stems` table with
+indexes on PlotID, Year, Species and StandardID. Each import or removal runs in
+one transaction, so a failed import leaves nothing behind.
+"""
+import datetime
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import pandas as pd
+
+try:
+    import duckdb
+except ImportError:  # optional dependency
+    duckdb = None
+
+from caching import dataset_fingerprint
+from config import (
+    DIAMETER_COL, SPECIES_COL, STATUS_COL, CROWN_COL, PLOTID_COL, TREEID_COL, YEAR_COL, X_COL, Y_COL,
+    TREATMENT_COL, INVENTORY_DB_PATHS, INVENTORY_BACKEND
+)
+
+# Stored columns and their SQL types; other uploaded columns are not kept
+STORE_COLUMNS: Dict[str, str] = {
+    "Inventory": "TEXT",
+    PLOTID_COL: "TEXT",
+    "PlotDisplay": "TEXT",
+    YEAR_COL: "INTEGER",
+    TREEID_COL: "TEXT",
+    SPECIES_COL: "TEXT",
+    STATUS_COL: "TEXT",
+    CROWN_COL: "TEXT",
+    TREATMENT_COL: "TEXT",
+    X_COL: "DOUBLE",
+    Y_COL: "DOUBLE",
+    DIAMETER_COL: "DOUBLE",
+}
+INDEXED_COLUMNS = [PLOTID_COL, YEAR_COL, SPECIES_COL, TREEID_COL]
+OPTIONAL_COLUMNS = ["PlotDisplay", TREEID_COL, CROWN_COL, TREATMENT_COL]
+TEXT_COLUMNS = [c for c, t in STORE_COLUMNS.items() if t == "TEXT"]
+
+_stores: Dict[str, "InventoryStore"] = {}
+_stores_lock = threading.Lock()
+
+
+def _resolve_backend(backend: str) -> str:
+    if backend == "auto":
+        backend = "duckdb" if duckdb is not None else "sqlite"
+    if backend == "duckdb" and duckdb is None:
+        raise ValueError("DuckDB backend requested but the duckdb package is not installed")
+    if backend not in ("sqlite", "duckdb"):
+        raise ValueError(f"Unknown inventory backend '{backend}'. Choose 'sqlite', 'duckdb' or 'auto'")
+    return backend
+
+
+def _restore_ids(values: pd.Series) -> pd.Series:
+    # IDs are stored as text; give back numbers when every ID is numeric, so
+    # filters and joins behave as on a frame from read_data()
+    numeric = pd.to_numeric(values, errors='coerce')
+    return numeric if numeric.notna().sum() == values.notna().sum() else values
+
+
+class InventoryStore:
+    """Census inventories in an embedded database. Use open_inventory_store() in the app."""
+
+    def __init__(self, path: Optional[str] = None, backend: str = INVENTORY_BACKEND):
+        backend = _resolve_backend(backend)
+        path = path or INVENTORY_DB_PATHS[backend]
+        self.path = path
+        self.backend = backend
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if backend == "duckdb":
+            self._con = duckdb.connect(path)
+        else:
+            # One connection shared across Streamlit threads, serialized by the lock
+            self._con = sqlite3.connect(path, check_same_thread=False)
+            self._con.execute("PRAGMA journal_mode=WAL")
+            self._con.execute("PRAGMA synchronous=NORMAL")
+            self._con.execute("PRAGMA cache_size=-65536")  # 64 MB page cache for bulk imports
+        self._lock = threading.RLock()
+        self._create_schema()
+
+    def _execute(self, sql: str, params: Sequence = ()) -> None:
+        with self._lock:
+            self._con.execute(sql, list(params))
+            if self.backend == "sqlite":
+                self._con.commit()
+
+    @contextmanager
+    def _transaction(self):
+        """Run the enclosed statements as one transaction, rolled back on any error."""
+        with self._lock:
+            if self.backend == "duckdb":
+                self._con.begin()
+                try:
+                    yield
+                except BaseException:
+                    self._con.rollback()
+                    raise
+                self._con.commit()
+            else:
+                # The connection context commits on success and rolls back on error
+                with self._con:
+                    yield
+
+    def _query(self, sql: str, params: Sequence = ()) -> pd.DataFrame:
+        with self._lock:
+            if self.backend == "duckdb":
+                return self._con.execute(sql, list(params)).fetchdf()
+            return pd.read_sql_query(sql, self._con, params=list(params))
+
+    def _create_schema(self) -> None:
+        columns = ", ".join(f'"{c}" {t}' for c, t in STORE_COLUMNS.items())
+        self._execute(f"CREATE TABLE IF NOT EXISTS stems ({columns})")
+        self._execute("CREATE TABLE IF NOT EXISTS inventories "
+                      "(name TEXT, fingerprint TEXT PRIMARY KEY, n_rows INTEGER, imported_at TEXT)")
+        # One row per plot census, so listing plots and years never scans the stems
+        self._execute(f'CREATE TABLE IF NOT EXISTS censuses ("Inventory" TEXT, "{PLOTID_COL}" TEXT, '
+                      f'"PlotDisplay" TEXT, "{YEAR_COL}" INTEGER, "Stems" INTEGER)')
+        self._execute(f'CREATE INDEX IF NOT EXISTS idx_censuses_plot ON censuses ("{PLOTID_COL}")')
+        for col in INDEXED_COLUMNS:
+            self._execute(f'CREATE INDEX IF NOT EXISTS idx_stems_{col.lower()} ON stems ("{col}")')
+        self._execute(f'CREATE INDEX IF NOT EXISTS idx_stems_plot_year ON stems ("{PLOTID_COL}", "{YEAR_COL}")')
+
+    def close(self) -> None:
+        with self._lock:
+            self._con.close()
+
+    # Import
+
+    def import_frame(self, df: pd.DataFrame, name: str) -> bool:
+        """Add a standardised inventory (read_data + normalize_coordinates output).
+
+        Inventories are identified by content, so importing the same data again is
+        a no-op; returns whether rows were added.
+        """
+        fp = dataset_fingerprint(df)
+        if self._has_inventory(fp):
+            return False
+
+        rows = pd.DataFrame(index=df.index)
+        for col, sql_type in STORE_COLUMNS.items():
+            if col == "Inventory":
+                rows[col] = name
+            elif col not in df.columns:
+                rows[col] = None
+            elif sql_type == "TEXT":
+                rows[col] = df[col].astype(str).astype(object).where(df[col].notna(), None)
+            elif sql_type == "INTEGER":
+                rows[col] = pd.to_numeric(df[col], errors='coerce').astype('Int64')
+            else:
+                rows[col] = pd.to_numeric(df[col], errors='coerce').astype(float)
+
+        # Rows of one plot census sit together on disk, and index inserts stay local
+        rows = rows.sort_values([PLOTID_COL, YEAR_COL], kind='stable')
+        censuses = (rows.groupby(["Inventory", PLOTID_COL, YEAR_COL], dropna=False)
+                    .agg(PlotDisplay=("PlotDisplay", "first"), Stems=(PLOTID_COL, "size")).reset_index())
+        censuses = censuses[["Inventory", PLOTID_COL, "PlotDisplay", YEAR_COL, "Stems"]]
+
+        with self._transaction():
+            # Checked again inside the transaction in case another session imported it meanwhile
+            if self._has_inventory(fp):
+                return False
+            self._append("stems", rows)
+            self._append("censuses", censuses)
+            self._con.execute("INSERT INTO inventories VALUES (?, ?, ?, ?)",
+                              [name, fp, len(rows), datetime.datetime.now().isoformat(timespec="seconds")])
+        return True
+
+    def _has_inventory(self, fingerprint: str) -> bool:
+        return not self._query("SELECT 1 FROM inventories WHERE fingerprint = ?", [fingerprint]).empty
+
+    def _append(self, table: str, frame: pd.DataFrame) -> None:
+        # Runs inside _transaction(); neither path commits on its own
+        if self.backend == "duckdb":
+            self._con.register("incoming", frame)
+            self._con.execute(f"INSERT INTO {table} SELECT * FROM incoming")
+            self._con.unregister("incoming")
+        else:
+            values = frame.astype(object).where(frame.notna(), None)
+            columns = ", ".join(f'"{c}"' for c in frame.columns)
+            self._con.executemany(f"INSERT INTO {table} ({columns}) VALUES ({', '.join('?' * frame.shape[1])})",
+                                  values.itertuples(index=False, name=None))
+
+    def import_csv(self, filelike, name: Optional[str] = None) -> bool:
+        """Read a CSV with read_data(), normalise it and import it."""
+        from tree_plots import normalize_coordinates, read_data
+
+        df, notices = read_data(filelike)
+        if df is None:
+            raise ValueError("; ".join(n.message for n in notices if n.level == "error") or "Could not read file")
+        if name is None:
+            name = os.path.basename(getattr(filelike, "name", str(filelike)))
+        return self.import_frame(normalize_coordinates(df), name)
+
+    def remove_inventory(self, name: str) -> None:
+        with self._transaction():
+            self._con.execute("DELETE FROM stems WHERE Inventory = ?", [name])
+            self._con.execute("DELETE FROM censuses WHERE Inventory = ?", [name])
+            self._con.execute("DELETE FROM inventories WHERE name = ?", [name])
+
+    # Queries
+
+    def inventories(self) -> pd.DataFrame:
+        return self._query("SELECT name, n_rows, imported_at FROM inventories ORDER BY imported_at")
+
+    def __len__(self) -> int:
+        return int(self._query("SELECT COUNT(*) AS n FROM stems")["n"].iloc[0])
+
+    def plots(self, inventories: Optional[Iterable[str]] = None) -> pd.DataFrame:
+        """Distinct PlotID (and PlotDisplay) values with their number of censuses."""
+        where, params = self._inventory_filter(inventories)
+        plots = self._query(f'SELECT "{PLOTID_COL}", MIN("PlotDisplay") AS "PlotDisplay", '
+                            f'COUNT(DISTINCT "{YEAR_COL}") AS "Censuses" FROM censuses {where} '
+                            f'GROUP BY "{PLOTID_COL}" ORDER BY "{PLOTID_COL}"', params)
+        plots[PLOTID_COL] = _restore_ids(plots[PLOTID_COL])
+        return plots
+
+    def years(self, plot_id) -> List[int]:
+        years = self._query(f'SELECT DISTINCT "{YEAR_COL}" FROM censuses WHERE "{PLOTID_COL}" = ? '
+                            f'AND "{YEAR_COL}" IS NOT NULL ORDER BY "{YEAR_COL}"', [str(plot_id)])
+        return [int(y) for y in years[YEAR_COL]]
+
+    def plot_rows(self, plot_ids: Iterable, years: Optional[Iterable[int]] = None,
+                  columns: Optional[Sequence[str]] = None, inventories: Optional[Iterable[str]] = None) -> pd.DataFrame:
+        """Stems of the given plots (optionally only some years), in the layout
+        read_data() + normalize_coordinates() produce."""
+        plot_ids = [str(p) for p in plot_ids]
+        if not plot_ids:
+            return pd.DataFrame(columns=list(columns or STORE_COLUMNS))
+        selected = ", ".join(f'"{c}"' for c in (columns or STORE_COLUMNS))
+        sql = f'SELECT {selected} FROM stems WHERE "{PLOTID_COL}" IN ({", ".join("?" * len(plot_ids))})'
+        params: list = list(plot_ids)
+        if years is not None:
+            years = [int(y) for y in years]
+            sql += f' AND "{YEAR_COL}" IN ({", ".join("?" * len(years))})' if years else " AND 1 = 0"
+            params += years
+        where, extra = self._inventory_filter(inventories, prefix="AND")
+        rows = self._query(f"{sql} {where}", params + extra)
+        return self._restore_types(rows)
+
+    def counts_by_year(self, plot_id, by: Optional[str] = None) -> pd.DataFrame:
+        """Stem count and basal area (m²) per census of a plot, optionally per `by` column."""
+        if by is not None and by not in TEXT_COLUMNS:
+            raise ValueError(f"Cannot group by '{by}'. Choose from {TEXT_COLUMNS}")
+        group = f', "{by}"' if by else ""
+        rows = self._query(
+            f'SELECT "{YEAR_COL}"{group}, COUNT(*) AS "Count", '
+            f'SUM(3.141592653589793 * "{DIAMETER_COL}" * "{DIAMETER_COL}" / 40000.0) AS "BasalArea_m2" '
+            f'FROM stems WHERE "{PLOTID_COL}" = ? GROUP BY "{YEAR_COL}"{group} ORDER BY "{YEAR_COL}"{group}',
+            [str(plot_id)])
+        rows[YEAR_COL] = rows[YEAR_COL].astype('Int64')
+        rows["BasalArea_m2"] = rows["BasalArea_m2"].fillna(0.0)
+        return rows
+
+    def _inventory_filter(self, inventories: Optional[Iterable[str]], prefix: str = "WHERE"):
+        if inventories is None:
+            return "", []
+        inventories = list(inventories)
+        if not inventories:
+            return f"{prefix} 1 = 0", []
+        return f'{prefix} "Inventory" IN ({", ".join("?" * len(inventories))})', inventories
+
+    def _restore_types(self, rows: pd.DataFrame) -> pd.DataFrame:
+        for col in (PLOTID_COL, TREEID_COL, CROWN_COL):
+            if col in rows.columns:
+                rows[col] = _restore_ids(rows[col])
+        if YEAR_COL in rows.columns:
+            rows[YEAR_COL] = pd.to_numeric(rows[YEAR_COL], errors='coerce').astype('Int64')
+        # Optional columns the source inventories never had come back entirely empty
+        empty = [c for c in OPTIONAL_COLUMNS if c in rows.columns and rows[c].isna().all()]
+        return rows.drop(columns=empty)
+
+
+def open_inventory_store(path: Optional[str] = None, backend: str = INVENTORY_BACKEND) -> InventoryStore:
+    """Process-wide store for a database file, opened on first use.
+
+    path defaults to the backend's file in INVENTORY_DB_PATHS.
+    """
+    backend = _resolve_backend(backend)
+    key = os.path.abspath(path or INVENTORY_DB_PATHS[backend])
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = InventoryStore(path, backend)
+        return _stores[key]
@@ -0,0 +1,73 @@
+"""Memory-conscious mode: pandas copy-on-write, memory reporting and a cache budget.
+
+With copy-on-write enabled, filtering, renaming and assign() share column data
+with their source until one side is written to, so the per-rerun frames the
+pages derive from an upload no longer each hold a full copy. The caches in
+caching.py are what keeps frames, cubes, stores and rendered maps alive between
+reruns. They are shared by every session, so the report and the budget here
+only count the entries one owner (a session) holds, using the sizes recorded
+when each entry was stored; enforce_budget() releases that owner's least
+recently used entries until its total fits.
+"""
+from typing import Dict, Hashable, Optional
+
+import pandas as pd
+
+from caching import all_caches, estimate_nbytes, memoize
+from config import COPY_ON_WRITE, MEMORY_BUDGET_MB
+
+MB = 1024 * 1024
+
+
+def enable_copy_on_write(enabled: bool = COPY_ON_WRITE) -> bool:
+    """Turn on pandas copy-on-write; returns whether it is active.
+
+    pandas 3 always uses copy-on-write and no longer has the option.
+    """
+    if int(pd.__version__.split('.')[0]) >= 3:
+        return True
+    if enabled:
+        pd.set_option('mode.copy_on_write', True)
+    return bool(pd.get_option('mode.copy_on_write'))
+
+
+# Size of a whole dataset, measured once per fingerprint rather than on every rerun
+cached_nbytes = memoize(name="nbytes")(estimate_nbytes)
+
+
+def memory_report(owner: Hashable, held: Optional[Dict[str, int]] = None) -> pd.DataFrame:
+    """Estimated memory of the cache entries owner holds, plus sizes of frames it keeps.
+
+    held maps a name to a size in bytes. Returns one row per source with Source,
+    Entries and MB columns, largest first.
+    """
+    rows = []
+    for c in all_caches():
+        entries, nbytes = c.owned_nbytes(owner)
+        rows.append((f"cache: {c.name}", entries, nbytes / MB))
+    rows.extend((name, 1, nbytes / MB) for name, nbytes in (held or {}).items())
+    report = pd.DataFrame(rows, columns=['Source', 'Entries', 'MB'])
+    return report.sort_values('MB', ascending=False, ignore_index=True)
+
+
+def enforce_budget(owner: Hashable, budget_mb: float = MEMORY_BUDGET_MB,
+                   held: Optional[Dict[str, int]] = None) -> int:
+    """Release owner's cache entries until they plus `held` bytes fit in budget_mb.
+
+    The oldest entry of owner's currently largest cache goes first; an entry is
+    only removed once no other owner holds it. Sizes in held are counted but
+    never evicted. Returns the number of entries released.
+    """
+    budget = budget_mb * MB
+    total_held = sum((held or {}).values())
+    sizes = {c: c.owned_nbytes(owner)[1] for c in all_caches()}
+    released = 0
+    while sizes and total_held + sum(sizes.values()) > budget:
+        largest = max(sizes, key=sizes.get)
+        nbytes = largest.release_oldest(owner)
+        if nbytes is None:
+            del sizes[largest]
+            continue
+        sizes[largest] -= nbytes
+        released += 1
+    return released
@@ -2,7 +2,7 @@ import streamlit as st
 import sys, os
 import numpy as np
 import matplotlib.pyplot as plt
-from typing import Optional, List
+from typing import NamedTuple, Optional, List
 import pandas as pd
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
@@ -10,19 +10,50 @@ from plotly.subplots import make_subplots
 st.set_page_config(layout="wide", page_title="Comparison")
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 
-from tree_plots import load_data, normalize_coordinates, plot_data, assign_colors, load_species_dict, load_status_dict
-from tree_statistics import compute_plot_year_stats, diversity, compute_dbh_increments, diversity_plot, dbh_plot
+from tree_plots import (
+    PlotGeometry, normalize_coordinates, assign_colors, load_species_dict, load_status_dict, infer_plot_geometry
+)
+from tree_statistics import cached_diversity, cached_dbh_increments
+from streamlit_views import load_data, plot_data, diversity_plot, dbh_counts_plot, session_owner
+from cube import StandCube, cached_cube, plot_year_stats
+from stem_store import cached_stem_store
+from reports import ReportJob
+from stem_matching import with_matched_ids
+from growth import cached_growth_models, project_basal_area
+from memory import enable_copy_on_write, memory_report, enforce_budget, cached_nbytes
+from caching import memoize
+from inventory_store import open_inventory_store
+from canopy import ALL_CLASSES, cached_canopy_cover
+from rarefaction import RAREFACTION_METHODS, cached_rarefaction_table, rarefaction_curve
+from raster import SURFACE_MEASURES, ALL_STEMS, cached_kernel_surfaces, difference_surface, surface_figure
 
 from config import (
-    DIAMETER_COL, PLOT_SIZE_METERS, SPECIES_COL, STATUS_COL, CROWN_COL,
-    PLOTID_COL, PLOT_AREA_M2, MATPLOTLIB_FIGSIZE_WIDE, MATPLOTLIB_FIGSIZE_SQUARE,
+    DIAMETER_COL, SPECIES_COL, STATUS_COL, CROWN_COL, YEAR_COL,
+    PLOTID_COL, MATPLOTLIB_FIGSIZE_WIDE, MATPLOTLIB_FIGSIZE_SQUARE,
     COORD_X_ALIASES, COORD_Y_ALIASES, WELCOME_TEXT, DEFAULT_BINS, MIN_BINS, MAX_BINS,
-    DEFAULT_YEAR_TEXT_FORMAT
+    DEFAULT_YEAR_TEXT_FORMAT, REPORT_POLL_SECONDS, MATCHED_ID_COL, TREATMENT_COL,
+    DEFAULT_PROJECTION_YEARS, MAX_PROJECTION_YEARS, MEMORY_BUDGET_MB, LOD_MODES,
+    KERNEL_BANDWIDTH_M, UPLOAD_TYPES
 )
 
-def dbh_app(df: pd.DataFrame, colors: dict) -> None:
-    """Display DBH histogram and statistics for a dataset."""
-    species_list = sorted(df[SPECIES_COL].dropna().unique())
+LOD_LABELS = {
+    "auto": "Automatic",
+    "markers": "Individual stems",
+    "density": "Stem density (hexbin)",
+    "basal_area": "Basal area per cell",
+    "dominant": "Dominant group per cell",
+}
+
+# Derived frames share column data with the upload instead of copying it
+enable_copy_on_write()
+
+@st.fragment
+def dbh_app(cube: StandCube, colors: dict) -> None:
+    """Display DBH histogram and statistics for a plot, answered from its stand cube.
+
+    A fragment: the species, bin and colour controls rerun only this panel.
+    """
+    species_list = sorted(cube.total([SPECIES_COL]).index)
     species_options = ["Select All"] + list(species_list)
     selected = st.multiselect("Choose species:", options=species_options, default=["Select All"], key="dbh_species")
 
@@ -31,35 +62,306 @@ def dbh_app(df: pd.DataFrame, colors: dict) -> None:
     else:
         selected_species = selected
 
-    filtered_df = df[df[SPECIES_COL].isin(selected_species)]
-    
     num_bins = st.slider("Number of bins for DBH histogram", min_value=MIN_BINS, max_value=MAX_BINS, value=DEFAULT_BINS, key="dbh_bins")
-    all_dbh = df[DIAMETER_COL].dropna()
+    bin_edges, counts_by_species = cube.dbh_histogram(num_bins, by=SPECIES_COL)
     
-    if len(all_dbh) == 0:
+    if bin_edges is None:
         st.warning("No DBH data available.")
         return
     
-    bin_edges = np.histogram_bin_edges(all_dbh, bins=num_bins)
     one_colour = st.checkbox("Use Species-Specific Colouring", value=True, key="dbh_color")
-    dbh_plot(filtered_df, selected_species, bin_edges, colors, one_colour)
+    selected_counts = {sp: counts_by_species[sp] for sp in selected_species if sp in counts_by_species}
+    dbh_counts_plot(bin_edges, selected_counts, colors, one_colour)
     
     if selected_species:
-        avg_dbh = filtered_df[DIAMETER_COL].mean()
+        avg_dbh = cube.select(**{SPECIES_COL: selected_species}).mean_dbh()
         st.write(f"Mean {DIAMETER_COL}: {avg_dbh:.2f} cm")
 
+
+def plot_geometry_inputs(label: str, default: PlotGeometry, key: str) -> PlotGeometry:
+    """Inputs for one dataset's plot frame, prefilled from its coordinates."""
+    col_w, col_l = st.columns(2)
+    width = col_w.number_input(f"{label} width (m)", min_value=1.0, value=float(default.width), step=5.0, key=f"{key}_width")
+    length = col_l.number_input(f"{label} length (m)", min_value=1.0, value=float(default.length), step=5.0, key=f"{key}_length")
+    return PlotGeometry(width, length)
+
+
+@st.fragment(run_every=REPORT_POLL_SECONDS)
+def report_panel(df: pd.DataFrame, plotting_group: Optional[str], use_mapped_names: bool, geometry: PlotGeometry) -> None:
+    """Start, monitor and download a background report for the whole dataset."""
+    job = st.session_state.get("report_job")
+
+    if job is None or job.done:
+        fmt = st.radio("Report format", ["pdf", "html"], horizontal=True, key="report_fmt")
+        if st.button("Generate report for all plots", key="report_start"):
+            species_dict = load_species_dict() if use_mapped_names else {}
+            status_dict = load_status_dict() if use_mapped_names else {}
+            job = ReportJob(df, fmt=fmt, plotting_group=plotting_group, species_dict=species_dict,
+                            status_dict=status_dict, geometry=geometry).start()
+            st.session_state["report_job"] = job
+
+    if job is None:
+        return
+    fraction, message = job.progress()
+    if job.running:
+        st.progress(fraction, text=f"Building report: {message}")
+        if st.button("Cancel report", key="report_cancel"):
+            job.cancel()
+    elif job.error is not None:
+        st.error(f"Report failed: {job.error}")
+    elif job.result is not None:
+        st.download_button("Download report", data=job.result, file_name=job.file_name,
+                           mime=job.mime, key="report_download")
+    elif job.cancelled:
+        st.info("Report cancelled.")
+
+class StemMapStyle(NamedTuple):
+    """Stem map settings shared by every map on the page."""
+    colors: dict
+    plotting_group: Optional[str]
+    species_dict: dict
+    status_dict: dict
+    lod: str
+    view: Optional[tuple]
+
+
+def show_stem_map(stems: pd.DataFrame, year, style: StemMapStyle, geometry: PlotGeometry, overlay=None) -> bytes:
+    return plot_data(stems, style.colors, style.plotting_group, year, species_dict=style.species_dict,
+                     status_dict=style.status_dict, geometry=geometry, lod=style.lod, view=style.view, overlay=overlay)
+
+
+def download_figure(png: bytes, label: str, key: str) -> None:
+    st.download_button(label=label, data=png, file_name="tree_plot.png", mime="image/png", key=key)
+
+
+@st.fragment
+def census_change_panel(df: pd.DataFrame, plot_id, label, year_list: List, measure: str, bandwidth: float,
+                        geometry: PlotGeometry) -> None:
+    """Difference surface between two censuses of one plot."""
+    c1, c2 = st.columns(2)
+    before_year = c1.selectbox("From", year_list, index=0, key="change_from")
+    after_year = c2.selectbox("To", year_list, index=len(year_list) - 1, key="change_to")
+    before, after = (
+        cached_kernel_surfaces(df, plot_id, y, measure, None, bandwidth, geometry=tuple(geometry))[ALL_STEMS]
+        for y in (before_year, after_year)
+    )
+    st.pyplot(surface_figure(difference_surface(before, after), f"Plot {label}: {before_year} to {after_year}"))
+
+
+@st.fragment
+def single_plot_view(df: pd.DataFrame, store, cube: StandCube, selected_plot, plot_id, style: StemMapStyle,
+                     geometry: PlotGeometry, overlay_measure: Optional[str], bandwidth: float) -> None:
+    """Stem map, summary metrics and DBH analysis for one plot.
+
+    Picking a year or overlay group reruns only this view; the DBH and census
+    change panels inside it rerun on their own.
+    """
+    df_subset = df[df[PLOTID_COL] == plot_id]
+    if df_subset.empty:
+        st.warning(f"No data found for plot {selected_plot}")
+        return
+    st.subheader(f"Cross Section - Plot {selected_plot}")
+
+    try:
+        if "Year" not in df_subset.columns:
+            st.warning("No 'Year' column found in data.")
+            return
+        year_list = sorted(df_subset["Year"].dropna().unique())
+        year = st.pills("Select year to display", year_list, default=year_list[0])
+
+        png = None
+        if year is not None:
+            year_subset = store.plot_year(plot_id, year).to_frame()
+            overlay = None
+            if overlay_measure is not None:
+                surfaces = cached_kernel_surfaces(df, plot_id, year, overlay_measure, style.plotting_group,
+                                                  bandwidth, geometry=tuple(geometry))
+                overlay_group = st.selectbox("Overlay group", list(surfaces), key="overlay_group")
+                overlay = surfaces[overlay_group]
+            png = show_stem_map(year_subset, year, style, geometry, overlay)
+
+        # Species statistics and DBH
+        col1, col2, col3 = st.columns([1, 0.5, 1])
+
+        plot_cube = cube.select(**{PLOTID_COL: plot_id})
+        species_counts = plot_cube.total([SPECIES_COL]).sort_values(ascending=False)
+        with col2:
+            st.metric("Total trees:", len(year_subset))
+            st.metric("Unique Species", len(species_counts))
+            st.metric("Mean DBH (cm)", f"{plot_cube.mean_dbh():.1f}")
+            st.metric("Median DBH (cm)", f"{store.plot(plot_id).median_dbh():.1f}")
+            top_species, top_count = species_counts.index[0], species_counts.iloc[0]
+            st.metric(
+                "Dominant Species (%)",
+                f"{top_species}:{100 * top_count / plot_cube.total():.1f}%"
+            )
+
+        with col1:
+            with st.expander("Species Composition", expanded = True):
+                diversity_plot(species_counts, style.colors)
+
+        with col3:
+            with st.expander("DBH Analysis", expanded=True):
+                dbh_app(plot_cube, style.colors)
+
+        # Download button
+        col_dl1, col_dl2, col_dl3 = st.columns([1, 2, 1])
+        with col_dl1:
+            if png is not None:
+                download_figure(png, "Download Figure", "single_download")
+
+        if overlay_measure is not None and len(year_list) > 1:
+            with st.expander("Change between censuses", expanded=False):
+                census_change_panel(df, plot_id, selected_plot, year_list, overlay_measure, bandwidth, geometry)
+    except Exception as e:
+        st.error(f"Error processing plot: {str(e)}")
+
+
+@st.fragment
+def comparison_maps(panels: List[tuple], style: StemMapStyle) -> None:
+    """Side-by-side stem maps, each with its own year pills, and the DBH histogram of the censuses shown.
+
+    panels holds (label, plot rows, stem store, PlotID, geometry) for each side.
+    """
+    shown = []
+    for i, (col, (label, subset, store, plot_id, geometry)) in enumerate(zip(st.columns(2), panels)):
+        with col:
+            stems, year = None, None
+            if subset.empty:
+                st.warning(f"No data found for {label}")
+            else:
+                available_years = sorted(subset["Year"].dropna().unique())
+                year = st.pills("Select year to display", options=available_years, key=i + 1,
+                                default=available_years[0] if available_years else None)
+            if year:
+                stems = store.plot_year(plot_id, year).to_frame()
+            st.subheader(f"Plot {label}")
+            if stems is not None and not stems.empty:
+                png = show_stem_map(stems, year, style, geometry)
+                download_figure(png, f"Download Figure {i + 1}", ["compare_download", "comp_download"][i])
+            shown.append(stems)
+
+    if all(stems is not None for stems in shown):
+        all_dbh = np.concatenate([stems[DIAMETER_COL].dropna().values for stems in shown])
+        if len(all_dbh) > 0:
+            bins = np.histogram_bin_edges(all_dbh, bins='auto')
+            fig = go.Figure()
+            for (label, *_), stems, colour in zip(panels, shown, ['rgba(31,119,180,0.6)', 'rgba(255,127,14,0.6)']):
+                fig.add_trace(go.Histogram(x=stems[DIAMETER_COL], name=f"{DIAMETER_COL} {label}",
+                                           nbinsx=len(bins)-1, marker_color=colour, opacity=0.7))
+            fig.update_layout(title_text=f"{DIAMETER_COL} distribution of the censuses shown", barmode='overlay',
+                              xaxis_title=f'{DIAMETER_COL} (cm)', yaxis_title='Count')
+            st.plotly_chart(fig, use_container_width=True)
+
+
+@st.fragment
+def rarefaction_panel(inputs: List[tuple]) -> None:
+    """Rarefaction or accumulation curves for (label, plot rows) inputs, compared at a common stem count."""
+    c1, c2 = st.columns(2)
+    method = c1.radio("Curve", RAREFACTION_METHODS, horizontal=True, key="rarefaction_method",
+                      format_func={"analytic": "Rarefaction (exact)", "permutation": "Accumulation (permutations)"}.get)
+    # One census at a time: pooling censuses would count remeasured stems repeatedly
+    years = sorted(set().union(*(rows[YEAR_COL].dropna().unique() for _, rows in inputs)))
+    if not years:
+        st.info("No census years to compare.")
+        return
+    year = c2.selectbox("Census", years, index=len(years) - 1, key="rarefaction_year")
+
+    fig = go.Figure()
+    totals = []
+    for label, rows in inputs:
+        rows = rows[rows[YEAR_COL] == year]
+        by = (PLOTID_COL, TREATMENT_COL) if TREATMENT_COL in rows.columns else (PLOTID_COL,)
+        table = cached_rarefaction_table(rows, by=by, method=method)
+        for key, curve in table.groupby(list(by), sort=False):
+            name = f"Plot {label}" + (f" ({key[1]})" if len(by) > 1 else "")
+            fig.add_trace(go.Scatter(x=curve["Individuals"], y=curve["Upper"], mode='lines', line=dict(width=0),
+                                     legendgroup=name, showlegend=False, hoverinfo='skip'))
+            fig.add_trace(go.Scatter(x=curve["Individuals"], y=curve["Lower"], mode='lines', line=dict(width=0),
+                                     fill='tonexty', legendgroup=name, showlegend=False, hoverinfo='skip'))
+            fig.add_trace(go.Scatter(x=curve["Individuals"], y=curve["Expected"], mode='lines', name=name,
+                                     legendgroup=name))
+        totals.append((label, rows[SPECIES_COL].dropna()))
+
+    common = min(len(species) for _, species in totals)
+    if common > 0:
+        fig.add_vline(x=common, line_dash='dot', annotation_text=f"{common} stems")
+    fig.update_layout(xaxis_title='Individuals sampled', yaxis_title='Species')
+    st.plotly_chart(fig, use_container_width=True)
+
+    # Richness of each plot rarefied to the smaller stem count, comparable across plots
+    for col, (label, species) in zip(st.columns(len(totals)), totals):
+        if common > 0:
+            rarefied = rarefaction_curve(species.value_counts().to_numpy(), sizes=np.array([common]))
+            col.metric(f"Species at {common} stems ({label})", f"{rarefied['Expected'].iloc[0]:.1f}",
+                       help=f"Observed: {species.nunique()} species in {len(species)} stems")
+
+@st.fragment
+def projection_panel(proj_inputs: List[tuple]) -> None:
+    """Basal area projection for (label, data, PlotID) inputs; the horizon slider reruns only this panel."""
+    proj_years = st.slider("Years to project", min_value=1, max_value=MAX_PROJECTION_YEARS,
+                           value=DEFAULT_PROJECTION_YEARS, key="proj_years")
+    proj_fig = go.Figure()
+    for label, data, pid in proj_inputs:
+        by = [SPECIES_COL, TREATMENT_COL] if TREATMENT_COL in data.columns else [SPECIES_COL]
+        try:
+            projection = project_basal_area(data, pid, proj_years, params=cached_growth_models(data, by=by))
+        except ValueError as e:
+            st.info(f"No growth model for plot {label}: {e}")
+            continue
+        if projection is not None:
+            proj_fig.add_trace(go.Scatter(x=projection['Year'], y=projection['BasalArea_m2'],
+                                          name=f"Projected {label}", mode='lines+markers'))
+    proj_fig.update_layout(xaxis_title='Year', yaxis_title='Living basal area (m²)')
+    st.plotly_chart(proj_fig, use_container_width=True)
+
+@memoize(name="prepared_dataset")
+def prepare_dataset(raw: pd.DataFrame, geometry: PlotGeometry) -> pd.DataFrame:
+    """Normalized coordinates wrapped into the plot frame, with stems linked across
+    censuses (MATCHED_ID_COL) so per-tree joins survive re-tagged or missing IDs."""
+    df = normalize_coordinates(raw)
+    df = df.assign(X=pd.to_numeric(df["X"], errors="coerce") % geometry.width,
+                   Y=pd.to_numeric(df["Y"], errors="coerce") % geometry.length)
+    return with_matched_ids(df)
+
 # Title of page 
 st.title("Tree Plot Grapher")
 st.write(WELCOME_TEXT)
 with st.sidebar:
-    file_option = st.radio("Data source:", ["Upload your data", "See an example"], horizontal=True)
+    file_option = st.radio("Data source:", ["Upload your data", "See an example", "Inventory store"], horizontal=True)
+    inventory = None
     
     if file_option == "See an example":
         uploaded_file = "Data/example_data.csv"
         df = load_data(uploaded_file)
         st.info("Showing example data from example_data.csv")
+    elif file_option == "Inventory store":
+        inventory = open_inventory_store()
+        with st.expander("Import CSVs into the store", expanded=inventory.inventories().empty):
+            new_files = st.file_uploader("Census CSVs", type=UPLOAD_TYPES, accept_multiple_files=True, key="store_upload")
+            imported = st.session_state.setdefault("store_imported", set())
+            for new_file in new_files or []:
+                upload_key = (new_file.name, new_file.size)
+                if upload_key in imported:
+                    continue
+                try:
+                    added = inventory.import_csv(new_file, new_file.name)
+                except ValueError as e:
+                    st.error(f"Could not import {new_file.name}: {e}")
+                    continue
+                imported.add(upload_key)
+                if added:
+                    st.success(f"Imported {new_file.name}")
+                else:
+                    st.info(f"{new_file.name} is already in the store")
+            st.caption(f"{len(inventory.inventories())} inventories in {inventory.path}")
+        store_plots = inventory.plots()
+        # Rows are read from the store once plots are selected below
+        uploaded_file = inventory.path if not store_plots.empty else None
+        df = None
     else:
-        uploaded_file = st.file_uploader("Choose a CSV file", type="csv")
+        uploaded_file = st.file_uploader("Choose a CSV file", type=UPLOAD_TYPES,
+                                         help="Plain CSV, or compressed as .gz, .xz or .zip (one or more CSVs).")
         df = load_data(uploaded_file) if uploaded_file is not None else None
     
     has_plots_subplots = False
@@ -74,6 +376,9 @@ with st.sidebar:
         plots_options = df[PLOTID_COL].unique() if (df is not None and PLOTID_COL in df.columns) else []
         if df is not None and PLOTID_COL not in df.columns and not has_plots_subplots:
             st.warning(f"Uploaded CSV does not contain a '{PLOTID_COL}' column or Plot/SubPlot columns. Plot selection is disabled.")
+    if inventory is not None:
+        has_plots_subplots = bool(store_plots["PlotDisplay"].notna().any())
+        plots_options = sorted(store_plots["PlotDisplay"].dropna().unique()) if has_plots_subplots else list(store_plots[PLOTID_COL])
 
     
     use_control = False
@@ -85,8 +390,12 @@ with st.sidebar:
     
     use_control = st.checkbox("Compare with a control file", value=False)
 
-    if use_control:
-        control_file = st.file_uploader("Upload a control file to compare against", type="csv", key="control_file")
+    if use_control and inventory is not None:
+        # The control plot comes from the same store
+        has_control_plots_subplots = has_plots_subplots
+        control_plots_options = plots_options
+    elif use_control:
+        control_file = st.file_uploader("Upload a control file to compare against", type=UPLOAD_TYPES, key="control_file")
         df_control = load_data(control_file) if control_file is not None else None
         
         if df_control is not None:
@@ -102,28 +411,57 @@ with st.sidebar:
 
     if use_control:
         plots = st.multiselect("Select plot to compare (main file)", options=plots_options, max_selections=1)
-        control_selected = st.selectbox("Select the control plot to compare against", options=control_plots_options) if df_control is not None else None
+        control_selected = st.selectbox("Select the control plot to compare against", options=control_plots_options) if (df_control is not None or inventory is not None) else None
     else:
         plots = st.multiselect("Select plot(s) to view:", options=plots_options, max_selections=2)
 
+    if inventory is not None:
+        # Query only the selected plots; PlotDisplay values in the store equal their PlotIDs
+        plot_lookup = {d: p for d, p in zip(store_plots["PlotDisplay"], store_plots[PLOTID_COL]) if d is not None}
+        df = inventory.plot_rows([plot_lookup.get(p, p) for p in plots]) if plots else None
+        if use_control and control_selected is not None:
+            df_control = inventory.plot_rows([plot_lookup.get(control_selected, control_selected)])
+
     plotting_group = st.selectbox("Pick attribute to plot trees by", [SPECIES_COL, STATUS_COL, CROWN_COL, None], format_func=lambda x: "No grouping (Grey)" if x is None else x)
     
     use_mapped_names = st.checkbox("Use full species/status names in legends", value=True)
 
 
 if uploaded_file is not None and df is not None:
+    raw_df, raw_control = df, df_control
     df = normalize_coordinates(df)
-    df["X"] = pd.to_numeric(df["X"], errors="coerce")
-    df["Y"] = pd.to_numeric(df["Y"], errors="coerce")
-
-    df["X"] = df["X"] % PLOT_SIZE_METERS
-    df["Y"] = df["Y"] % PLOT_SIZE_METERS
     if df_control is not None:
         df_control = normalize_coordinates(df_control)
-        df_control["X"] = pd.to_numeric(df_control["X"], errors="coerce")
-        df_control["Y"] = pd.to_numeric(df_control["Y"], errors="coerce")
-        df_control["X"] = df_control["X"] % PLOT_SIZE_METERS
-        df_control["Y"] = df_control["Y"] % PLOT_SIZE_METERS
+
+    # Each dataset has its own plot frame, inferred from its coordinates
+    with st.sidebar:
+        with st.expander("Stem map view", expanded=False):
+            geometry = plot_geometry_inputs("Plot", infer_plot_geometry(df), key="geometry")
+            geometry_control = plot_geometry_inputs("Control plot", infer_plot_geometry(df_control), key="geometry_control") if df_control is not None else None
+            lod = st.selectbox("Level of detail", LOD_MODES, format_func=LOD_LABELS.get, key="lod",
+                               help="Automatic draws individual stems for small or zoomed-in plots and a density map for large ones.")
+            view = None
+            if st.checkbox("Zoom to a region", value=False, key="zoom"):
+                x_range = st.slider("X range (m)", 0.0, float(geometry.width), (0.0, float(geometry.width)), key="zoom_x")
+                y_range = st.slider("Y range (m)", 0.0, float(geometry.length), (0.0, float(geometry.length)), key="zoom_y")
+                view = (*x_range, *y_range)
+            overlay_measure = st.selectbox("Kernel overlay", [None, *SURFACE_MEASURES], key="overlay_measure",
+                                           format_func=lambda m: "None" if m is None else SURFACE_MEASURES[m])
+            bandwidth = st.slider("Kernel bandwidth (m)", 0.5, 5.0, float(KERNEL_BANDWIDTH_M), 0.25, key="bandwidth",
+                                  help="Standard deviation of the Gaussian kernel used to smooth stems into a surface.")
+
+    # The uploads themselves are parsed once (see load_data), so these are hashed
+    # once per dataset and plot frame rather than on every rerun
+    df = prepare_dataset(raw_df, geometry)
+    if df_control is not None:
+        df_control = prepare_dataset(raw_control, geometry_control)
+
+    # Pre-aggregated counts/basal area that the widgets below slice instead of re-scanning rows
+    cube = cached_cube(df)
+    cube_control = cached_cube(df_control) if df_control is not None else None
+    # Compact stem arrays; per-plot/year stem map inputs are views into these
+    store = cached_stem_store(df)
+    store_control = cached_stem_store(df_control) if df_control is not None else None
 
     all_species = []
     if SPECIES_COL in df.columns:
@@ -141,10 +479,26 @@ if uploaded_file is not None and df is not None:
     all_status = sorted(set(all_status))
     colorsstat = assign_colors(all_status)
 
-    # Initialize subset variables for later use
-    subset1 = None
-    subset2 = None
-    
+    with st.sidebar:
+        with st.expander("Report", expanded=False):
+            report_panel(df, plotting_group, use_mapped_names, geometry)
+        with st.expander("Memory", expanded=False):
+            budget_mb = st.number_input("Cache budget (MB)", min_value=16, value=MEMORY_BUDGET_MB, step=64, key="memory_budget",
+                                        help="Applies to the cached results this session uses; results other sessions also use stay cached for them.")
+            # Dataset sizes are measured once per dataset, cache entries when they are stored
+            session_frames = {name: cached_nbytes(frame) for name, frame in [("data", df), ("control data", df_control)]
+                              if frame is not None}
+            owner = session_owner()
+            released = enforce_budget(owner, budget_mb, session_frames)
+            report = memory_report(owner, session_frames)
+            st.dataframe(report.round({"MB": 1}), hide_index=True)
+            st.caption(f"This session: {report['MB'].sum():.1f} MB" + (f"; released {released} cached entries" if released else ""))
+
+    # Widgets inside these views are fragments: they rerun only their own section,
+    # while the sidebar controls above rerun the page
+    style = StemMapStyle(colors, plotting_group, load_species_dict() if use_mapped_names else {},
+                         load_status_dict() if use_mapped_names else {}, lod, view)
+
     # Single plot cross-section view (only if NOT comparing with control)
     if len(plots) == 1 and not (use_control and control_selected is not None):
         selected_plot = plots[0]
@@ -154,84 +508,23 @@ if uploaded_file is not None and df is not None:
             plot_id_filtered = selected_plot.replace(" - ", "-")
         else:
             plot_id_filtered = selected_plot
-        
-        # Filter dataframe to selected plot
-        df_subset = df[df[PLOTID_COL] == plot_id_filtered].copy()
-        
-        if df_subset.empty:
-            st.warning(f"No data found for plot {selected_plot}")
-        else:
-            st.subheader(f"Cross Section - Plot {selected_plot}")
-            
-            try:
-                # Year selection
-                if "Year" in df_subset.columns:  
-                    year_list = sorted(df_subset["Year"].dropna().unique())
-                    year = st.pills("Select year to display", year_list, default=year_list[0])
-                    
-                    if year is not None:
-                        year_subset = df_subset[df_subset["Year"] == year]
-                        species_dict = load_species_dict() if use_mapped_names else {}
-                        status_dict = load_status_dict() if use_mapped_names else {}
-                        fn = plot_data(year_subset, colors, plotting_group, year, species_dict=species_dict, status_dict=status_dict)
-                    
-                    # Species statistics and DBH
-                    col1, col2, col3 = st.columns([1, 0.5, 1])
-                    
-                    species_counts = df_subset[SPECIES_COL].value_counts().sort_values(ascending=False)
-                    with col2:
-                        st.metric("Total trees:", len(year_subset))
-                        st.metric("Unique Species", len(species_counts))  
-                        st.metric("Mean DBH (cm)", f"{df_subset[DIAMETER_COL].mean():.1f}")
-                        st.metric("Median DBH (cm)", f"{df_subset[DIAMETER_COL].median():.1f}") 
-                        top_species, top_count = species_counts.index[0], species_counts.iloc[0]
-                        st.metric(
-                            "Dominant Species (%)",
-                            f"{top_species}:{100 * top_count / len(df_subset):.1f}%"
-                        )
-                                            
-                    with col1:
-                        with st.expander("Species Composition", expanded = True):
-                            diversity_plot(species_counts, colors)
-                    
-                    with col3:
-                        with st.expander("DBH Analysis", expanded=True):
-                            dbh_app(df_subset, colors)
-                    
-                    # Download button
-                    col_dl1, col_dl2, col_dl3 = st.columns([1, 2, 1])
-                    with col_dl1:
-                        if year is not None and 'fn' in locals():
-                            with open(fn, "rb") as img:
-                                st.download_button(
-                                    label="Download Figure",
-                                    data=img,
-                                    file_name=fn,
-                                    mime="image/png",
-                                    key="single_download"
-                                )
-                else:
-                    st.warning("No 'Year' column found in data.")
-            except Exception as e:
-                st.error(f"Error processing plot: {str(e)}")
+
+        single_plot_view(df, store, cube, selected_plot, plot_id_filtered, style, geometry, overlay_measure, bandwidth)
     
     # Comparison view (two plots)
     elif (not use_control and len(plots) == 2) or (use_control and len(plots) == 1 and control_selected is not None):
-        col1, col2 = st.columns(2)
-
-        datasets = []
-        plot_ids = []
-        plot_labels = []
-        
         if use_control:
             plot_ids = [plots[0], control_selected]
             datasets = [df, df_control]
+            stores = [store, store_control]
+            geometries = [geometry, geometry_control]
         else:
             plot_ids = plots
             datasets = [df, df]
+            stores = [store, store]
+            geometries = [geometry, geometry]
 
-        subset1 = None
-        subset2 = None
+        panels = []
         for i, plot_id in enumerate(plot_ids):
             # Convert PlotDisplay format ("1 - 1") to PlotID format ("1-1") if needed
             # Use the appropriate has_plots_subplots flag based on which dataset we're using
@@ -244,44 +537,11 @@ if uploaded_file is not None and df is not None:
                 plot_id_filtered = plot_id.replace(" - ", "-")
             else:
                 plot_id_filtered = plot_id
-            
+
             subset = datasets[i][datasets[i][PLOTID_COL] == plot_id_filtered]
-            label_id = plot_id
+            panels.append((plot_id, subset, stores[i], plot_id_filtered, geometries[i]))
+        comparison_maps(panels, style)
 
-            if i == 0:
-                with col1:
-                    if subset.empty:
-                        st.warning(f"No data found for {label_id}")
-                        year1 = None
-                    else:
-                        available_years = sorted(subset["Year"].dropna().unique())
-                        year1 = st.pills("Select year to display", options=available_years, key=1, default = available_years[0] if available_years else None)
-                    if year1:
-                        subset1 = subset[subset["Year"] == year1]
-                    st.subheader(f"Plot {label_id}")
-                    if subset1 is not None and not subset1.empty:
-                        species_dict = load_species_dict() if use_mapped_names else {}
-                        status_dict = load_status_dict() if use_mapped_names else {}
-                        wn = plot_data(subset1, colors, plotting_group, year=year1, species_dict=species_dict, status_dict=status_dict)
-
-                    
-            else:
-                with col2:
-                    if subset.empty:
-                        st.warning(f"No data found for {label_id}")
-                        year2 = None
-                    else:
-                        available_years = sorted(subset["Year"].dropna().unique())
-                        year2 = st.pills("Select year to display", options=available_years, key=2, default = available_years[0] if available_years else None)
-                    if year2:
-                        subset2 = subset[subset["Year"] == year2]
-                    st.subheader(f"Plot {label_id}")
-                    if subset2 is not None and not subset2.empty:
-                        species_dict = load_species_dict() if use_mapped_names else {}
-                        status_dict = load_status_dict() if use_mapped_names else {}
-                        rn = plot_data(subset2, colors, plotting_group, year=year2, species_dict=species_dict, status_dict=status_dict)
-
-                    
     #metric = st.selectbox("Choose a metric:", ["Tree density", "Basal area", "Species composition", "Survival"])
     
     if (not use_control and len(plots) == 2) or (use_control and len(plots) == 1 and control_selected is not None):
@@ -292,23 +552,22 @@ if uploaded_file is not None and df is not None:
         
         if has_plots_subplots:
             plotA_id = plotA.replace(" - ", "-") if " - " in plotA else plotA
-            stats_a = compute_plot_year_stats(df, plotA_id)
+            stats_a = plot_year_stats(cube, plotA_id)
         else:
-            stats_a = compute_plot_year_stats(df, plotA)
+            stats_a = plot_year_stats(cube, plotA)
         
         if use_control and has_control_plots_subplots:
             plotB_id = plotB.replace(" - ", "-") if " - " in plotB else plotB
-            stats_b = compute_plot_year_stats(df_control, plotB_id)
+            stats_b = plot_year_stats(cube_control, plotB_id)
         elif use_control:
-            df_b = df_control if df_control is not None else df
-            stats_b = compute_plot_year_stats(df_b, plotB)
+            stats_b = plot_year_stats(cube_control if cube_control is not None else cube, plotB)
         else:
             # When not using control and has_plots_subplots, apply same conversion as plotA
             if has_plots_subplots:
                 plotB_id = plotB.replace(" - ", "-") if " - " in plotB else plotB
-                stats_b = compute_plot_year_stats(df, plotB_id)
+                stats_b = plot_year_stats(cube, plotB_id)
             else:
-                stats_b = compute_plot_year_stats(df, plotB)
+                stats_b = plot_year_stats(cube, plotB)
 
         if stats_a is None or stats_b is None:
             st.warning("One or both selected plots do not have time-based data for statistics.")
@@ -318,13 +577,14 @@ if uploaded_file is not None and df is not None:
                 specs=[
                     [{"colspan": 2}, None],   # row 1: density
                     [{"colspan": 2}, None],   # row 2: basal area
-                    [{}, {}],                 # row 3: species
-                    [{}, {}],                  # row 4: status
-                    [{"colspan": 2}, None],   # row 5: DBH histogram
+                    [{"colspan": 2}, None],   # row 3: canopy cover
+                    [{}, {}],                 # row 4: species
+                    [{}, {}],                  # row 5: status
                 ],
                 subplot_titles=(
                     "Tree density over time",
                     "Basal area (m²) over time",
+                    "Canopy cover (%) over time",
                     f"Species composition: Plot {plotA}",
                     f"Species composition: Plot {plotB}",
                     f"Status composition: Plot {plotA}",
@@ -338,9 +598,9 @@ if uploaded_file is not None and df is not None:
 
             a_counts = stats_a['counts_df'].sort_values('Year')
             b_counts = stats_b['counts_df'].sort_values('Year')
-            fig.add_trace(go.Scatter(x=a_counts['Year'], y=a_counts['Count'] / PLOT_AREA_M2, 
+            fig.add_trace(go.Scatter(x=a_counts['Year'], y=a_counts['Count'] / geometry.area_m2, 
                                     name=f"Density {plotA}", mode='lines+markers'), row=1, col=1)
-            fig.add_trace(go.Scatter(x=b_counts['Year'], y=b_counts['Count'] / PLOT_AREA_M2, 
+            fig.add_trace(go.Scatter(x=b_counts['Year'], y=b_counts['Count'] / (geometry_control if use_control else geometry).area_m2, 
                                     name=f"Density {plotB}", mode='lines+markers'), row=1, col=1)
 
             a_ba = stats_a['basal_area_df'].sort_values('Year')
@@ -350,6 +610,19 @@ if uploaded_file is not None and df is not None:
             fig.add_trace(go.Scatter(x=b_ba['Year'], y=b_ba['BasalArea_m2'], 
                                     name=f"Basal area - {plotB}", mode='lines+markers'), row=2, col=1)
 
+            # Canopy cover is computed for every plot of a dataset at once and memoized
+            df_b = df_control if use_control and df_control is not None else df
+            geometry_b = geometry_control if use_control and geometry_control is not None else geometry
+            id_a = plotA.replace(" - ", "-") if has_plots_subplots and " - " in plotA else plotA
+            id_b = plotB.replace(" - ", "-") if (has_control_plots_subplots if use_control else has_plots_subplots) and " - " in plotB else plotB
+            for label, data, plot_geometry, plot_id in ((plotA, df, geometry, id_a), (plotB, df_b, geometry_b, id_b)):
+                canopy = cached_canopy_cover(data, geometry=tuple(plot_geometry))
+                cover = canopy[(canopy[PLOTID_COL] == plot_id) & (canopy[CROWN_COL] == ALL_CLASSES)].sort_values('Year')
+                fig.add_trace(go.Scatter(x=cover['Year'], y=cover['Cover'],
+                                        name=f"Canopy cover - {label}", mode='lines+markers'), row=3, col=1)
+                fig.add_trace(go.Scatter(x=cover['Year'], y=cover['Overlap'], line=dict(dash='dot'),
+                                        name=f"Crown overlap - {label}", mode='lines+markers'), row=3, col=1)
+
             species_mapping = {s: colors[s] for s in (all_species if len(all_species) > 0 else df[SPECIES_COL].dropna().unique())}
 
             a_species = stats_a['species_df']
@@ -360,12 +633,12 @@ if uploaded_file is not None and df is not None:
             for sp in piv_a.columns:
                 fig.add_trace(go.Scatter(x=piv_a.index, y=piv_a[sp], name=str(sp), legendgroup=str(sp), 
                                         showlegend=True, stackgroup='one', mode='none', 
-                                        fillcolor=species_mapping.get(sp)), row=3, col=1)
+                                        fillcolor=species_mapping.get(sp)), row=4, col=1)
 
             for sp in piv_b.columns:
                 fig.add_trace(go.Scatter(x=piv_b.index, y=piv_b[sp], name=str(sp), legendgroup=str(sp), 
                                         showlegend=False, stackgroup='two', mode='none', 
-                                        fillcolor=species_mapping.get(sp)), row=3, col=2)
+                                        fillcolor=species_mapping.get(sp)), row=4, col=2)
 
             status_mapping = {s: colors[s] for s in (all_status if len(all_status) > 0 else df[STATUS_COL].dropna().unique())}
 
@@ -378,30 +651,20 @@ if uploaded_file is not None and df is not None:
             for ap in piv_as.columns:
                 fig.add_trace(go.Scatter(x=piv_as.index, y=piv_as[ap], name=str(ap), legendgroup=str(ap), 
                                         showlegend=False, stackgroup='one', mode='none', 
-                                        fillcolor=status_mapping.get(ap)), row=4, col=1)
+                                        fillcolor=status_mapping.get(ap)), row=5, col=1)
 
             for ap in piv_bs.columns:
                 fig.add_trace(go.Scatter(x=piv_bs.index, y=piv_bs[ap], name=str(ap), legendgroup=str(ap), 
                                         showlegend=False, stackgroup='two', mode='none', 
-                                        fillcolor=status_mapping.get(ap)), row=4, col=2)
+                                        fillcolor=status_mapping.get(ap)), row=5, col=2)
                 
 
             fig.update_layout(title_text=f"Comparison Statistics: Plot {plotA} vs {plotB}", height=1000, showlegend=True)
-            fig.update_xaxes(title_text='Year', row=3, col=1)
-            fig.update_xaxes(title_text='Year', row=3, col=2)
+            fig.update_xaxes(title_text='Year', row=4, col=1)
+            fig.update_xaxes(title_text='Year', row=4, col=2)
             fig.update_yaxes(title_text='Count (per m²)', row=1, col=1)
             fig.update_yaxes(title_text='Basal area (m²)', row=2, col=1)
-
-            if subset1 is not None and subset2 is not None:
-                all_dbh = list(subset1[DIAMETER_COL].dropna().values) + list(subset2[DIAMETER_COL].dropna().values)
-                if len(all_dbh) > 0:
-                    bins = np.histogram_bin_edges(all_dbh, bins='auto')
-                    fig.add_trace(go.Histogram(x=subset1[DIAMETER_COL], name=f"{DIAMETER_COL} {plotA}", 
-                                              nbinsx=len(bins)-1, marker_color='rgba(31,119,180,0.6)', opacity=0.7), row=5, col=1)
-                    fig.add_trace(go.Histogram(x=subset2[DIAMETER_COL], name=f"{DIAMETER_COL} {plotB}", 
-                                              nbinsx=len(bins)-1, marker_color='rgba(255,127,14,0.6)', opacity=0.7), row=5, col=1)
-                    fig.update_xaxes(title_text=f'{DIAMETER_COL} (cm)', row=5, col=1)
-                    fig.update_yaxes(title_text='Count', row=5, col=1)
+            fig.update_yaxes(title_text='Plot area (%)', row=3, col=1)
 
             st.plotly_chart(fig, use_container_width=True)
 
@@ -412,41 +675,41 @@ if uploaded_file is not None and df is not None:
             
             if has_plots_subplots:
                 plotA_id = plotA.replace(" - ", "-") if " - " in plotA else plotA
-                div_a = diversity(df[df["PlotID"] == plotA_id])
+                div_a = cached_diversity(df, plotA_id)
             else:
-                div_a = diversity(df[df[PLOTID_COL] == plotA])
+                div_a = cached_diversity(df, plotA)
             
             if use_control and has_control_plots_subplots:
                 plotB_id = plotB.replace(" - ", "-") if " - " in plotB else plotB
-                div_b = diversity(df_control[df_control["PlotID"] == plotB_id])
+                div_b = cached_diversity(df_control, plotB_id)
             elif use_control:
                 df_b = df_control if df_control is not None else df
-                div_b = diversity(df_b[df_b[PLOTID_COL] == plotB])
+                div_b = cached_diversity(df_b, plotB)
             else:
                 if has_plots_subplots:
                     plotB_id = plotB.replace(" - ", "-") if " - " in plotB else plotB
-                    div_b = diversity(df[df["PlotID"] == plotB_id])
+                    div_b = cached_diversity(df, plotB_id)
                 else:
-                    div_b = diversity(df[df[PLOTID_COL] == plotB])
+                    div_b = cached_diversity(df, plotB)
 
             if has_plots_subplots:
                 plotA_id = plotA.replace(" - ", "-") if " - " in plotA else plotA
-                inc_a = compute_dbh_increments(df, plotA_id)
+                inc_a = cached_dbh_increments(df, plotA_id, id_col=MATCHED_ID_COL)
             else:
-                inc_a = compute_dbh_increments(df, plotA)
+                inc_a = cached_dbh_increments(df, plotA, id_col=MATCHED_ID_COL)
             
             if use_control and has_control_plots_subplots:
                 plotB_id = plotB.replace(" - ", "-") if " - " in plotB else plotB
-                inc_b = compute_dbh_increments(df_control, plotB_id)
+                inc_b = cached_dbh_increments(df_control, plotB_id, id_col=MATCHED_ID_COL)
             elif use_control:
                 df_b = df_control if df_control is not None else df
-                inc_b = compute_dbh_increments(df_b, plotB)
+                inc_b = cached_dbh_increments(df_b, plotB, id_col=MATCHED_ID_COL)
             else:
                 if has_plots_subplots:
                     plotB_id = plotB.replace(" - ", "-") if " - " in plotB else plotB
-                    inc_b = compute_dbh_increments(df, plotB_id)
+                    inc_b = cached_dbh_increments(df, plotB_id, id_col=MATCHED_ID_COL)
                 else:
-                    inc_b = compute_dbh_increments(df, plotB)
+                    inc_b = cached_dbh_increments(df, plotB, id_col=MATCHED_ID_COL)
             
             mean_inc_a = np.nanmean(inc_a) if inc_a is not None and len(inc_a) > 0 else 0
             mean_inc_b = np.nanmean(inc_b) if inc_b is not None and len(inc_b) > 0 else 0
@@ -463,27 +726,13 @@ if uploaded_file is not None and df is not None:
                 st.metric(label=f"Species richness ({plotB})", value=f"{div_b}")
                 st.metric(label=f"Mean {DIAMETER_COL} increment ({plotB})", value=f"{mean_inc_b:.2f} cm/yr")
 
-col1, col2, col3 = st.columns([1,2,1])
-with col1:
-    if uploaded_file is not None:
-        try:
-            if year1 is not None and 'wn' in locals():
-                with open(wn, "rb") as img:
-                    st.download_button(
-                        label="Download Figure 1",
-                        data=img,
-                        file_name=wn,
-                        mime="image/png",
-                        key="compare_download"
-                    )
-            if year2 is not None and 'rn' in locals():
-                with open(rn, "rb") as img:
-                    st.download_button(
-                        label="Download Figure 2",
-                        data=img,
-                        file_name=rn,
-                        mime="image/png",
-                        key="comp_download"
-                    )
-        except:
-            pass
+            with st.expander("Species rarefaction", expanded=False):
+                rarefaction_panel([(plotA, df[df[PLOTID_COL] == id_a]), (plotB, df_b[df_b[PLOTID_COL] == id_b])])
+
+            with st.expander("Basal area projection", expanded=False):
+                convert_b = has_control_plots_subplots if use_control else has_plots_subplots
+                projection_panel([
+                    (plotA, df, plotA.replace(" - ", "-") if has_plots_subplots and " - " in str(plotA) else plotA),
+                    (plotB, df_control if use_control and df_control is not None else df,
+                     plotB.replace(" - ", "-") if convert_b and " - " in str(plotB) else plotB),
+                ])
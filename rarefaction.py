@@ -0,0 +1,196 @@
+"""Individual-based species rarefaction and accumulation curves.
+
+Raw richness grows with the number of stems counted, so plots of different
+size or stem density are compared at a common number of individuals instead.
+The rarefaction curve E[S_n] and its variance are exact (Hurlbert 1971,
+Heck et al. 1975), evaluated with log-gamma binomials for all sample sizes and
+species at once. Accumulation curves come from random orderings of the stems:
+each batch of permutations is one (permutations, stems) rank matrix, from which
+the first appearance of every species and the running species count follow by
+vectorized reductions. Groups can be spread over worker processes.
+"""
+import multiprocessing
+from statistics import NormalDist
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from scipy.special import gammaln
+
+from caching import memoize
+from config import (
+    SPECIES_COL, PLOTID_COL, YEAR_COL, TREATMENT_COL, RENDER_START_METHOD,
+    RAREFACTION_POINTS, RAREFACTION_PERMUTATIONS, RAREFACTION_BATCH_CELLS, RAREFACTION_CONFIDENCE,
+    RAREFACTION_SEED, RAREFACTION_WORKERS
+)
+
+CURVE_COLUMNS = ["Individuals", "Expected", "Lower", "Upper"]
+RAREFACTION_METHODS = ["analytic", "permutation"]
+
+
+def default_groups(df: pd.DataFrame) -> Tuple[str, ...]:
+    """Plot and census year, plus treatment when the data has one."""
+    return (PLOTID_COL, YEAR_COL, TREATMENT_COL) if TREATMENT_COL in df.columns else (PLOTID_COL, YEAR_COL)
+
+
+def sample_sizes(total: int, points: int = RAREFACTION_POINTS) -> np.ndarray:
+    """Up to `points` distinct sample sizes from 1 to total."""
+    if total < 1:
+        return np.array([], dtype=int)
+    return np.unique(np.linspace(1, total, min(points, total)).round().astype(int))
+
+
+def _log_choose(log_factorial: np.ndarray, a: np.ndarray, n: np.ndarray) -> np.ndarray:
+    # log C(a, n) from a table of log k!, -inf where a < n so that exp() gives 0
+    valid = a >= n
+    out = log_factorial[a] - log_factorial[n] - log_factorial[np.where(valid, a - n, 0)]
+    return np.where(valid, out, -np.inf)
+
+
+def _rarefy(abundances: np.ndarray, sizes: Optional[np.ndarray], confidence: float) -> Tuple[np.ndarray, ...]:
+    counts = np.asarray(abundances, dtype=int)
+    counts = counts[counts > 0]
+    total = int(counts.sum())
+    n = sample_sizes(total) if sizes is None else np.asarray(sizes, dtype=int)
+    if len(n) == 0:
+        return n, np.array([]), np.array([]), np.array([])
+
+    log_factorial = gammaln(np.arange(total + 1) + 1.0)
+    nn = n[:, None]
+    log_all = _log_choose(log_factorial, np.full_like(nn, total), nn)
+    # q_i: chance that species i is missing from a subsample of n
+    q = np.exp(_log_choose(log_factorial, total - counts[None], nn) - log_all)
+    expected = (1 - q).sum(axis=1)
+    # Heck et al. (1975): Var = sum q_i(1 - q_i) + 2 sum_{i<j} (q_ij - q_i q_j)
+    pair = total - counts[:, None] - counts[None, :]
+    q_pair = np.exp(_log_choose(log_factorial, np.clip(pair, 0, None)[None], nn[:, :, None]) - log_all[:, :, None])
+    cov = q_pair - q[:, :, None] * q[:, None, :]
+    upper_pairs = np.triu(np.ones((len(counts), len(counts)), dtype=bool), k=1)
+    variance = (q * (1 - q)).sum(axis=1) + 2 * cov[:, upper_pairs].sum(axis=1)
+
+    half = NormalDist().inv_cdf(0.5 + confidence / 2) * np.sqrt(np.clip(variance, 0, None))
+    return n, expected, np.clip(expected - half, 1, len(counts)), np.clip(expected + half, 1, len(counts))
+
+
+def rarefaction_curve(abundances: np.ndarray, sizes: Optional[np.ndarray] = None,
+                      confidence: float = RAREFACTION_CONFIDENCE) -> pd.DataFrame:
+    """Expected species in random subsamples of n stems, with a normal confidence band.
+
+    abundances holds the stem count of each species. Returns CURVE_COLUMNS with
+    one row per sample size.
+    """
+    return pd.DataFrame(dict(zip(CURVE_COLUMNS, _rarefy(abundances, sizes, confidence))), columns=CURVE_COLUMNS)
+
+
+def accumulation_counts(codes: np.ndarray, permutations: int = RAREFACTION_PERMUTATIONS,
+                        seed=RAREFACTION_SEED) -> np.ndarray:
+    """Species seen after the first k stems, for random orderings of the stems.
+
+    codes holds a species code (0..S-1) per stem. Returns a (permutations, stems)
+    array whose column k-1 is the count after k stems.
+    """
+    codes = np.asarray(codes)
+    n, n_species = len(codes), int(codes.max()) + 1 if len(codes) else 0
+    if n == 0:
+        return np.zeros((permutations, 0), dtype=int)
+    rng = np.random.default_rng(seed)
+    # Stems grouped by species, so each species' first appearance is one reduceat
+    order = np.argsort(codes, kind='stable')
+    starts = np.searchsorted(codes[order], np.arange(n_species))
+    present = np.bincount(codes, minlength=n_species) > 0
+
+    curves = np.empty((permutations, n), dtype=np.int32)
+    batch = max(RAREFACTION_BATCH_CELLS // n, 1)
+    for first in range(0, permutations, batch):
+        rows = min(batch, permutations - first)
+        # Row p gives each stem its position in ordering p
+        ranks = rng.permuted(np.broadcast_to(np.arange(n), (rows, n)), axis=1)
+        first_seen = np.minimum.reduceat(ranks[:, order], starts[present], axis=1)
+        offsets = (np.arange(rows) * n)[:, None]
+        new = np.bincount((first_seen + offsets).ravel(), minlength=rows * n).reshape(rows, n)
+        curves[first:first + rows] = np.cumsum(new, axis=1)
+    return curves
+
+
+def _accumulate(codes: np.ndarray, sizes: Optional[np.ndarray], permutations: int, seed,
+                confidence: float) -> Tuple[np.ndarray, ...]:
+    curves = accumulation_counts(codes, permutations, seed)
+    n = sample_sizes(curves.shape[1]) if sizes is None else np.asarray(sizes, dtype=int)
+    if len(n) == 0:
+        return n, np.array([]), np.array([]), np.array([])
+    at = curves[:, n - 1]
+    tail = 100 * (1 - confidence) / 2
+    lower, upper = np.percentile(at, [tail, 100 - tail], axis=0)
+    return n, at.mean(axis=0), lower, upper
+
+
+def accumulation_curve(codes: np.ndarray, sizes: Optional[np.ndarray] = None,
+                       permutations: int = RAREFACTION_PERMUTATIONS, seed=RAREFACTION_SEED,
+                       confidence: float = RAREFACTION_CONFIDENCE) -> pd.DataFrame:
+    """Mean species accumulation over random stem orderings with a percentile band.
+
+    Returns CURVE_COLUMNS with one row per sample size.
+    """
+    return pd.DataFrame(dict(zip(CURVE_COLUMNS, _accumulate(codes, sizes, permutations, seed, confidence))),
+                        columns=CURVE_COLUMNS)
+
+
+def _group_curves(tasks: List[Tuple[np.ndarray, np.random.SeedSequence]], method: str, permutations: int,
+                  confidence: float) -> List[Tuple[np.ndarray, ...]]:
+    if method == "analytic":
+        return [_rarefy(np.bincount(codes), None, confidence) for codes, _ in tasks]
+    return [_accumulate(codes, None, permutations, seed, confidence) for codes, seed in tasks]
+
+
+def rarefaction_table(df: pd.DataFrame, by: Optional[Sequence[str]] = None, method: str = "analytic",
+                      permutations: int = RAREFACTION_PERMUTATIONS, seed: int = RAREFACTION_SEED,
+                      workers: int = RAREFACTION_WORKERS, confidence: float = RAREFACTION_CONFIDENCE) -> pd.DataFrame:
+    """Rarefaction (method="analytic") or accumulation ("permutation") curves per group.
+
+    by defaults to default_groups(df). Returns the grouping columns, CURVE_COLUMNS
+    and Observed (the group's species richness). With workers > 0, groups are
+    split across that many processes. Permutation results depend only on seed,
+    not on how the work is split.
+    """
+    if method not in RAREFACTION_METHODS:
+        raise ValueError(f"Unknown rarefaction method '{method}'. Choose from {RAREFACTION_METHODS}")
+    by = list(default_groups(df) if by is None else by)
+    missing = [c for c in [SPECIES_COL, *by] if c not in df.columns]
+    if missing:
+        raise ValueError(f"DataFrame must contain {missing} for rarefaction")
+
+    stems = df[[*by, SPECIES_COL]].dropna()
+    codes = pd.factorize(stems[SPECIES_COL])[0]
+    groups = stems.groupby(by, sort=True).indices
+    keys = list(groups)
+    seeds = np.random.SeedSequence(seed).spawn(len(keys))
+    tasks = []
+    for key, seed_seq in zip(keys, seeds):
+        # Recode species within the group so codes run 0..S-1
+        tasks.append((pd.factorize(codes[groups[key]])[0], seed_seq))
+
+    if workers > 0 and len(tasks) > 1:
+        chunks = [tasks[i::workers] for i in range(workers)]
+        with ProcessPoolExecutor(max_workers=workers,
+                                 mp_context=multiprocessing.get_context(RENDER_START_METHOD)) as pool:
+            parts = list(pool.map(_group_curves, chunks, [method] * workers, [permutations] * workers,
+                                  [confidence] * workers))
+        curves = [None] * len(tasks)
+        for i, part in enumerate(parts):
+            curves[i::workers] = part
+    else:
+        curves = _group_curves(tasks, method, permutations, confidence)
+
+    if not tasks:
+        return pd.DataFrame(columns=[*by, *CURVE_COLUMNS, "Observed"])
+    # One frame for all groups: curve columns concatenated, group keys repeated per row
+    lengths = [len(curve[0]) for curve in curves]
+    table = pd.DataFrame(keys, columns=by) if len(by) > 1 else pd.DataFrame({by[0]: keys})
+    table["Observed"] = [int(group_codes.max()) + 1 for group_codes, _ in tasks]
+    table = table.loc[np.repeat(np.arange(len(keys)), lengths)].reset_index(drop=True)
+    for i, column in enumerate(CURVE_COLUMNS):
+        table[column] = np.concatenate([curve[i] for curve in curves])
+    return table[[*by, *CURVE_COLUMNS, "Observed"]]
+
+cached_rarefaction_table = memoize(name="rarefaction_table")(rarefaction_table)
@@ -0,0 +1,142 @@
+"""Kernel-smoothed stem-density and basal-area surfaces on a grid over each plot.
+
+Stems of one plot census are binned onto a fine grid (np.bincount) and smoothed
+with a Gaussian kernel by FFT convolution. Each surface is divided by the
+share of the kernel that falls inside the plot, so cells near the edge are not
+biased low. Groups (species, status) are stacked on one axis and convolved in a
+single call, so every group's surface costs about as much as one.
+"""
+from typing import Dict, NamedTuple, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from matplotlib.colors import TwoSlopeNorm
+from matplotlib.figure import Figure
+from scipy.signal import fftconvolve
+
+from caching import memoize
+from config import (
+    DIAMETER_COL, PLOTID_COL, YEAR_COL, PLOT_SIZE_METERS, KERNEL_BANDWIDTH_M, KERNEL_CELL_M,
+    MATPLOTLIB_FIGSIZE_SQUARE
+)
+
+SURFACE_MEASURES = {"density": "Stems/ha", "basal_area": "Basal area (m²/ha)"}
+ALL_STEMS = "All stems"
+
+
+class Surface(NamedTuple):
+    """A raster over a plot: values[row, col] with row 0 at the low-y edge."""
+    values: np.ndarray
+    extent: Tuple[float, float, float, float]
+    label: str
+
+
+def _grid_shape(geometry: Tuple[float, float], cell: float) -> Tuple[int, int]:
+    width, length = geometry
+    return max(int(np.ceil(length / cell)), 1), max(int(np.ceil(width / cell)), 1)
+
+
+def _gaussian_kernel(bandwidth: float, cell: float) -> np.ndarray:
+    # Truncated at three bandwidths and normalised to sum to one
+    radius = max(int(np.ceil(3 * bandwidth / cell)), 1)
+    offsets = np.arange(-radius, radius + 1) * cell
+    profile = np.exp(-0.5 * (offsets / bandwidth) ** 2)
+    kernel = np.outer(profile, profile)
+    return kernel / kernel.sum()
+
+
+def _edge_correction(shape: Tuple[int, int], kernel: np.ndarray) -> np.ndarray:
+    """Share of the kernel centred on each cell that lies inside the plot."""
+    inside = fftconvolve(np.ones(shape), kernel, mode='same')
+    return np.clip(inside, 1e-12, None)
+
+
+def _bin(x: np.ndarray, y: np.ndarray, layer: np.ndarray, weights: np.ndarray, n_layers: int,
+         shape: Tuple[int, int], cell: float) -> np.ndarray:
+    ny, nx = shape
+    ix = np.clip((x / cell).astype(int), 0, nx - 1)
+    iy = np.clip((y / cell).astype(int), 0, ny - 1)
+    flat = (layer * ny + iy) * nx + ix
+    return np.bincount(flat, weights=weights, minlength=n_layers * ny * nx).reshape(n_layers, ny, nx)
+
+
+def smooth(stack: np.ndarray, bandwidth: float, cell: float) -> np.ndarray:
+    """Kernel-smooth and edge-correct a (layers, ny, nx) stack of per-cell totals.
+
+    Returns per-hectare values.
+    """
+    kernel = _gaussian_kernel(bandwidth, cell)
+    smoothed = fftconvolve(stack, kernel[None], mode='same', axes=(1, 2))
+    smoothed = np.clip(smoothed, 0, None) / _edge_correction(stack.shape[1:], kernel)[None]
+    return smoothed * (10000.0 / (cell * cell))
+
+
+def _stem_values(df: pd.DataFrame, measure: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    if measure not in SURFACE_MEASURES:
+        raise ValueError(f"Unknown surface measure '{measure}'. Choose from {list(SURFACE_MEASURES)}")
+    x = pd.to_numeric(df["X"], errors='coerce').to_numpy(dtype=float)
+    y = pd.to_numeric(df["Y"], errors='coerce').to_numpy(dtype=float)
+    dbh = pd.to_numeric(df[DIAMETER_COL], errors='coerce').to_numpy(dtype=float)
+    keep = np.isfinite(x) & np.isfinite(y)
+    if measure == "basal_area":
+        keep &= np.isfinite(dbh)
+        weights = np.pi * (dbh / 200.0) ** 2
+    else:
+        weights = np.ones(len(df))
+    return x, y, weights, keep
+
+
+def kernel_surfaces(df: pd.DataFrame, plot_id, year, measure: str = "density", by: Optional[str] = None,
+                    bandwidth: float = KERNEL_BANDWIDTH_M, cell: float = KERNEL_CELL_M,
+                    geometry: Tuple[float, float] = (PLOT_SIZE_METERS, PLOT_SIZE_METERS)) -> Dict[str, Surface]:
+    """Smoothed density or basal-area surfaces for one plot census.
+
+    Returns {group: Surface}, with one surface per label of `by` plus ALL_STEMS;
+    by=None gives only ALL_STEMS.
+    """
+    rows = df[(df[PLOTID_COL] == plot_id) & (df[YEAR_COL] == year)]
+    x, y, weights, keep = _stem_values(rows, measure)
+    if by is not None:
+        # Layer 0 collects stems without a group; it becomes ALL_STEMS below
+        codes, labels = pd.factorize(rows[by], sort=True)
+        layer = codes + 1
+        names = [ALL_STEMS] + [str(label) for label in labels]
+    else:
+        layer = np.zeros(len(rows), dtype=int)
+        names = [ALL_STEMS]
+
+    shape = _grid_shape(geometry, cell)
+    stack = _bin(x[keep], y[keep], layer[keep], weights[keep], len(names), shape, cell)
+    stack[0] = stack.sum(axis=0)  # the ALL_STEMS layer holds every stem
+    surfaces = smooth(stack, bandwidth, cell)
+    extent = (0.0, shape[1] * cell, 0.0, shape[0] * cell)
+    return {name: Surface(surfaces[i], extent, SURFACE_MEASURES[measure]) for i, name in enumerate(names)}
+
+
+cached_kernel_surfaces = memoize(name="kernel_surfaces")(kernel_surfaces)
+
+
+def difference_surface(before: Surface, after: Surface) -> Surface:
+    """after - before, e.g. the change in density between two censuses."""
+    return Surface(after.values - before.values, after.extent, f"Change in {after.label}")
+
+
+def surface_figure(surface: Surface, title: str, stems: Optional[pd.DataFrame] = None) -> Figure:
+    """Draw a surface on its own; difference surfaces get a diverging colour scale
+    centred on zero. Stem positions, if given, are drawn as small dots."""
+    fig = Figure(figsize=MATPLOTLIB_FIGSIZE_SQUARE)
+    ax = fig.add_subplot()
+    values = surface.values
+    if surface.label.startswith("Change"):
+        bound = max(np.abs(values).max(), 1e-9)
+        im = ax.imshow(values, extent=surface.extent, origin='lower', cmap='RdBu_r',
+                       norm=TwoSlopeNorm(0, -bound, bound), interpolation='bilinear')
+    else:
+        im = ax.imshow(values, extent=surface.extent, origin='lower', cmap='viridis', interpolation='bilinear')
+    if stems is not None and not stems.empty:
+        ax.scatter(stems["X"], stems["Y"], s=3, c='k', alpha=0.5)
+    fig.colorbar(im, ax=ax, label=surface.label)
+    ax.set_xlabel('Meters (x)')
+    ax.set_ylabel('Meters (y)')
+    ax.set_title(title)
+    return fig
@@ -0,0 +1,237 @@
+"""Process pool that renders stem maps to PNG bytes off the Streamlit script thread.
+
+A render request is a StemMapSpec: the stem arrays for one plot-year plus the
+grouping, the colour of each group present, its legend label and the frame,
+level of detail and zoom window to draw. Specs are plain picklable data, so
+workers (separate processes on the Agg backend) never share matplotlib state with
+the app or with each other. Identical requests are deduplicated: one that is
+already rendered is served from a PNG cache, and one still in flight shares the
+pending future.
+"""
+import atexit
+import hashlib
+import io
+import multiprocessing
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from caching import LRUCache
+from config import (
+    DIAMETER_COL, SPECIES_COL, STATUS_COL, YEAR_COL,
+    RENDER_WORKERS, RENDER_START_METHOD, RENDER_TIMEOUT_SECONDS, RENDER_DPI, PNG_CACHE_SIZE
+)
+from raster import Surface
+from tree_plots import PlotGeometry, View, load_species_dict, load_status_dict, stem_map_figure
+
+
+class StemMapSpec(NamedTuple):
+    """Everything needed to draw one stem map, as picklable arrays and tuples."""
+    x: np.ndarray
+    y: np.ndarray
+    dbh: np.ndarray
+    groups: Optional[np.ndarray]
+    plotting_group: Optional[str]
+    year: Any
+    colors: Tuple[Tuple[Any, str], ...]
+    names: Tuple[Tuple[Any, str], ...]
+    geometry: Tuple[float, float] = tuple(PlotGeometry())
+    lod: str = "auto"
+    view: Optional[View] = None
+    overlay: Optional[Surface] = None
+    dpi: int = RENDER_DPI
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, species_colors: Dict, plotting_group: Optional[str], year,
+                   species_dict: Optional[Dict[str, str]] = None, status_dict: Optional[Dict[str, str]] = None,
+                   geometry: Optional[PlotGeometry] = None, lod: str = "auto", view: Optional[View] = None,
+                   overlay: Optional[Surface] = None, dpi: int = RENDER_DPI) -> "StemMapSpec":
+        """Extract the rows of one year and the styling they need from a stem frame.
+
+        Raises ValueError for the same missing-column cases as stem_map_figure().
+        """
+        if YEAR_COL not in df.columns:
+            raise ValueError(f"DataFrame must contain '{YEAR_COL}' column")
+        if plotting_group is not None and plotting_group not in df.columns:
+            raise ValueError(f"DataFrame must contain '{plotting_group}' column")
+        try:
+            year_value = int(year)
+        except Exception:
+            year_value = year
+        rows = df[df[YEAR_COL] == year_value]
+
+        def column(name):
+            return pd.to_numeric(rows[name], errors='coerce').to_numpy(dtype=float)
+
+        groups, colors, names = None, (), ()
+        if plotting_group is not None:
+            groups = np.asarray(rows[plotting_group], dtype=object)
+            present = [g for g in pd.unique(groups) if pd.notna(g)]
+            # Resolve colours here: species_colors may be a defaultdict that
+            # hands out new colours on lookup, which a worker cannot share
+            colors = tuple((g, species_colors[g]) for g in present)
+            lookup = {SPECIES_COL: species_dict, STATUS_COL: status_dict}.get(plotting_group) or {}
+            names = tuple((g, lookup[g]) for g in present if g in lookup)
+        return cls(column("X"), column("Y"), column(DIAMETER_COL), groups, plotting_group, year_value,
+                   colors, names, tuple(geometry or PlotGeometry()), lod, view, overlay, dpi)
+
+    def key(self) -> str:
+        """Content hash used to deduplicate identical requests."""
+        h = hashlib.sha1()
+        for a in (self.x, self.y, self.dbh):
+            h.update(a.tobytes())
+        if self.groups is not None:
+            h.update(pd.util.hash_array(self.groups.astype(str)).tobytes())
+        if self.overlay is not None:
+            h.update(self.overlay.values.tobytes())
+            h.update(repr((self.overlay.extent, self.overlay.label)).encode())
+        h.update(repr((self.plotting_group, str(self.year), self.colors, self.names,
+                       self.geometry, self.lod, self.view, self.dpi)).encode())
+        return h.hexdigest()
+
+
+def render_png(spec: StemMapSpec) -> bytes:
+    """Draw a spec with stem_map_figure() and return PNG bytes. Runs in a worker."""
+    data = {"X": spec.x, "Y": spec.y, DIAMETER_COL: spec.dbh, YEAR_COL: spec.year}
+    if spec.plotting_group is not None:
+        data[spec.plotting_group] = spec.groups
+    names = dict(spec.names)
+    species_dict = names if spec.plotting_group == SPECIES_COL else {}
+    status_dict = names if spec.plotting_group == STATUS_COL else {}
+    fig = stem_map_figure(pd.DataFrame(data), dict(spec.colors), spec.plotting_group, spec.year,
+                          species_dict, status_dict, PlotGeometry(*spec.geometry), spec.lod, spec.view, spec.overlay)
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png', dpi=spec.dpi, bbox_inches='tight')
+    return buf.getvalue()
+
+
+def _init_worker() -> None:
+    import matplotlib
+    matplotlib.use("Agg", force=True)
+
+
+class RenderPool:
+    """Queue of stem-map renders served by a pool of worker processes.
+
+    With workers=0, or if the pool cannot start or breaks, renders run in the
+    calling thread instead.
+    """
+
+    def __init__(self, workers: int = RENDER_WORKERS, start_method: str = RENDER_START_METHOD):
+        self.workers = workers
+        self.start_method = start_method
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._pending: Dict[str, Future] = {}
+        self._cache = LRUCache(maxsize=PNG_CACHE_SIZE, name="png")
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> Optional[ProcessPoolExecutor]:
+        if self.workers <= 0:
+            return None
+        if self._executor is None:
+            try:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                                     mp_context=multiprocessing.get_context(self.start_method))
+            except (OSError, ValueError):
+                self.workers = 0
+        return self._executor
+
+    def submit(self, spec: StemMapSpec, key: Optional[str] = None) -> Future:
+        """Future resolving to the PNG bytes for spec, shared with identical requests."""
+        key = key or spec.key()
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                future = Future()
+                future.set_result(cached)
+                return future
+            if key in self._pending:
+                return self._pending[key]
+
+            executor = self._get_executor()
+            future = None
+            if executor is not None:
+                try:
+                    future = executor.submit(render_png, spec)
+                except (BrokenProcessPool, RuntimeError):
+                    self._executor = None
+            in_process = future is None
+            if in_process:
+                future = Future()
+                future.set_running_or_notify_cancel()
+            self._pending[key] = future
+        future.add_done_callback(lambda f, k=key: self._finish(k, f))
+        if in_process:
+            # Drawn outside the lock so other callers are not queued behind it;
+            # identical requests meanwhile wait on the pending future
+            try:
+                future.set_result(render_png(spec))
+            except Exception as e:
+                future.set_exception(e)
+        return future
+
+    def _finish(self, key: str, future: Future) -> None:
+        with self._lock:
+            self._pending.pop(key, None)
+            if not future.cancelled() and future.exception() is None:
+                self._cache.put(key, future.result())
+
+    def render(self, spec: StemMapSpec, timeout: Optional[float] = RENDER_TIMEOUT_SECONDS) -> bytes:
+        """Blocking render; re-raises errors from stem_map_figure() such as ValueError.
+
+        If the pool breaks, or no worker delivers within timeout, the map is drawn
+        in the calling thread instead.
+        """
+        key = spec.key()
+        try:
+            png = self.submit(spec, key).result(timeout=timeout)
+        except BrokenProcessPool:
+            # A worker died; drop the pool and draw this one in-process
+            with self._lock:
+                self._executor = None
+            return render_png(spec)
+        except TimeoutError:
+            # Workers are busy or stuck; the queued render still fills the cache if it finishes
+            return render_png(spec)
+        # _finish() may run on the pool's callback thread, possibly after this
+        # returns; storing here as well tags the entry with the calling session
+        self._cache.put(key, png)
+        return png
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+_pool: Optional[RenderPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_render_pool() -> RenderPool:
+    """The process-wide render pool, started on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = RenderPool()
+            atexit.register(_pool.shutdown)
+        return _pool
+
+
+def render_stem_map(df: pd.DataFrame, species_colors: Dict, plotting_group: Optional[str], year,
+                    species_dict: Optional[Dict[str, str]] = None, status_dict: Optional[Dict[str, str]] = None,
+                    geometry: Optional[PlotGeometry] = None, lod: str = "auto", view: Optional[View] = None,
+                    overlay: Optional[Surface] = None) -> bytes:
+    """PNG bytes of the stem map for one year, rendered by the shared pool."""
+    if species_dict is None:
+        species_dict = load_species_dict()
+    if status_dict is None:
+        status_dict = load_status_dict()
+    spec = StemMapSpec.from_frame(df, species_colors, plotting_group, year, species_dict, status_dict,
+                                  geometry, lod, view, overlay)
+    return get_render_pool().render(spec)
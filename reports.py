@@ -0,0 +1,272 @@
+"""Multi-page PDF/HTML reports covering every plot in a dataset.
+
+Reports are built by a ReportJob running in a background thread, so the Streamlit
+script can keep rerunning (and showing progress) while pages are rendered. All
+figures use the object-oriented matplotlib API, never pyplot, which keeps the
+worker thread from touching pyplot's global state. Every page is a fresh Figure
+that is cleared once written, so concurrent jobs never share one; what is cached
+is the finished file, keyed on the dataset and report settings.
+"""
+import base64
+import html
+import io
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from matplotlib.backends.backend_pdf import PdfPages
+from matplotlib.figure import Figure
+
+from caching import RENDER_CACHE, dataset_fingerprint, mapping_key
+from config import (
+    DIAMETER_COL, SPECIES_COL, STATUS_COL, PLOTID_COL, YEAR_COL, REPORT_FIGSIZE,
+    TREEID_COL, MATCHED_ID_COL
+)
+from tree_plots import (
+    PlotGeometry, assign_colors, infer_plot_geometry, load_species_dict, load_status_dict, stem_map_figure
+)
+from tree_statistics import cached_plot_year_stats, cached_dbh_increments, cached_diversity
+
+
+class ReportCancelled(Exception):
+    """Raised inside a report build when the job has been cancelled."""
+
+
+def _stacked_area(ax, df: pd.DataFrame, group_col: str, colors: Dict, title: str) -> None:
+    piv = df.pivot(index='Year', columns=group_col, values='Proportion').fillna(0).sort_index()
+    if piv.empty:
+        ax.set_axis_off()
+        return
+    ax.stackplot(piv.index.astype(float), piv.T.values,
+                 labels=[str(c) for c in piv.columns],
+                 colors=[colors[c] for c in piv.columns], alpha=0.85)
+    ax.set_title(title)
+    ax.set_xlabel('Year')
+    ax.set_ylim(0, 1)
+    ax.legend(fontsize='x-small', loc='upper left', bbox_to_anchor=(1.01, 1))
+
+
+def statistics_figure(stats: dict, plot_label: str, species_colors: Dict, status_colors: Dict,
+                      area_m2: float = PlotGeometry().area_m2) -> Figure:
+    """Density, basal area and composition charts for one plot on a single page."""
+    fig = Figure(figsize=REPORT_FIGSIZE)
+    axes = fig.subplots(2, 2)
+
+    counts = stats['counts_df'].sort_values('Year')
+    axes[0, 0].plot(counts['Year'], counts['Count'] / area_m2, marker='o')
+    axes[0, 0].set_title('Tree density over time')
+    axes[0, 0].set_ylabel('Count (per m²)')
+
+    ba = stats['basal_area_df'].sort_values('Year')
+    axes[0, 1].plot(ba['Year'], ba['BasalArea_m2'], marker='o', color='tab:orange')
+    axes[0, 1].set_title('Basal area (m²) over time')
+    axes[0, 1].set_ylabel('Basal area (m²)')
+
+    _stacked_area(axes[1, 0], stats['species_df'], SPECIES_COL, species_colors, 'Species composition')
+    _stacked_area(axes[1, 1], stats['status_df'], STATUS_COL, status_colors, 'Status composition')
+
+    fig.suptitle(f"Plot {plot_label}: statistics")
+    fig.tight_layout()
+    return fig
+
+
+def summary_figure(plot_df: pd.DataFrame, stats: dict, plot_label: str, area_m2: float = PlotGeometry().area_m2) -> Figure:
+    """Text page with the summary metrics shown on the Comparison page."""
+    counts = stats['counts_df'].sort_values('Year')
+    ba = stats['basal_area_df'].sort_values('Year')
+    id_col = MATCHED_ID_COL if MATCHED_ID_COL in plot_df.columns else TREEID_COL
+    increments = cached_dbh_increments(plot_df, None, id_col=id_col)
+    mean_inc = np.nanmean(increments) if increments is not None and len(increments) > 0 else 0
+
+    lines = [
+        f"Average trees: {counts['Count'].mean():.1f}",
+        f"Species richness: {cached_diversity(plot_df)}",
+        f"Mean {DIAMETER_COL}: {pd.to_numeric(plot_df[DIAMETER_COL], errors='coerce').mean():.2f} cm",
+        f"Mean {DIAMETER_COL} increment: {mean_inc:.2f} cm/yr",
+        "",
+        "Year    Trees    Density (/m²)    Basal area (m²)",
+    ]
+    merged = counts.merge(ba, on=['Year', 'PlotID'], how='left')
+    for _, row in merged.iterrows():
+        lines.append(f"{row['Year']:<8}{row['Count']:<9}{row['Count'] / area_m2:<17.3f}{row['BasalArea_m2']:.3f}")
+
+    fig = Figure(figsize=REPORT_FIGSIZE)
+    fig.text(0.08, 0.9, f"Plot {plot_label}", fontsize=20, weight='bold')
+    fig.text(0.08, 0.82, "\n".join(lines), fontsize=11, family='monospace', va='top')
+    return fig
+
+
+def report_pages(df: pd.DataFrame, plot_ids: Optional[List] = None, plotting_group: Optional[str] = SPECIES_COL,
+                 species_dict: Optional[Dict[str, str]] = None, status_dict: Optional[Dict[str, str]] = None,
+                 geometry: Optional[PlotGeometry] = None):
+    """Yield (title, Figure) for every page of the report, plot by plot.
+
+    Each Figure is new and owned by the caller, which should clear it once saved.
+
+    geometry is the dataset's plot frame; it is inferred from the coordinates if omitted.
+    """
+    if species_dict is None:
+        species_dict = load_species_dict()
+    if status_dict is None:
+        status_dict = load_status_dict()
+    if plot_ids is None:
+        plot_ids = sorted(df[PLOTID_COL].dropna().unique(), key=str)
+    if geometry is None:
+        geometry = infer_plot_geometry(df)
+
+    species_colors = assign_colors(df[SPECIES_COL].dropna().unique()) if SPECIES_COL in df.columns else assign_colors([])
+    status_colors = assign_colors(df[STATUS_COL].dropna().unique()) if STATUS_COL in df.columns else assign_colors([])
+    group_colors = status_colors if plotting_group == STATUS_COL else species_colors
+    if plotting_group not in (None, SPECIES_COL, STATUS_COL):
+        group_colors = assign_colors(df[plotting_group].dropna().unique())
+
+    for plot_id in plot_ids:
+        plot_df = df[df[PLOTID_COL] == plot_id]
+        if plot_df.empty:
+            continue
+        stats = cached_plot_year_stats(plot_df, plot_id)
+        if stats is None:
+            continue
+
+        yield f"Plot {plot_id}: summary", summary_figure(plot_df, stats, plot_id, geometry.area_m2)
+
+        for year in sorted(plot_df[YEAR_COL].dropna().unique()):
+            year_df = plot_df[plot_df[YEAR_COL] == year]
+            try:
+                fig = stem_map_figure(year_df, group_colors, plotting_group, year,
+                                      species_dict=species_dict, status_dict=status_dict, geometry=geometry)
+            except ValueError:
+                continue
+            yield f"Plot {plot_id}: stem map {year}", fig
+
+        yield f"Plot {plot_id}: statistics", statistics_figure(stats, plot_id, species_colors, status_colors,
+                                                              geometry.area_m2)
+
+
+def count_report_pages(df: pd.DataFrame, plot_ids: Optional[List] = None) -> int:
+    """Number of pages report_pages() will produce (an upper bound if rows are incomplete)."""
+    if plot_ids is not None:
+        df = df[df[PLOTID_COL].isin(plot_ids)]
+    years_per_plot = df.dropna(subset=[YEAR_COL]).groupby(PLOTID_COL)[YEAR_COL].nunique()
+    return int(years_per_plot.sum() + 2 * len(years_per_plot))
+
+
+def write_pdf(pages, out: io.BytesIO, on_page=None) -> None:
+    with PdfPages(out) as pdf:
+        for title, fig in pages:
+            pdf.savefig(fig)
+            fig.clear()
+            if on_page is not None:
+                on_page(title)
+
+
+def write_html(pages, out: io.BytesIO, on_page=None) -> None:
+    parts = ["<!DOCTYPE html><html><head><meta charset='utf-8'><title>Tree plot report</title></head><body>"]
+    for title, fig in pages:
+        buf = io.BytesIO()
+        fig.savefig(buf, format='png')
+        fig.clear()
+        encoded = base64.b64encode(buf.getvalue()).decode('ascii')
+        parts.append(f"<h2>{html.escape(title)}</h2><img src='data:image/png;base64,{encoded}'/>")
+        if on_page is not None:
+            on_page(title)
+    parts.append("</body></html>")
+    out.write("\n".join(parts).encode('utf-8'))
+
+
+def build_report(df: pd.DataFrame, fmt: str = "pdf", plot_ids: Optional[List] = None,
+                 plotting_group: Optional[str] = SPECIES_COL, on_page=None, **kwargs) -> bytes:
+    """Build the full report synchronously and return the file contents.
+
+    The file is cached in RENDER_CACHE, so an identical report is not rendered
+    again; on_page is only called when pages are actually rendered.
+    """
+    if fmt not in ("pdf", "html"):
+        raise ValueError(f"Unsupported report format: {fmt}")
+    geometry = kwargs.get("geometry")
+    key = ("report", dataset_fingerprint(df), fmt, None if plot_ids is None else tuple(map(str, plot_ids)),
+           plotting_group, mapping_key(kwargs.get("species_dict")), mapping_key(kwargs.get("status_dict")),
+           None if geometry is None else tuple(geometry))
+
+    def render() -> bytes:
+        out = io.BytesIO()
+        pages = report_pages(df, plot_ids, plotting_group, **kwargs)
+        writer = write_pdf if fmt == "pdf" else write_html
+        writer(pages, out, on_page=on_page)
+        return out.getvalue()
+
+    return RENDER_CACHE.get_or_create(key, render)
+
+
+class ReportJob:
+    """Build a report in a background thread with progress reporting and cancellation.
+
+    Typical use from a Streamlit page: create the job, call start(), keep it in
+    st.session_state and poll progress() on later reruns until done.
+    """
+
+    def __init__(self, df: pd.DataFrame, fmt: str = "pdf", plot_ids: Optional[List] = None,
+                 plotting_group: Optional[str] = SPECIES_COL, **kwargs):
+        self.df = df
+        self.fmt = fmt
+        self.plot_ids = plot_ids
+        self.plotting_group = plotting_group
+        self.kwargs = kwargs
+        self.total = max(count_report_pages(df, plot_ids), 1)
+        self.completed = 0
+        self.message = "Queued"
+        self.result: Optional[bytes] = None
+        self.error: Optional[str] = None
+        self._cancel = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="report-job", daemon=True)
+
+    def start(self) -> "ReportJob":
+        self._thread.start()
+        return self
+
+    def cancel(self) -> None:
+        self._cancel.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    @property
+    def running(self) -> bool:
+        return self._thread.is_alive()
+
+    @property
+    def done(self) -> bool:
+        return self._thread.ident is not None and not self._thread.is_alive()
+
+    def progress(self) -> Tuple[float, str]:
+        """Fraction complete (0-1) and a short status message."""
+        return min(self.completed / self.total, 1.0), self.message
+
+    @property
+    def file_name(self) -> str:
+        return f"tree_plot_report.{self.fmt}"
+
+    @property
+    def mime(self) -> str:
+        return "application/pdf" if self.fmt == "pdf" else "text/html"
+
+    def _on_page(self, title: str) -> None:
+        self.completed += 1
+        self.message = title
+        if self._cancel.is_set():
+            raise ReportCancelled()
+
+    def _run(self) -> None:
+        try:
+            self.message = "Rendering"
+            self.result = build_report(self.df, self.fmt, self.plot_ids, self.plotting_group,
+                                       on_page=self._on_page, **self.kwargs)
+            self.completed = self.total
+            self.message = "Finished"
+        except ReportCancelled:
+            self.message = "Cancelled"
+        except Exception as e:
+            self.error = str(e)
+            self.message = "Failed"
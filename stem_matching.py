@@ -0,0 +1,261 @@
+"""Link stems between consecutive censuses of a plot when tree IDs are unreliable.
+
+Stems whose StandardID appears once in both censuses are linked directly when the
+species agrees and the stem has not moved; the recorded DBH change is kept as
+measured, however large. Everything else (duplicate or conflicting IDs, untagged
+stems) is matched by nearest neighbour in X/Y, constrained to the same species
+and a plausible DBH change. Stems without a recorded species are never matched.
+All plots and census pairs are matched in one pass: each (census pair, species)
+block is pushed far apart along a third axis so a single KD-tree query never
+crosses blocks, and candidates are assigned with vectorized mutual-best rounds
+instead of Python loops.
+"""
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+from caching import LRUCache, dataset_fingerprint
+from config import (
+    DIAMETER_COL, SPECIES_COL, PLOTID_COL, TREEID_COL, YEAR_COL, X_COL, Y_COL, MATCHED_ID_COL,
+    MATCH_MAX_DISTANCE_M, MATCH_ID_MAX_DISTANCE_M, MATCH_MAX_DBH_SHRINK_CM,
+    MATCH_MAX_DBH_GROWTH_CM_PER_YEAR, MATCH_NEIGHBOURS
+)
+
+CROSSWALK_COLUMNS = [
+    PLOTID_COL, "YearFrom", "YearTo", "RowFrom", "RowTo", "IDFrom", "IDTo",
+    SPECIES_COL, "Distance", "DBHChange", "Method", "Confidence",
+]
+
+_crosswalk_cache = LRUCache(maxsize=8, name="crosswalk")
+
+
+def _stem_table(df: pd.DataFrame) -> pd.DataFrame:
+    """Numeric working copy of the columns needed for matching, one row per stem.
+
+    Stems missing a plot, year, position or species are left out.
+    """
+    tid = df[TREEID_COL] if TREEID_COL in df.columns else pd.Series(np.nan, index=df.index)
+    stems = pd.DataFrame({
+        "Row": np.arange(len(df)),
+        PLOTID_COL: df[PLOTID_COL].to_numpy(),
+        YEAR_COL: pd.to_numeric(df[YEAR_COL], errors="coerce").to_numpy(dtype=float),
+        SPECIES_COL: df[SPECIES_COL].to_numpy(),
+        TREEID_COL: tid.to_numpy(),
+        X_COL: pd.to_numeric(df[X_COL], errors="coerce").to_numpy(dtype=float),
+        Y_COL: pd.to_numeric(df[Y_COL], errors="coerce").to_numpy(dtype=float),
+        DIAMETER_COL: pd.to_numeric(df[DIAMETER_COL], errors="coerce").to_numpy(dtype=float),
+    })
+    stems = stems.dropna(subset=[PLOTID_COL, YEAR_COL, SPECIES_COL, X_COL, Y_COL])
+    # Species codes are compared as text, so 12 and "12" count as the same species
+    return stems.assign(**{SPECIES_COL: stems[SPECIES_COL].astype(str)})
+
+
+def _census_pairs(stems: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Split stems into 'from' and 'to' sides of every consecutive census pair.
+
+    A middle census appears on both sides (as 'to' for the previous pair and 'from'
+    for the next one); each copy carries the PairID it belongs to.
+    """
+    years = stems[[PLOTID_COL, YEAR_COL]].drop_duplicates().sort_values(YEAR_COL)
+    years["YearTo"] = years.groupby(PLOTID_COL, sort=False)[YEAR_COL].shift(-1)
+    pairs = years.dropna(subset=["YearTo"]).rename(columns={YEAR_COL: "YearFrom"})
+    pairs["PairID"] = np.arange(len(pairs))
+
+    src = stems.merge(pairs, left_on=[PLOTID_COL, YEAR_COL], right_on=[PLOTID_COL, "YearFrom"])
+    dst = stems.merge(pairs, left_on=[PLOTID_COL, YEAR_COL], right_on=[PLOTID_COL, "YearTo"])
+    return src.drop(columns=[YEAR_COL]), dst.drop(columns=[YEAR_COL])
+
+
+def _plausible(distance: np.ndarray, dbh_change: np.ndarray, years: np.ndarray, max_distance: float) -> np.ndarray:
+    max_growth = MATCH_MAX_DBH_GROWTH_CM_PER_YEAR * years
+    ok_dbh = np.isnan(dbh_change) | ((dbh_change >= -MATCH_MAX_DBH_SHRINK_CM) & (dbh_change <= max_growth))
+    return (distance <= max_distance) & ok_dbh
+
+
+def _match_cost(distance: np.ndarray, dbh_change: np.ndarray, years: np.ndarray, max_distance: float) -> np.ndarray:
+    """Cost in [0, 1] combining normalised distance and normalised DBH change."""
+    d = distance / max_distance
+    growth_limit = MATCH_MAX_DBH_GROWTH_CM_PER_YEAR * years
+    g = np.where(dbh_change < 0, -dbh_change / MATCH_MAX_DBH_SHRINK_CM, dbh_change / growth_limit)
+    g = np.nan_to_num(g, nan=0.5)
+    return np.sqrt((d ** 2 + np.clip(g, 0, 1) ** 2) / 2)
+
+
+def _id_matches(src: pd.DataFrame, dst: pd.DataFrame) -> pd.DataFrame:
+    """Pairs sharing a unique StandardID within a census pair, same species and position.
+
+    DBH change is not checked here: a large measured change on a tagged tree is
+    data, not evidence of a different stem.
+    """
+    def unique_ids(side):
+        tagged = side.dropna(subset=[TREEID_COL])
+        return tagged[~tagged.duplicated(["PairID", TREEID_COL], keep=False)]
+
+    m = unique_ids(src).merge(unique_ids(dst), on=["PairID", TREEID_COL], suffixes=("From", "To"))
+    distance = np.hypot(m[X_COL + "To"] - m[X_COL + "From"], m[Y_COL + "To"] - m[Y_COL + "From"]).to_numpy()
+    keep = (distance <= MATCH_ID_MAX_DISTANCE_M) & (m[SPECIES_COL + "From"] == m[SPECIES_COL + "To"]).to_numpy()
+    return pd.DataFrame({
+        "From": m.loc[keep, "RowFrom"].to_numpy(),
+        "To": m.loc[keep, "RowTo"].to_numpy(),
+        "Distance": distance[keep],
+        "Confidence": 1.0,
+        "Method": "id",
+    })
+
+
+def _spatial_matches(src: pd.DataFrame, dst: pd.DataFrame, max_distance: float, neighbours: int) -> pd.DataFrame:
+    """Nearest-neighbour matches within the same census pair and species."""
+    empty = pd.DataFrame({"From": [], "To": [], "Distance": [], "Confidence": [], "Method": []})
+    if src.empty or dst.empty:
+        return empty
+
+    # One block code per (census pair, species), shared by both sides
+    keys = pd.concat([src[["PairID", SPECIES_COL]], dst[["PairID", SPECIES_COL]]], ignore_index=True)
+    codes = pd.MultiIndex.from_frame(keys).factorize()[0].astype(float)
+    src_code, dst_code = codes[:len(src)], codes[len(src):]
+
+    # Blocks are spaced further apart than any in-plot distance
+    coords = np.concatenate([src[[X_COL, Y_COL]].to_numpy(), dst[[X_COL, Y_COL]].to_numpy()])
+    spacing = 2 * (np.ptp(coords, axis=0).max() + max_distance) + 1
+    src_pts = np.column_stack([src[X_COL], src[Y_COL], src_code * spacing])
+    dst_pts = np.column_stack([dst[X_COL], dst[Y_COL], dst_code * spacing])
+
+    k = max(2, min(neighbours, len(dst)))
+    dist, idx = cKDTree(dst_pts).query(src_pts, k=k, distance_upper_bound=max_distance)
+    found = idx < len(dst)
+    idx_safe = np.where(found, idx, 0)
+
+    src_dbh = src[DIAMETER_COL].to_numpy()[:, None]
+    dst_dbh = dst[DIAMETER_COL].to_numpy()[idx_safe]
+    years = (src["YearTo"] - src["YearFrom"]).to_numpy()[:, None]
+    dbh_change = dst_dbh - src_dbh
+    feasible = found & _plausible(dist, dbh_change, years, max_distance)
+    cost = np.where(feasible, _match_cost(dist, dbh_change, years, max_distance), np.inf)
+
+    # Ambiguity: how much better the best candidate is than the runner-up
+    sorted_cost = np.sort(cost, axis=1)
+    runner_up = sorted_cost[:, 1]
+
+    # Mutual-best rounds: every open 'from' stem proposes its cheapest open
+    # candidate, each 'to' stem keeps the cheapest proposal. A proposer either
+    # wins or loses that candidate for good, so k rounds exhaust all candidates.
+    rows = np.arange(len(src))
+    src_open = np.ones(len(src), dtype=bool)
+    dst_open = np.ones(len(dst), dtype=bool)
+    won_src, won_dst = [], []
+    for _ in range(k):
+        c = np.where(src_open[:, None] & dst_open[idx_safe], cost, np.inf)
+        best = np.argmin(c, axis=1)
+        best_cost = c[rows, best]
+        proposers = np.flatnonzero(np.isfinite(best_cost))
+        if proposers.size == 0:
+            break
+        targets = idx_safe[proposers, best[proposers]]
+        order = np.lexsort((best_cost[proposers], targets))
+        first = np.r_[True, targets[order][1:] != targets[order][:-1]]
+        winners, winner_targets = proposers[order][first], targets[order][first]
+        src_open[winners] = False
+        dst_open[winner_targets] = False
+        won_src.append(winners)
+        won_dst.append(winner_targets)
+
+    if not won_src:
+        return empty
+    s = np.concatenate(won_src)
+    d = np.concatenate(won_dst)
+    pos = np.argmax(idx_safe[s] == d[:, None], axis=1)
+    best_cost = cost[s, pos]
+    has_runner_up = np.isfinite(runner_up[s])
+    runner = np.where(has_runner_up, runner_up[s], 1.0)
+    margin = np.where(has_runner_up, (runner - best_cost) / np.maximum(runner, 1e-9), 1.0)
+    confidence = np.clip(1 - best_cost, 0, 1) * (0.5 + 0.5 * margin)
+    return pd.DataFrame({
+        "From": src["Row"].to_numpy()[s],
+        "To": dst["Row"].to_numpy()[d],
+        "Distance": dist[s, pos],
+        "Confidence": confidence,
+        "Method": "spatial",
+    })
+
+
+def build_crosswalk(df: pd.DataFrame, max_distance: float = MATCH_MAX_DISTANCE_M,
+                    neighbours: int = MATCH_NEIGHBOURS) -> pd.DataFrame:
+    """Match stems between consecutive censuses of every plot.
+
+    Returns one row per linked stem pair with the plot, both census years, the
+    positional rows in df (RowFrom/RowTo), both StandardIDs, species, distance moved,
+    DBH change, match method ("id" or "spatial") and a confidence in [0, 1].
+    Unmatched stems (mortality, recruitment) do not appear.
+    """
+    required = [PLOTID_COL, YEAR_COL, SPECIES_COL, X_COL, Y_COL, DIAMETER_COL]
+    missing = [c for c in required if c not in df.columns]
+    if missing:
+        raise ValueError(f"DataFrame must contain {missing} for stem matching")
+
+    stems = _stem_table(df)
+    src, dst = _census_pairs(stems)
+    by_id = _id_matches(src, dst)
+    # Each row is on the 'from' side of at most one pair and the 'to' side of at
+    # most one, so filtering by row is enough to drop stems already linked by ID
+    src_left = src[~src["Row"].isin(by_id["From"])]
+    dst_left = dst[~dst["Row"].isin(by_id["To"])]
+    spatial = _spatial_matches(src_left, dst_left, max_distance, neighbours)
+
+    links = pd.concat([by_id, spatial], ignore_index=True)
+    if links.empty:
+        return pd.DataFrame(columns=CROSSWALK_COLUMNS)
+    links["From"] = links["From"].astype(int)
+    links["To"] = links["To"].astype(int)
+
+    s = stems.set_index("Row")
+    f, t = s.loc[links["From"]], s.loc[links["To"]]
+    crosswalk = pd.DataFrame({
+        PLOTID_COL: f[PLOTID_COL].to_numpy(),
+        "YearFrom": f[YEAR_COL].to_numpy().astype(int),
+        "YearTo": t[YEAR_COL].to_numpy().astype(int),
+        "RowFrom": links["From"].to_numpy(),
+        "RowTo": links["To"].to_numpy(),
+        "IDFrom": f[TREEID_COL].to_numpy(),
+        "IDTo": t[TREEID_COL].to_numpy(),
+        SPECIES_COL: f[SPECIES_COL].to_numpy(),
+        "Distance": links["Distance"].to_numpy(),
+        "DBHChange": t[DIAMETER_COL].to_numpy() - f[DIAMETER_COL].to_numpy(),
+        "Method": links["Method"].to_numpy(),
+        "Confidence": links["Confidence"].to_numpy(),
+    })
+    return crosswalk.sort_values(["YearFrom", "RowFrom"]).reset_index(drop=True)
+
+
+def cached_crosswalk(df: pd.DataFrame) -> pd.DataFrame:
+    """build_crosswalk() with default settings, cached by dataset fingerprint."""
+    return _crosswalk_cache.get_or_create(dataset_fingerprint(df), lambda: build_crosswalk(df))
+
+
+def lineage_ids(n_rows: int, crosswalk: pd.DataFrame) -> np.ndarray:
+    """Label every row with the position of the first census row in its chain of matches."""
+    parent = np.arange(n_rows)
+    parent[crosswalk["RowTo"].to_numpy()] = crosswalk["RowFrom"].to_numpy()
+    # Pointer jumping: each pass halves the remaining chain length
+    while True:
+        grand = parent[parent]
+        if np.array_equal(grand, parent):
+            return parent
+        parent = grand
+
+
+def with_matched_ids(df: pd.DataFrame, crosswalk: pd.DataFrame = None) -> pd.DataFrame:
+    """Return df with a MATCHED_ID_COL that is stable for each tree across censuses.
+
+    Use it in place of TREEID_COL for per-tree joins, e.g.
+    compute_dbh_increments(df, plot_id, id_col=MATCHED_ID_COL). If df lacks the
+    columns needed for matching, the recorded StandardIDs are used as-is.
+    """
+    if crosswalk is None:
+        try:
+            crosswalk = cached_crosswalk(df)
+        except ValueError:
+            # Not enough columns to match on; fall back to the recorded IDs
+            return df.assign(**{MATCHED_ID_COL: df.get(TREEID_COL)})
+    return df.assign(**{MATCHED_ID_COL: lineage_ids(len(df), crosswalk)})
@@ -0,0 +1,175 @@
+"""Compact struct-of-arrays store of stems with zero-copy per-plot and per-year views.
+
+Only the columns the app works with are kept, as contiguous NumPy arrays: float32
+X/Y/DBH, int16 Year and small integer codes (with one label table each) for plot,
+species, status, crown class and tree ID. Rows are sorted by (PlotID, Year,
+StandardID) and an offset table records where each (plot, year) block starts, so
+plot() and plot_year() return views that share memory with the store. A store can
+be saved as .npy files and reopened memory-mapped; label tables are saved as JSON
+with their dtype, so a reopened store gives back identical frames.
+"""
+import json
+import os
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+from caching import LRUCache, dataset_fingerprint
+from config import (
+    DIAMETER_COL, SPECIES_COL, STATUS_COL, CROWN_COL, PLOTID_COL, TREEID_COL, YEAR_COL, X_COL, Y_COL
+)
+
+# Coded (categorical) columns and the dtype of their codes; -1 marks a missing value
+CODED_FIELDS = {PLOTID_COL: np.int32, SPECIES_COL: np.int16, STATUS_COL: np.int8,
+                CROWN_COL: np.int8, TREEID_COL: np.int32}
+VALUE_FIELDS = {X_COL: np.float32, Y_COL: np.float32, DIAMETER_COL: np.float32, YEAR_COL: np.int16}
+MISSING_YEAR = -1
+
+_store_cache = LRUCache(maxsize=4, name="stem_store")
+
+
+def _factorize(values) -> tuple:
+    try:
+        return pd.factorize(values, sort=True)
+    except TypeError:
+        # Mixed label types (e.g. numeric and text IDs) have no order
+        return pd.factorize(values, sort=False)
+
+
+def _code_dtype(preferred, n_labels: int):
+    dtype = np.dtype(preferred)
+    return dtype if n_labels < np.iinfo(dtype).max else np.dtype(np.int32)
+
+
+class StemStore:
+    """Stems as parallel arrays. Build with StemStore.from_frame() or StemStore.open()."""
+
+    def __init__(self, arrays: Dict[str, np.ndarray], labels: Dict[str, np.ndarray]):
+        self.arrays = arrays
+        self.labels = labels
+        self._build_offsets()
+
+    def _build_offsets(self) -> None:
+        plot = self.arrays[PLOTID_COL]
+        year = self.arrays[YEAR_COL]
+        if len(plot) == 0:
+            self.block_plot = np.array([], dtype=plot.dtype)
+            self.block_year = np.array([], dtype=year.dtype)
+            self.block_offsets = np.array([0], dtype=np.int64)
+            return
+        # Rows are sorted, so a block starts wherever plot or year changes
+        change = np.flatnonzero((plot[1:] != plot[:-1]) | (year[1:] != year[:-1])) + 1
+        starts = np.r_[0, change]
+        self.block_plot = np.asarray(plot[starts])
+        self.block_year = np.asarray(year[starts])
+        self.block_offsets = np.r_[starts, len(plot)].astype(np.int64)
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> "StemStore":
+        arrays, labels = {}, {}
+        for col, dtype in CODED_FIELDS.items():
+            values = df[col].to_numpy() if col in df.columns else np.full(len(df), np.nan)
+            codes, uniques = _factorize(values)
+            labels[col] = np.asarray(uniques)
+            arrays[col] = codes.astype(_code_dtype(dtype, len(uniques)))
+        for col, dtype in VALUE_FIELDS.items():
+            values = pd.to_numeric(df[col], errors='coerce') if col in df.columns else pd.Series(np.nan, index=df.index)
+            if col == YEAR_COL:
+                values = values.fillna(MISSING_YEAR)
+            arrays[col] = values.to_numpy(dtype=dtype)
+
+        order = np.lexsort((arrays[TREEID_COL], arrays[YEAR_COL], arrays[PLOTID_COL]))
+        arrays = {col: np.ascontiguousarray(a[order]) for col, a in arrays.items()}
+        return cls(arrays, labels)
+
+    def __len__(self) -> int:
+        return len(self.arrays[PLOTID_COL])
+
+    @property
+    def nbytes(self) -> int:
+        return sum(a.nbytes for a in self.arrays.values())
+
+    def plots(self) -> list:
+        return [self.labels[PLOTID_COL][c] for c in np.unique(self.block_plot) if c >= 0]
+
+    def years(self, plot_id) -> list:
+        code = self._plot_code(plot_id)
+        if code is None:
+            return []
+        return [int(y) for y in self.block_year[self.block_plot == code] if y != MISSING_YEAR]
+
+    def _plot_code(self, plot_id) -> Optional[int]:
+        hits = np.flatnonzero(pd.Index(self.labels[PLOTID_COL]) == plot_id)
+        return int(hits[0]) if len(hits) else None
+
+    def _view(self, start: int, stop: int) -> "StemStore":
+        # Basic slicing returns views, so no stem data is copied
+        return StemStore({col: a[start:stop] for col, a in self.arrays.items()}, self.labels)
+
+    def plot(self, plot_id) -> "StemStore":
+        """Zero-copy view of every census of one plot."""
+        code = self._plot_code(plot_id)
+        blocks = np.flatnonzero(self.block_plot == code) if code is not None else []
+        if len(blocks) == 0:
+            return self._view(0, 0)
+        return self._view(self.block_offsets[blocks[0]], self.block_offsets[blocks[-1] + 1])
+
+    def plot_year(self, plot_id, year) -> "StemStore":
+        """Zero-copy view of one census of one plot."""
+        code = self._plot_code(plot_id)
+        hit = np.flatnonzero((self.block_plot == code) & (self.block_year == int(year))) if code is not None else []
+        if len(hit) == 0:
+            return self._view(0, 0)
+        return self._view(self.block_offsets[hit[0]], self.block_offsets[hit[0] + 1])
+
+    def median_dbh(self) -> float:
+        """Exact median DBH of the stems in this store or view, ignoring missing values."""
+        dbh = self.arrays[DIAMETER_COL].astype(np.float64)
+        dbh = dbh[np.isfinite(dbh)]
+        return float(np.median(dbh)) if len(dbh) else float('nan')
+
+    def to_frame(self) -> pd.DataFrame:
+        """DataFrame adapter; coded columns become pandas Categoricals over the shared labels."""
+        data = {}
+        for col in CODED_FIELDS:
+            codes = self.arrays[col]
+            if col == PLOTID_COL:
+                # Plot IDs stay plain values so equality filters behave as on the raw frame
+                plot_labels = np.append(self.labels[col].astype(object), None)
+                data[col] = plot_labels[np.where(codes >= 0, codes, len(plot_labels) - 1)]
+            else:
+                data[col] = pd.Categorical.from_codes(codes, categories=pd.Index(self.labels[col]))
+        year = self.arrays[YEAR_COL]
+        data[YEAR_COL] = pd.Series(year, dtype='Int64').mask(year == MISSING_YEAR)
+        for col in (X_COL, Y_COL, DIAMETER_COL):
+            data[col] = self.arrays[col]
+        return pd.DataFrame(data)
+
+    def save(self, directory: str) -> None:
+        """Write one .npy file per array plus the label tables to a directory."""
+        os.makedirs(directory, exist_ok=True)
+        for col, a in self.arrays.items():
+            np.save(os.path.join(directory, f"{col}.npy"), a)
+        # JSON keeps int, float, str, bool and None apart; the dtype restores the array itself
+        meta = {col: {"dtype": self.labels[col].dtype.str,
+                      "values": [v.item() if isinstance(v, np.generic) else v for v in self.labels[col]]}
+                for col in CODED_FIELDS}
+        with open(os.path.join(directory, "labels.json"), "w") as fh:
+            json.dump(meta, fh)
+
+    @classmethod
+    def open(cls, directory: str, mmap: bool = True) -> "StemStore":
+        """Reopen a saved store; with mmap=True arrays are paged in lazily from disk."""
+        mode = 'r' if mmap else None
+        arrays = {col: np.load(os.path.join(directory, f"{col}.npy"), mmap_mode=mode)
+                  for col in list(CODED_FIELDS) + list(VALUE_FIELDS)}
+        with open(os.path.join(directory, "labels.json")) as fh:
+            meta = json.load(fh)
+        labels = {col: np.array(meta[col]["values"], dtype=np.dtype(meta[col]["dtype"])) for col in CODED_FIELDS}
+        return cls(arrays, labels)
+
+
+def cached_stem_store(df: pd.DataFrame) -> StemStore:
+    """Build the store once per dataset content."""
+    return _store_cache.get_or_create(dataset_fingerprint(df), lambda: StemStore.from_frame(df))
@@ -0,0 +1,100 @@
+"""Thin Streamlit adapter over the headless plotting and statistics API.
+
+tree_plots.py and tree_statistics.py return figures, arrays and Notice objects
+without touching Streamlit; the functions here display those results in the app.
+They keep the names and signatures the pages have always used.
+"""
+import os
+from typing import Dict, Hashable, Iterable, List, Optional
+
+import pandas as pd
+import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+from caching import LRUCache, set_owner_resolver
+from tree_plots import Notice, PlotGeometry, View, read_data
+from raster import Surface
+from render_pool import render_stem_map
+from tree_statistics import diversity_figure, dbh_figure, dbh_counts_figure
+
+_NOTICE_FUNCS = {
+    "success": st.success,
+    "info": st.info,
+    "warning": st.warning,
+    "error": st.error,
+}
+
+
+def session_owner() -> Optional[str]:
+    """ID of the Streamlit session running the calling thread, if any."""
+    ctx = get_script_run_ctx(suppress_warning=True)
+    return ctx.session_id if ctx is not None else None
+
+
+# Cache entries are tagged with the session that stored or read them
+set_owner_resolver(session_owner)
+
+
+def show_notices(notices: Iterable[Notice]) -> None:
+    """Display notices from the headless API with the matching st.* call."""
+    for notice in notices:
+        _NOTICE_FUNCS.get(notice.level, st.info)(notice.message)
+
+
+# Parsed uploads, so reruns reuse one frame (and its memoized fingerprint)
+_upload_cache = LRUCache(maxsize=8, name="uploads")
+
+
+def _upload_key(filelike) -> Optional[Hashable]:
+    file_id = getattr(filelike, "file_id", None)
+    if file_id is not None:
+        return ("upload", file_id)
+    if isinstance(filelike, (str, os.PathLike)) and os.path.exists(filelike):
+        stat = os.stat(filelike)
+        return ("path", os.path.abspath(filelike), stat.st_mtime_ns, stat.st_size)
+    return None
+
+
+def load_data(filelike) -> Optional[pd.DataFrame]:
+    """read_data() once per uploaded file or file version; the frame is shared, so treat it as read-only."""
+    key = _upload_key(filelike)
+    if key is None:
+        df, notices = read_data(filelike)
+    else:
+        df, notices = _upload_cache.get_or_create(key, lambda: read_data(filelike))
+    show_notices(notices)
+    return df
+
+
+def plot_data(df: pd.DataFrame, species_colors: Dict, plotting_group: Optional[str], year: int, species_dict: Optional[Dict[str, str]] = None, status_dict: Optional[Dict[str, str]] = None,
+              geometry: Optional[PlotGeometry] = None, lod: str = "auto", view: Optional[View] = None,
+              overlay: Optional[Surface] = None) -> bytes:
+    # Drawn by the render worker pool; the script thread only ships arrays and shows bytes
+    try:
+        png = render_stem_map(df, species_colors, plotting_group, year, species_dict, status_dict,
+                              geometry, lod, view, overlay)
+    except ValueError as e:
+        st.warning(str(e))
+        raise
+    st.image(png)
+    # Returned rather than written to disk, where concurrent sessions would share one file
+    return png
+
+
+def diversity_plot(species_counts: pd.Series, colourwheel: Dict) -> None:
+    st.pyplot(diversity_figure(species_counts, colourwheel))
+
+
+def dbh_plot(df: pd.DataFrame, selected_species: List[str], numbins: int,
+             colourwheel: Dict, colourtype: bool) -> None:
+    fig, notices = dbh_figure(df, selected_species, numbins, colourwheel, colourtype)
+    show_notices(notices)
+    if fig is not None:
+        st.pyplot(fig)
+
+
+def dbh_counts_plot(bin_edges, counts_by_species: Dict, colourwheel: Dict, colourtype: bool) -> None:
+    if bin_edges is None or not counts_by_species:
+        st.warning("No DBH data for selected species.")
+        return
+    st.pyplot(dbh_counts_figure(bin_edges, counts_by_species, colourwheel, colourtype))
@@ -0,0 +1,74 @@
+import pandas as pd
+
+from caching import (
+    LRUCache, dataset_fingerprint, forget_fingerprint, invalidate_dataset, mapping_key, memoize
+)
+
+
+def counting(cache):
+    calls = []
+
+    @memoize(cache)
+    def total(df, column, scale=1):
+        calls.append(column)
+        return df[column].sum() * scale
+
+    return total, calls
+
+
+def test_memoize_keys_on_content_and_arguments():
+    cache = LRUCache(maxsize=8, name="test-memoize")
+    total, calls = counting(cache)
+    df = pd.DataFrame({"a": [1, 2, 3], "b": [4, 5, 6]})
+
+    assert total(df, "a") == 6
+    assert total(df, "a") == 6
+    # A separate frame with the same content shares the entry
+    assert total(df.copy(), "a") == 6
+    assert calls == ["a"]
+    assert total(df, "a", scale=2) == 12
+    assert total(df, "b") == 15
+    assert calls == ["a", "a", "b"]
+    assert total.uncached(df, "a") == 6 and len(calls) == 4
+
+
+def test_sources_without_fingerprint_are_not_cached():
+    cache = LRUCache(maxsize=8, name="test-memoize-none")
+    total, calls = counting(cache)
+    frame = {"a": pd.Series([1, 2])}
+    total(frame, "a")
+    total(frame, "a")
+    assert len(calls) == 2 and len(cache) == 0
+
+
+def test_invalidate_dataset_drops_only_its_entries():
+    cache = LRUCache(maxsize=8, name="test-invalidate")
+    total, calls = counting(cache)
+    df = pd.DataFrame({"a": [1, 2, 3]})
+    other = pd.DataFrame({"a": [10, 20]})
+    total(df, "a")
+    total(other, "a")
+    cache.put(dataset_fingerprint(df), "raw entry")
+
+    assert invalidate_dataset(df) >= 2
+    assert dataset_fingerprint(df) not in cache and len(cache) == 1
+    total(other, "a")
+    assert calls == ["a", "a"]
+
+
+def test_in_place_edits_need_forget_fingerprint():
+    cache = LRUCache(maxsize=8, name="test-forget")
+    total, calls = counting(cache)
+    df = pd.DataFrame({"a": [1, 2, 3]})
+    assert total(df, "a") == 6
+    df.loc[0, "a"] = 100
+    # The fingerprint is memoized on the object, so the stale result comes back...
+    assert total(df, "a") == 6
+    forget_fingerprint(df)
+    # ...until it is forgotten and recomputed from the new content
+    assert total(df, "a") == 105
+
+
+def test_mapping_key_ignores_order():
+    assert mapping_key({"b": 1, "a": 2}) == mapping_key({"a": 2, "b": 1})
+    assert mapping_key(None) == mapping_key({}) == ()
@@ -0,0 +1,38 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from canopy import ALL_CLASSES, canopy_cover
+from config import CROWN_COL, DIAMETER_COL, SPECIES_COL, STATUS_COL, PLOTID_COL, YEAR_COL, X_COL, Y_COL
+
+
+@pytest.fixture
+def allometry(tmp_path):
+    # Constant 3 m crown radius regardless of DBH
+    path = tmp_path / "CrownAllometry.csv"
+    pd.DataFrame({"Abbreviation": ["ACRU"], "Intercept": [3.0], "Slope": [0.0]}).to_csv(path, index=False)
+    return str(path)
+
+
+def stems(xs, ys, status="AS"):
+    return pd.DataFrame({
+        PLOTID_COL: 1, YEAR_COL: 2020, SPECIES_COL: "ACRU", STATUS_COL: status,
+        X_COL: xs, Y_COL: ys, DIAMETER_COL: 25.0,
+    })
+
+
+def test_single_crown_area_matches_disk(allometry):
+    cover = canopy_cover(stems([10.0], [10.0]), geometry=(20.0, 20.0), cell=0.05, by=None, allometry_path=allometry)
+    row = cover[cover[CROWN_COL] == ALL_CLASSES].iloc[0]
+    expected = 100.0 * np.pi * 3.0 ** 2 / 400.0
+    assert row["Cover"] == pytest.approx(expected, rel=0.01)
+    assert row["Overlap"] == 0
+    assert row["Gap"] == pytest.approx(100.0 - row["Cover"])
+
+
+def test_overlap_and_dead_stems(allometry):
+    df = pd.concat([stems([10.0, 10.0], [10.0, 10.0]), stems([2.0], [2.0], status="DS")])
+    row = canopy_cover(df, geometry=(20.0, 20.0), cell=0.05, by=None, allometry_path=allometry).iloc[0]
+    # Two identical crowns overlap everywhere; the dead stem adds nothing
+    assert row["Overlap"] == pytest.approx(row["Cover"])
+    assert row["Cover"] == pytest.approx(100.0 * np.pi * 9.0 / 400.0, rel=0.01)
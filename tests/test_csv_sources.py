@@ -0,0 +1,61 @@
+import gzip
+import io
+import lzma
+import zipfile
+
+import pandas as pd
+import pytest
+
+from csv_sources import DECOMPRESSION_ERRORS, csv_streams, read_csv_source
+from tree_plots import read_data
+
+with open("Data/example_data.csv", "rb") as fh:
+    RAW = fh.read()
+EXPECTED = pd.read_csv(io.BytesIO(RAW))
+
+
+def zipped(*members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, data in members:
+            archive.writestr(name, data)
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize("compress", [lambda b: b, gzip.compress, lzma.compress,
+                                      lambda b: zipped(("census.csv", b))],
+                         ids=["plain", "gzip", "xz", "zip"])
+def test_compressed_sources_read_like_plain_csv(compress, tmp_path):
+    data = compress(RAW)
+    pd.testing.assert_frame_equal(read_csv_source(io.BytesIO(data)), EXPECTED)
+    # Detection goes by content, so the file name does not matter
+    path = tmp_path / "upload.bin"
+    path.write_bytes(data)
+    pd.testing.assert_frame_equal(read_csv_source(str(path)), EXPECTED)
+
+
+def test_zip_members_are_concatenated_and_other_files_skipped():
+    header, *rows = RAW.decode().splitlines(keepends=True)
+    half = len(rows) // 2
+    data = zipped(("2016.csv", header + "".join(rows[:half])), ("readme.txt", "not a csv"),
+                  ("__MACOSX/._2017.csv", "junk"), ("2017.csv", header + "".join(rows[half:])))
+    assert [name for name, _ in csv_streams(io.BytesIO(data))] == ["2016.csv", "2017.csv"]
+    pd.testing.assert_frame_equal(read_csv_source(io.BytesIO(data)), EXPECTED)
+
+
+def test_zip_without_csv_is_rejected():
+    with pytest.raises(ValueError, match="no CSV"):
+        read_csv_source(io.BytesIO(zipped(("readme.txt", "hello"))))
+
+
+@pytest.mark.parametrize("compress", [gzip.compress, lzma.compress, lambda b: zipped(("census.csv", b))],
+                         ids=["gzip", "xz", "zip"])
+def test_truncated_archive_is_reported(compress):
+    data = compress(RAW)
+    truncated = io.BytesIO(data[:len(data) // 2])
+    with pytest.raises(DECOMPRESSION_ERRORS):
+        read_csv_source(truncated)
+    truncated.seek(0)
+    df, notices = read_data(truncated)
+    assert df is None
+    assert [n.level for n in notices] == ["error"]
@@ -0,0 +1,42 @@
+import pandas as pd
+import pytest
+
+from config import DIAMETER_COL, SPECIES_COL, PLOTID_COL, YEAR_COL
+from cube import StandCube, plot_year_stats
+from tree_plots import normalize_coordinates, read_data
+from tree_statistics import compute_plot_year_stats
+
+
+@pytest.fixture(scope="module")
+def df():
+    return normalize_coordinates(read_data("Data/example_data.csv")[0])
+
+
+@pytest.mark.parametrize("plot_id", [1, 2, None])
+def test_plot_year_stats_match_pandas(df, plot_id):
+    cube = StandCube.from_frame(df)
+    from_cube = plot_year_stats.uncached(cube, plot_id)
+    expected = compute_plot_year_stats(df, plot_id)
+    assert from_cube.keys() == expected.keys()
+    for name, frame in expected.items():
+        # The cube reports Year as int64, the raw frame as nullable Int64
+        pd.testing.assert_frame_equal(from_cube[name], frame, check_dtype=False, check_exact=False)
+
+
+def test_totals_and_mean_match_stems(df):
+    cube = StandCube.from_frame(df).select(**{PLOTID_COL: 2})
+    plot = df[df[PLOTID_COL] == 2]
+    assert cube.total() == len(plot)
+    pd.testing.assert_series_equal(cube.total([SPECIES_COL]), plot.groupby(SPECIES_COL).size(),
+                                   check_names=False, check_index_type=False)
+    assert cube.mean_dbh() == pytest.approx(plot[DIAMETER_COL].mean())
+    # The class-based median is only accurate to one class width
+    assert abs(cube.median_dbh() - plot[DIAMETER_COL].median()) <= cube.dbh_class_width
+
+
+def test_select_by_year_and_missing_plot(df):
+    cube = StandCube.from_frame(df)
+    years = sorted(df[YEAR_COL].dropna().unique())
+    assert cube.select(**{YEAR_COL: years[0]}).total() == (df[YEAR_COL] == years[0]).sum()
+    assert len(cube.select(**{PLOTID_COL: "no such plot"})) == 0
+    assert plot_year_stats.uncached(cube, "no such plot") is None
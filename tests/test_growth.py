@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from config import DIAMETER_COL, SPECIES_COL, STATUS_COL, PLOTID_COL, TREEID_COL, YEAR_COL, DEAD_STATUS_CODES
+from growth import fit_growth_models, project_basal_area
+from tree_plots import normalize_coordinates, read_data
+
+
+def test_fitted_params_repr_and_copy():
+    rows = []
+    for tree in range(8):
+        for i, year in enumerate([2010, 2015, 2020]):
+            rows.append({PLOTID_COL: "1-1", TREEID_COL: tree, SPECIES_COL: "ACRU", YEAR_COL: year,
+                         DIAMETER_COL: 10.0 + tree + (1.0 + 0.1 * tree) * i})
+    params = fit_growth_models(pd.DataFrame(rows))
+    # pandas compares attrs when carrying them over, so they must not hold arrays
+    repr(params)
+    assert params.head(1).attrs["pooled_coef"] == params.attrs["pooled_coef"]
+
+
+def test_projected_basal_area_stays_within_growth_bounds():
+    df = normalize_coordinates(read_data("Data/example_data.csv")[0])
+    params = fit_growth_models(df)
+    inc_max = max(params["inc_max"].max(), params.attrs["pooled_range"][2])
+    for plot_id in df[PLOTID_COL].unique():
+        projection = project_basal_area(df, plot_id, 10, params)
+        plot = df[df[PLOTID_COL] == plot_id]
+        last = plot[(plot[YEAR_COL] == plot[YEAR_COL].max()) & ~plot[STATUS_COL].isin(DEAD_STATUS_CODES)]
+        dbh = last[DIAMETER_COL].dropna().to_numpy()
+        dbh = dbh[dbh > 0]
+
+        assert projection[YEAR_COL].tolist() == list(range(plot[YEAR_COL].max(), plot[YEAR_COL].max() + 11))
+        ba = projection["BasalArea_m2"].to_numpy()
+        assert ba[0] == pytest.approx(np.pi * np.sum((dbh / 200.0) ** 2))
+        # Increments are never negative and never exceed the largest observed one
+        assert (np.diff(ba) >= 0).all()
+        upper = [np.pi * np.sum(((dbh + t * inc_max) / 200.0) ** 2) for t in range(11)]
+        assert (ba <= np.array(upper) + 1e-12).all()
+
+
+def test_projection_ignores_dead_stems_and_empty_plots():
+    df = normalize_coordinates(read_data("Data/example_data.csv")[0])
+    params = fit_growth_models(df)
+    plot_id = df[PLOTID_COL].iloc[0]
+    last_year = df.loc[df[PLOTID_COL] == plot_id, YEAR_COL].max()
+    dead = df[(df[PLOTID_COL] == plot_id) & (df[YEAR_COL] == last_year)].head(1).assign(
+        **{STATUS_COL: DEAD_STATUS_CODES[0], DIAMETER_COL: 80.0})
+    with_dead = pd.concat([df, dead], ignore_index=True)
+    pd.testing.assert_frame_equal(project_basal_area(with_dead, plot_id, 5, params),
+                                  project_basal_area(df, plot_id, 5, params))
+    assert project_basal_area(df, "no such plot", 5, params) is None
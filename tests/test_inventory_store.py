@@ -0,0 +1,60 @@
+import pandas as pd
+import pytest
+
+from config import DIAMETER_COL, SPECIES_COL, STATUS_COL, PLOTID_COL, TREEID_COL, YEAR_COL
+from inventory_store import InventoryStore
+
+
+def _inventory() -> pd.DataFrame:
+    return pd.DataFrame({
+        PLOTID_COL: [1, 1, 1, 2],
+        YEAR_COL: pd.array([2015, 2015, 2020, 2015], dtype="Int64"),
+        TREEID_COL: [10, 11, 10, 20],
+        SPECIES_COL: ["ACRU", "PIST", "ACRU", None],
+        STATUS_COL: [1, 1, 2, 1],
+        "X": [1.5, 4.0, 1.5, 9.0],
+        "Y": [2.0, 3.5, 2.0, 7.25],
+        DIAMETER_COL: [12.3, 8.0, 13.1, float("nan")],
+    })
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = InventoryStore(str(tmp_path / "inventory.sqlite"), backend="sqlite")
+    yield store
+    store.close()
+
+
+def test_round_trip_and_dedup(store):
+    df = _inventory()
+    assert store.import_frame(df, "a.csv")
+    assert not store.import_frame(df.copy(), "again.csv")
+    assert len(store) == len(df)
+    assert list(store.plots()[PLOTID_COL]) == [1, 2]
+    assert store.years(1) == [2015, 2020]
+
+    rows = store.plot_rows([1, 2]).sort_values([PLOTID_COL, YEAR_COL, TREEID_COL], ignore_index=True)
+    expected = df.sort_values([PLOTID_COL, YEAR_COL, TREEID_COL], ignore_index=True)
+    for col in [PLOTID_COL, YEAR_COL, TREEID_COL, "X", "Y", DIAMETER_COL]:
+        pd.testing.assert_series_equal(rows[col], expected[col], check_dtype=False, check_names=False)
+    assert rows[SPECIES_COL].tolist() == expected[SPECIES_COL].tolist()
+
+
+def test_failed_import_rolls_back(store, monkeypatch):
+    df = _inventory()
+    original = store._append
+
+    def failing_append(table, frame):
+        if table == "censuses":
+            raise RuntimeError("disk full")
+        original(table, frame)
+
+    monkeypatch.setattr(store, "_append", failing_append)
+    with pytest.raises(RuntimeError):
+        store.import_frame(df, "a.csv")
+    assert len(store) == 0 and store.inventories().empty
+
+    monkeypatch.setattr(store, "_append", original)
+    assert store.import_frame(df, "a.csv")
+    assert len(store) == len(df)
+    assert store.plots()["Censuses"].tolist() == [2, 1]
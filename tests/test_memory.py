@@ -0,0 +1,26 @@
+import numpy as np
+
+import caching
+from caching import LRUCache
+from memory import MB, enforce_budget, memory_report
+
+
+def test_budget_only_releases_the_calling_owners_entries(monkeypatch):
+    owner = {"id": "a"}
+    monkeypatch.setattr(caching, "_owner_resolver", lambda: owner["id"])
+    cache = LRUCache(maxsize=8, name="test-budget")
+    cache.put("a1", np.zeros(MB, dtype=np.uint8))
+    cache.put("a2", np.zeros(MB, dtype=np.uint8))
+    owner["id"] = "b"
+    cache.put("b1", np.zeros(MB, dtype=np.uint8))
+    cache.get("a2")
+
+    assert cache.owned_nbytes("a") == (2, 2 * MB)
+    report = memory_report("a")
+    assert report.loc[report["Source"] == "cache: test-budget", "MB"].item() == 2
+
+    assert enforce_budget("a", budget_mb=0) == 2
+    # a1 was only a's; a2 is still held by b, and b's own entry is untouched
+    assert "a1" not in cache and "a2" in cache and "b1" in cache
+    assert cache.owned_nbytes("a") == (0, 0)
+    assert cache.owned_nbytes("b") == (2, 2 * MB)
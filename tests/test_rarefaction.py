@@ -0,0 +1,33 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from config import SPECIES_COL, PLOTID_COL, YEAR_COL
+from rarefaction import accumulation_curve, rarefaction_curve, rarefaction_table
+
+ABUNDANCES = np.array([30, 12, 6, 3, 1, 1])
+
+
+def test_analytic_curve_matches_permutation_mean():
+    codes = np.repeat(np.arange(len(ABUNDANCES)), ABUNDANCES)
+    analytic = rarefaction_curve(ABUNDANCES)
+    permuted = accumulation_curve(codes, sizes=analytic["Individuals"].to_numpy(), permutations=4000, seed=1)
+    np.testing.assert_allclose(permuted["Expected"], analytic["Expected"], atol=0.1)
+    # One stem always shows one species; all of them show every species
+    assert analytic["Expected"].iloc[0] == pytest.approx(1.0)
+    assert analytic["Expected"].iloc[-1] == pytest.approx(len(ABUNDANCES))
+    assert (np.diff(analytic["Expected"]) >= 0).all()
+
+
+def test_parallel_table_equals_serial():
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        PLOTID_COL: np.repeat([1, 2, 3], 40),
+        YEAR_COL: 2020,
+        SPECIES_COL: rng.choice(["ACRU", "PIST", "BEAL", "TSCA"], 120, p=[0.5, 0.3, 0.15, 0.05]),
+    })
+    for method in ("analytic", "permutation"):
+        serial = rarefaction_table(df, method=method, permutations=200, workers=0)
+        parallel = rarefaction_table(df, method=method, permutations=200, workers=2)
+        pd.testing.assert_frame_equal(parallel, serial)
+    assert serial.groupby(PLOTID_COL)["Observed"].first().tolist() == df.groupby(PLOTID_COL)[SPECIES_COL].nunique().tolist()
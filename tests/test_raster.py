@@ -0,0 +1,38 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from config import DIAMETER_COL, SPECIES_COL, PLOTID_COL, YEAR_COL, X_COL, Y_COL
+from raster import ALL_STEMS, kernel_surfaces
+
+
+def stems(n=60, seed=0):
+    rng = np.random.default_rng(seed)
+    # Kept six bandwidths from the edges, where the edge correction is 1
+    return pd.DataFrame({
+        PLOTID_COL: 1, YEAR_COL: 2020,
+        SPECIES_COL: rng.choice(["ACRU", "PIST"], n),
+        X_COL: rng.uniform(8, 32, n), Y_COL: rng.uniform(8, 32, n),
+        DIAMETER_COL: rng.uniform(5, 60, n),
+    })
+
+
+def integral(surface, cell):
+    # Surfaces are per hectare; each cell covers cell² m²
+    return surface.values.sum() * cell * cell / 10000.0
+
+
+@pytest.mark.parametrize("measure", ["density", "basal_area"])
+def test_surface_integrates_to_plot_total(measure):
+    df, cell = stems(), 0.25
+    surfaces = kernel_surfaces(df, 1, 2020, measure, bandwidth=1.0, cell=cell, geometry=(40.0, 40.0))
+    expected = len(df) if measure == "density" else (np.pi * (df[DIAMETER_COL] / 200.0) ** 2).sum()
+    assert integral(surfaces[ALL_STEMS], cell) == pytest.approx(expected, rel=1e-6)
+
+
+def test_group_surfaces_sum_to_all_stems():
+    df, cell = stems(), 0.25
+    surfaces = kernel_surfaces(df, 1, 2020, by=SPECIES_COL, bandwidth=1.0, cell=cell, geometry=(40.0, 40.0))
+    assert set(surfaces) == {ALL_STEMS, "ACRU", "PIST"}
+    np.testing.assert_allclose(surfaces["ACRU"].values + surfaces["PIST"].values, surfaces[ALL_STEMS].values, atol=1e-9)
+    assert integral(surfaces["ACRU"], cell) == pytest.approx((df[SPECIES_COL] == "ACRU").sum(), rel=1e-6)
@@ -0,0 +1,46 @@
+import threading
+import time
+
+import pandas as pd
+
+import render_pool
+from config import DIAMETER_COL, YEAR_COL
+from render_pool import RenderPool, StemMapSpec
+
+
+def _spec(dbh: float) -> StemMapSpec:
+    df = pd.DataFrame({"X": [1.0, 5.0], "Y": [2.0, 8.0], DIAMETER_COL: [dbh, 20.0], YEAR_COL: [2020, 2020]})
+    return StemMapSpec.from_frame(df, {}, None, 2020, {}, {})
+
+
+def test_timeout_falls_back_to_in_process_render():
+    pool = RenderPool(workers=1)
+    try:
+        # Far shorter than starting a spawned worker
+        png = pool.render(_spec(10.0), timeout=1e-4)
+    finally:
+        pool.shutdown()
+    assert png.startswith(b"\x89PNG")
+
+
+def test_in_process_render_does_not_hold_the_lock(monkeypatch):
+    started, release = threading.Event(), threading.Event()
+    real = render_pool.render_png
+
+    def slow_render(spec):
+        if spec.dbh[0] == 10.0:
+            started.set()
+            release.wait(5)
+        return real(spec)
+
+    monkeypatch.setattr(render_pool, "render_png", slow_render)
+    pool = RenderPool(workers=0)
+    slow = threading.Thread(target=pool.render, args=(_spec(10.0),))
+    slow.start()
+    assert started.wait(5)
+    t0 = time.perf_counter()
+    pool.render(_spec(30.0))
+    waited = time.perf_counter() - t0
+    release.set()
+    slow.join()
+    assert waited < 5
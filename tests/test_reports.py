@@ -0,0 +1,28 @@
+import pandas as pd
+
+from caching import RENDER_CACHE
+from config import DIAMETER_COL, SPECIES_COL, STATUS_COL, PLOTID_COL, TREEID_COL, YEAR_COL
+from reports import ReportJob, build_report
+
+
+def _inventory() -> pd.DataFrame:
+    rows = []
+    for plot in (1, 2):
+        for year in (2015, 2020):
+            for tree in range(6):
+                rows.append({PLOTID_COL: plot, YEAR_COL: year, TREEID_COL: tree, SPECIES_COL: ["ACRU", "PIST"][tree % 2],
+                             STATUS_COL: 1, "X": 2.0 + 3 * tree, "Y": 1.0 + 2 * tree,
+                             DIAMETER_COL: 10.0 + tree + (year - 2015) * 0.2})
+    return pd.DataFrame(rows)
+
+
+def test_concurrent_jobs_build_and_cache_the_file_not_figures():
+    df = _inventory()
+    jobs = [ReportJob(df, "pdf").start(), ReportJob(df, "html").start()]
+    for job in jobs:
+        job._thread.join()
+        assert job.error is None and job.result
+    assert jobs[0].result.startswith(b"%PDF") and b"<img" in jobs[1].result
+    # Only finished files are cached, and an identical request is served from them
+    assert build_report(df, "pdf") is jobs[0].result
+    assert all(isinstance(v, bytes) for v in RENDER_CACHE._data.values())
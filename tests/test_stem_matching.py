@@ -0,0 +1,38 @@
+import numpy as np
+import pandas as pd
+
+from config import DIAMETER_COL, SPECIES_COL, PLOTID_COL, TREEID_COL, YEAR_COL, X_COL, Y_COL, MATCHED_ID_COL
+from stem_matching import build_crosswalk, with_matched_ids
+
+
+def test_same_id_with_large_dbh_change_stays_one_lineage():
+    # Same tag, species and position; DBH shrinks 5 cm, then grows 20 cm in 2 years
+    df = pd.DataFrame({
+        PLOTID_COL: ["1-1"] * 3,
+        YEAR_COL: [2010, 2012, 2014],
+        TREEID_COL: [7, 7, 7],
+        SPECIES_COL: ["ACRU"] * 3,
+        X_COL: [4.0, 4.0, 4.0],
+        Y_COL: [9.0, 9.0, 9.0],
+        DIAMETER_COL: [30.0, 25.0, 45.0],
+    })
+    crosswalk = build_crosswalk(df)
+    assert crosswalk["Method"].tolist() == ["id", "id"]
+    assert crosswalk["DBHChange"].tolist() == [-5.0, 20.0]
+    assert with_matched_ids(df, crosswalk)[MATCHED_ID_COL].nunique() == 1
+
+
+def test_stems_without_species_are_not_matched():
+    # Two untagged stems at the same spot with no species recorded
+    df = pd.DataFrame({
+        PLOTID_COL: ["1-1"] * 4,
+        YEAR_COL: [2010, 2014, 2010, 2014],
+        TREEID_COL: [np.nan] * 4,
+        SPECIES_COL: [np.nan, np.nan, "ACRU", "ACRU"],
+        X_COL: [1.0, 1.0, 8.0, 8.0],
+        Y_COL: [2.0, 2.0, 8.0, 8.0],
+        DIAMETER_COL: [20.0, 21.0, 15.0, 16.0],
+    })
+    crosswalk = build_crosswalk(df)
+    assert crosswalk[["RowFrom", "RowTo"]].values.tolist() == [[2, 3]]
+    assert "nan" not in crosswalk[SPECIES_COL].tolist()
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+import pandas as pd
+
+from config import DIAMETER_COL, SPECIES_COL, STATUS_COL, CROWN_COL, PLOTID_COL, TREEID_COL, YEAR_COL
+from stem_store import StemStore
+from tree_plots import normalize_coordinates, read_data
+
+
+def test_save_open_round_trip(tmp_path):
+    df = normalize_coordinates(read_data("Data/example_data.csv")[0])
+    store = StemStore.from_frame(df)
+    store.save(str(tmp_path))
+    for mmap in (True, False):
+        reopened = StemStore.open(str(tmp_path), mmap=mmap)
+        for plot_id in store.plots():
+            for year in store.years(plot_id):
+                assert reopened.plot_year(plot_id, year).to_frame().equals(store.plot_year(plot_id, year).to_frame())
+
+
+def test_mixed_and_missing_labels_round_trip(tmp_path):
+    df = pd.DataFrame({
+        PLOTID_COL: ["1-1", "1-1", "2-1"],
+        YEAR_COL: [2015, 2020, 2015],
+        TREEID_COL: [7, "7a", np.nan],
+        SPECIES_COL: ["ACRU", None, "PIST"],
+        STATUS_COL: [1, 2, 1],
+        CROWN_COL: [2.0, np.nan, 3.0],
+        "X": [1.0, 2.0, 3.0], "Y": [4.0, 5.0, 6.0], DIAMETER_COL: [10.0, 11.5, np.nan],
+    })
+    store = StemStore.from_frame(df)
+    store.save(str(tmp_path))
+    assert StemStore.open(str(tmp_path)).to_frame().equals(store.to_frame())
+
+
+def test_views_share_memory():
+    df = normalize_coordinates(read_data("Data/example_data.csv")[0])
+    store = StemStore.from_frame(df)
+    plot_id = store.plots()[0]
+    view = store.plot_year(plot_id, store.years(plot_id)[0])
+    assert np.shares_memory(view.arrays[DIAMETER_COL], store.arrays[DIAMETER_COL])
+    assert len(view) == ((df[PLOTID_COL] == plot_id) & (df[YEAR_COL] == store.years(plot_id)[0])).sum()
+
+
+def test_median_dbh_is_exact():
+    df = normalize_coordinates(read_data("Data/example_data.csv")[0])
+    store = StemStore.from_frame(df)
+    for plot_id in store.plots():
+        expected = pd.to_numeric(df.loc[df[PLOTID_COL] == plot_id, DIAMETER_COL], errors='coerce').astype(np.float32).astype(float).median()
+        assert store.plot(plot_id).median_dbh() == pytest.approx(float(expected), abs=1e-9)
+    assert np.isnan(store.plot_year("no such plot", 2000).median_dbh())
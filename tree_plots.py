@@ -1,18 +1,32 @@
 import matplotlib.pyplot as plt
-import streamlit as st 
 from collections import defaultdict
 import itertools
 import pandas as pd
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, NamedTuple, Tuple
+from matplotlib.colors import to_rgba
+from matplotlib.figure import Figure
 from matplotlib.lines import Line2D
+from matplotlib.patches import Patch
 import numpy as np
 
 from config import (
     DIAMETER_COL, SPECIES_COL, STATUS_COL, CROWN_COL,
-    KNOWN_SPECIES_COLORS, PLOT_SIZE_METERS, PLOT_CENTER, DBH_MARKER_SCALE,
+    KNOWN_SPECIES_COLORS, PLOT_SIZE_METERS, DBH_MARKER_SCALE, LOD_MODES, LOD_STEM_THRESHOLD, LOD_GRID_CELLS,
     LEGEND_DBH_SIZES, MATPLOTLIB_FIGSIZE_SQUARE, DEFAULT_GRID_STYLE, DEFAULT_GRID_WIDTH,
     DATE_COL, YEAR_COL, COORD_X_ALIASES, COORD_Y_ALIASES
 )
+from csv_sources import DECOMPRESSION_ERRORS, read_csv_source
+from raster import Surface
+
+
+class Notice(NamedTuple):
+    """A user-facing message produced by a headless function.
+
+    level is one of "success", "info", "warning" or "error"; the Streamlit adapter
+    in streamlit_views.py maps it onto the matching st.* call.
+    """
+    level: str
+    message: str
 
 def load_species_dict(filepath: str = "Data/TreeDict.csv") -> Dict[str, str]:
     """Load species abbreviation to common name mapping from TreeDict.csv.
@@ -40,10 +54,17 @@ def load_status_dict(filepath: str = "Data/StatusDict.csv") -> Dict[str, str]:
         # If file doesn't exist or is malformed, return empty dict (will use codes)
         return {}
 
-def load_data(filelike) -> Optional[pd.DataFrame]:
+def read_data(filelike) -> Tuple[Optional[pd.DataFrame], List[Notice]]:
+    """Read and standardise an inventory CSV without any UI side effects.
+
+    filelike may be gzip-, xz- or zip-compressed (see csv_sources). Returns the
+    DataFrame (None if the file could not be read) and the notices that the
+    caller may want to show.
+    """
+    notices: List[Notice] = []
     if filelike is not None:
         try:
-            df = pd.read_csv(filelike)
+            df = read_csv_source(filelike)
             df.columns = df.columns.str.strip()
             if "TreeStatus" in df.columns and "Status" not in df.columns:
                 df.rename(columns={"TreeStatus": "Status"}, inplace=True)
@@ -59,7 +80,7 @@ def load_data(filelike) -> Optional[pd.DataFrame]:
                 # handle the case where CSV already has a Year column with stray whitespace or string types
                 df[YEAR_COL] = pd.to_numeric(df[YEAR_COL].astype(str).str.strip(), errors='coerce').astype('Int64')
             else:
-                st.warning("No date/year column found. Year-based filtering will not be available.")
+                notices.append(Notice("warning", "No date/year column found. Year-based filtering will not be available."))
 
             # Handle Plot/Subplot columns
             if ("Plots" in df.columns and "Subplots" in df.columns) or ("Plot" in df.columns and "SubPlot" in df.columns):
@@ -74,36 +95,42 @@ def load_data(filelike) -> Optional[pd.DataFrame]:
                 # If only Plots column exists (no Subplots), use it as PlotID but keep as numeric
                 df["PlotID"] = pd.to_numeric(df["Plots"], errors='coerce').fillna(df["Plots"])
 
-            st.success("File successfully uploaded and read.")
-            return df
-        except (pd.errors.ParserError, ValueError) as e:
-            st.error(f"Error reading file: {e}")
-            return None
-    return None
+            notices.append(Notice("success", "File successfully uploaded and read."))
+            return df, notices
+        except (pd.errors.ParserError, ValueError, *DECOMPRESSION_ERRORS) as e:
+            notices.append(Notice("error", f"Error reading file: {e}"))
+            return None, notices
+    return None, notices
 
 
 def normalize_coordinates(df: pd.DataFrame) -> pd.DataFrame:
-    """Rename coordinate columns to 'X' and 'Y' if needed."""
-    df = df.copy()
+    """Rename coordinate columns to 'X' and 'Y' if needed.
 
-    df['Year'] = pd.to_numeric(df['Year'], errors='coerce').astype('Int64')
+    Returns a new frame and leaves df untouched. Columns that are already in the
+    right form are not coerced again, and with copy-on-write enabled (see
+    memory.enable_copy_on_write) unchanged columns are shared rather than copied.
+    """
+    renames = {}
     for alias in COORD_X_ALIASES:
         if alias in df.columns and 'X' not in df.columns:
-            df.rename(columns={alias: 'X'}, inplace=True)
+            renames[alias] = 'X'
             break
     for alias in COORD_Y_ALIASES:
         if alias in df.columns and 'Y' not in df.columns:
-            df.rename(columns={alias: 'Y'}, inplace=True)
+            renames[alias] = 'Y'
             break
 
+    updates = {}
+    if str(df['Year'].dtype) != 'Int64':
+        updates['Year'] = pd.to_numeric(df['Year'], errors='coerce').astype('Int64')
+
     # Only apply string normalization to PlotDisplay column (not PlotID which should remain numeric)
-    for col in df.columns:
-        if col == "PlotDisplay":  # Only process PlotDisplay, not PlotID
-            df[col] = df[col].astype(str).str.replace('\u00A0', ' ')  # NBSP -> space
-            df[col] = df[col].str.strip()
-            df[col] = df[col].str.replace(r'\s*-\s*', '-', regex=True)
-    
-    return df
+    if "PlotDisplay" in df.columns:
+        display = df["PlotDisplay"].astype(str).str.replace('\u00A0', ' ')  # NBSP -> space
+        display = display.str.strip()
+        updates["PlotDisplay"] = display.str.replace(r'\s*-\s*', '-', regex=True)
+
+    return df.rename(columns=renames).assign(**updates)
 
 
 def assign_colors(species_list) -> Dict[Any, str]:
@@ -124,8 +151,121 @@ def assign_colors(species_list) -> Dict[Any, str]:
 
     return defaultdict(lambda: next(color_cycle), mapping)
 
-def plot_data(df: pd.DataFrame, species_colors: Dict, plotting_group: Optional[str], year: int, species_dict: Optional[Dict[str, str]] = None, status_dict: Optional[Dict[str, str]] = None) -> str:
-    
+class PlotGeometry(NamedTuple):
+    """Size of a plot's rectangular frame in metres, with the origin at one corner."""
+    width: float = PLOT_SIZE_METERS
+    length: float = PLOT_SIZE_METERS
+
+    @property
+    def area_m2(self) -> float:
+        return self.width * self.length
+
+    @property
+    def center(self) -> Tuple[float, float]:
+        return self.width / 2, self.length / 2
+
+
+# Zoom window (x0, x1, y0, y1) in metres
+View = Tuple[float, float, float, float]
+
+LOD_TITLES = {
+    "markers": "Scaled by DBH",
+    "density": "Stem density",
+    "basal_area": "Basal area per cell",
+    "dominant": "Dominant group per cell",
+}
+
+
+def infer_plot_geometry(df: pd.DataFrame) -> PlotGeometry:
+    """Guess a dataset's plot frame from its coordinates.
+
+    Stays at PLOT_SIZE_METERS unless coordinates clearly run past it (more than 10%
+    beyond the edge, ignoring the outermost 0.5% of stems), in which case each side
+    is rounded up to the next 10 m.
+    """
+    sides = []
+    for col in ("X", "Y"):
+        values = pd.to_numeric(df[col], errors='coerce').dropna() if col in df.columns else pd.Series(dtype=float)
+        edge = values.quantile(0.995) if len(values) else 0
+        sides.append(PLOT_SIZE_METERS if edge <= PLOT_SIZE_METERS * 1.1 else float(np.ceil(edge / 10) * 10))
+    return PlotGeometry(*sides)
+
+
+def choose_lod(n_stems: int, lod: str = "auto", threshold: int = LOD_STEM_THRESHOLD) -> str:
+    """Representation for a stem map: lod itself, or for "auto" markers up to
+    threshold stems (e.g. once zoomed in) and a density map above it."""
+    if lod not in LOD_MODES:
+        raise ValueError(f"Unknown level of detail '{lod}'. Choose from {LOD_MODES}")
+    if lod != "auto":
+        return lod
+    return "markers" if n_stems <= threshold else "density"
+
+
+def _ticks(start: float, stop: float) -> np.ndarray:
+    # About 20 ticks at a round step (1, 2, 5, 10 m, ...) whatever the extent
+    raw = max((stop - start) / 20, 1)
+    magnitude = 10 ** np.floor(np.log10(raw))
+    step = next(m * magnitude for m in (1, 2, 5, 10) if m * magnitude >= raw)
+    return np.arange(np.ceil(start / step) * step, stop + step / 2, step)
+
+
+def _draw_binned(fig: Figure, ax, df_year: pd.DataFrame, lod: str, extent: View, species_colors: Dict,
+                 plotting_group: Optional[str], labels: Dict) -> None:
+    """Summarise stems per grid cell instead of drawing one marker each."""
+    x = df_year["X"].to_numpy(dtype=float)
+    y = df_year["Y"].to_numpy(dtype=float)
+    x0, x1, y0, y1 = extent
+    cell = max(x1 - x0, y1 - y0) / LOD_GRID_CELLS
+
+    if lod == "density":
+        hb = ax.hexbin(x, y, gridsize=LOD_GRID_CELLS, extent=extent, mincnt=1, cmap='viridis')
+        fig.colorbar(hb, ax=ax, label='Stems per cell')
+        return
+
+    nx, ny = max(int(np.ceil((x1 - x0) / cell)), 1), max(int(np.ceil((y1 - y0) / cell)), 1)
+    ix = np.clip(((x - x0) / cell).astype(int), 0, nx - 1)
+    iy = np.clip(((y - y0) / cell).astype(int), 0, ny - 1)
+    cells = iy * nx + ix
+    ba = np.pi * (df_year[DIAMETER_COL].to_numpy(dtype=float) / 200.0) ** 2
+    grid_extent = (x0, x0 + nx * cell, y0, y0 + ny * cell)
+
+    if lod == "basal_area":
+        per_ha = np.bincount(cells, weights=ba, minlength=nx * ny) / (cell * cell / 10000.0)
+        image = np.ma.masked_equal(per_ha.reshape(ny, nx), 0)
+        im = ax.imshow(image, extent=grid_extent, origin='lower', cmap='Greens', interpolation='nearest', aspect='auto')
+        fig.colorbar(im, ax=ax, label='Basal area (m²/ha)')
+        return
+
+    # Dominant group: the group holding the most basal area in each cell
+    codes, groups = pd.factorize(df_year[plotting_group], sort=True)
+    ba_by_group = np.bincount(cells * len(groups) + codes, weights=ba,
+                              minlength=nx * ny * len(groups)).reshape(nx * ny, len(groups))
+    dominant = ba_by_group.argmax(axis=1)
+    occupied = ba_by_group.sum(axis=1) > 0
+    palette = np.array([to_rgba(species_colors[g]) for g in groups])
+    rgba = np.zeros((nx * ny, 4))
+    rgba[occupied] = palette[dominant[occupied]]
+    ax.imshow(rgba.reshape(ny, nx, 4), extent=grid_extent, origin='lower', interpolation='nearest', aspect='auto')
+    present = np.unique(dominant[occupied])
+    handles = [Patch(facecolor=palette[g], label=labels.get(groups[g], groups[g])) for g in present]
+    ax.legend(handles=handles, title=plotting_group, bbox_to_anchor=(1.05, 1), loc='upper left')
+    fig.subplots_adjust(right=0.75)
+
+
+def stem_map_figure(df: pd.DataFrame, species_colors: Dict, plotting_group: Optional[str], year: int, species_dict: Optional[Dict[str, str]] = None, status_dict: Optional[Dict[str, str]] = None,
+                    geometry: Optional[PlotGeometry] = None, lod: str = "auto", view: Optional[View] = None,
+                    overlay: Optional[Surface] = None) -> Figure:
+    """Build the stem map for one year as a standalone matplotlib Figure.
+
+    Uses the object-oriented Figure API rather than pyplot so it can run outside the
+    Streamlit script thread (e.g. in background report jobs). Raises ValueError when
+    no plottable rows exist for the year.
+
+    geometry sets the plot frame (default PLOT_SIZE_METERS square) and view an
+    optional (x0, x1, y0, y1) zoom window. lod picks the representation, see
+    choose_lod(); binned modes summarise stems per grid cell instead of drawing them.
+    overlay is a raster.Surface (e.g. a kernel density surface) drawn beneath the stems.
+    """
     if YEAR_COL not in df.columns:
         raise ValueError(f"DataFrame must contain '{YEAR_COL}' column")
     if plotting_group is not None and plotting_group not in df.columns:
@@ -142,20 +282,18 @@ def plot_data(df: pd.DataFrame, species_colors: Dict, plotting_group: Optional[s
     except Exception:
         year_int = year
 
-    # Coerce numeric columns used for plotting
-    # creates copies of numeric versions to keep original df untouched
-    df = df.copy()
-    df["X"] = pd.to_numeric(df["X"], errors='coerce')
-    df["Y"] = pd.to_numeric(df["Y"], errors='coerce')
-    df[DIAMETER_COL] = pd.to_numeric(df[DIAMETER_COL], errors='coerce')
-
-    fig, ax = plt.subplots(figsize=MATPLOTLIB_FIGSIZE_SQUARE)
     df_year = df[df[YEAR_COL] == year_int]
 
+    # Coerce numeric columns used for plotting, only on the year's rows and only
+    # where needed; assign() leaves the caller's frame untouched
+    coerce = {col: pd.to_numeric(df_year[col], errors='coerce') for col in ("X", "Y", DIAMETER_COL)
+              if not pd.api.types.is_numeric_dtype(df_year[col])}
+    if coerce:
+        df_year = df_year.assign(**coerce)
+
     if df_year.empty:
-        st.warning(f"No data found for year {year} after coercion (year value used: {year_int}). "
-                   "Check YEAR_COL types and values in your DataFrame.")
-        raise ValueError(f"No data found for year {year}")
+        raise ValueError(f"No data found for year {year} after coercion (year value used: {year_int}). "
+                         "Check YEAR_COL types and values in your DataFrame.")
 
     # Require numeric/finite X,Y,DBH and a valid plotting_group
     required_cols = ["X", "Y", DIAMETER_COL]
@@ -166,10 +304,31 @@ def plot_data(df: pd.DataFrame, species_colors: Dict, plotting_group: Optional[s
     df_year = df_year[np.isfinite(df_year["X"]) & np.isfinite(df_year["Y"]) & np.isfinite(df_year[DIAMETER_COL])]
 
     if df_year.empty:
-        st.warning(f"No data found for year {year} with numeric X, Y, and {DIAMETER_COL} after coercion.")
         raise ValueError(f"No data found for year {year} with complete X, Y, {DIAMETER_COL}, and {plotting_group} values")
 
-    if plotting_group is None:
+    if geometry is None:
+        geometry = PlotGeometry()
+    if view is not None:
+        x0, x1, y0, y1 = view
+        df_year = df_year[df_year["X"].between(x0, x1) & df_year["Y"].between(y0, y1)]
+    extent = view if view is not None else (0, geometry.width, 0, geometry.length)
+    # An empty zoom window just shows the empty frame
+    lod = choose_lod(len(df_year), lod) if len(df_year) else "markers"
+    if lod == "dominant" and plotting_group is None:
+        lod = "basal_area"
+
+    fig = Figure(figsize=MATPLOTLIB_FIGSIZE_SQUARE)
+    ax = fig.add_subplot()
+
+    if overlay is not None:
+        im = ax.imshow(overlay.values, extent=overlay.extent, origin='lower', cmap='YlGn', alpha=0.6,
+                       interpolation='bilinear', zorder=0)
+        fig.colorbar(im, ax=ax, label=overlay.label, location='left', pad=0.12, shrink=0.8)
+
+    if lod != "markers":
+        labels = species_dict if plotting_group == SPECIES_COL else status_dict if plotting_group == STATUS_COL else {}
+        _draw_binned(fig, ax, df_year, lod, extent, species_colors, plotting_group, labels)
+    elif plotting_group is None:
         # Plot all trees in grey without grouping
         valid_mask = df_year[DIAMETER_COL].notna() & df_year["X"].notna() & df_year["Y"].notna()
         if valid_mask.sum() > 0:
@@ -177,7 +336,7 @@ def plot_data(df: pd.DataFrame, species_colors: Dict, plotting_group: Optional[s
             ax.scatter(df_valid["X"], df_valid["Y"], s=df_valid[DIAMETER_COL] * DBH_MARKER_SCALE, 
                        c='grey', label='All trees', marker='o', alpha=0.8)
     else:
-        for sp, group in df_year.groupby(plotting_group, dropna=True):
+        for sp, group in df_year.groupby(plotting_group, dropna=True, observed=True):
             if not group.empty and len(group) > 0:
                 # Ensure all values are numeric and not NaN
                 valid_mask = group[DIAMETER_COL].notna() & group["X"].notna() & group["Y"].notna()
@@ -193,18 +352,20 @@ def plot_data(df: pd.DataFrame, species_colors: Dict, plotting_group: Optional[s
                     ax.scatter(group_valid["X"], group_valid["Y"], s=group_valid[DIAMETER_COL] * DBH_MARKER_SCALE, 
                                c=species_colors[sp], label=label, marker='o', alpha=0.8)
     
-    ax.legend()
     ax.grid(True, which='both', linestyle=DEFAULT_GRID_STYLE, linewidth=DEFAULT_GRID_WIDTH)
-    ax.axvline(x=PLOT_CENTER, color='red', linestyle='-', linewidth=1)
-    ax.axhline(y=PLOT_CENTER, color='red', linestyle='-', linewidth=1)
-    ax.set_xlim(0, PLOT_SIZE_METERS)
-    ax.set_ylim(0, PLOT_SIZE_METERS)
-    ax.set_xticks(range(0, PLOT_SIZE_METERS + 1, 1))
-    ax.set_yticks(range(0, PLOT_SIZE_METERS + 1, 1))
+    center_x, center_y = geometry.center
+    ax.axvline(x=center_x, color='red', linestyle='-', linewidth=1)
+    ax.axhline(y=center_y, color='red', linestyle='-', linewidth=1)
+    ax.set_xlim(extent[0], extent[1])
+    ax.set_ylim(extent[2], extent[3])
+    ax.set_xticks(_ticks(extent[0], extent[1]))
+    ax.set_yticks(_ticks(extent[2], extent[3]))
     ax.set_xlabel('Meters (x)')
     ax.set_ylabel('Meters (y)')
     title_group = plotting_group if plotting_group is not None else 'No grouping'
-    ax.set_title(f'Tree Plot by {title_group}, {year}, Scaled by DBH')
+    ax.set_title(f'Tree Plot by {title_group}, {year}, {LOD_TITLES[lod]}')
+    if lod != "markers":
+        return fig
 
     marker_sizes = [dbh * DBH_MARKER_SCALE for dbh in LEGEND_DBH_SIZES]
     dbh_legend_elements = [Line2D([0], [0], marker='o', color='w', markerfacecolor='gray', 
@@ -223,11 +384,5 @@ def plot_data(df: pd.DataFrame, species_colors: Dict, plotting_group: Optional[s
         # Fallback if no legend elements
         ax.legend(handles=dbh_legend_elements, 
                   title=legend_title, bbox_to_anchor=(1.05, 1), loc='upper left')
-    plt.subplots_adjust(right=0.75)
-    st.pyplot(fig)
-    fn = 'tree_plot.png'
-    plt.savefig(fn)
-    return fn
-
-
-
+    fig.subplots_adjust(right=0.75)
+    return fig
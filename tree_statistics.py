@@ -2,9 +2,10 @@ import pandas as pd
 import numpy as np
 import math
 import matplotlib.pyplot as plt
-import streamlit as st 
+from matplotlib.figure import Figure
 from typing import Optional, Tuple, Dict, List
-from tree_plots import assign_colors
+from tree_plots import assign_colors, Notice
+from caching import memoize
 
 from config import (
     DIAMETER_COL, SPECIES_COL, MIN_SAMPLES_FOR_STATS, STATUS_COL, TREEID_COL, PLOTID_COL, MATPLOTLIB_FIGSIZE_SQUARE,
@@ -26,29 +27,30 @@ def compute_plot_year_stats(df: pd.DataFrame, plot_id: str) -> Optional[dict]:
     if df is None:
         return None
     
+    # Boolean indexing already yields a new frame, and the caller's frame is never
+    # written to, so no defensive copies are needed
     if plot_id is not None and PLOTID_COL in df.columns:
-        plot_df = df[df[PLOTID_COL] == plot_id].copy()
+        plot_df = df[df[PLOTID_COL] == plot_id]
     else:
-        plot_df = df.copy()
+        plot_df = df
     
     if plot_df.empty:
         return None
 
     if 'Year' not in plot_df.columns:
         if 'Date' in plot_df.columns:
-            plot_df['Year'] = pd.to_datetime(plot_df['Date'], errors='coerce').dt.year
+            plot_df = plot_df.assign(Year=pd.to_datetime(plot_df['Date'], errors='coerce').dt.year)
         elif 'YearInv' in plot_df.columns:
-            plot_df['Year'] = plot_df['YearInv']
+            plot_df = plot_df.assign(Year=plot_df['YearInv'])
         else:
             raise ValueError('DataFrame must contain Year, Date, or YearInv for time-based statistics')
 
     counts = plot_df.groupby('Year').size().reset_index(name='Count')
     counts['PlotID'] = plot_id if plot_id is not None else 'Plot'
 
-    plot_df['BasalArea'] = plot_df[DIAMETER_COL].apply(basal_area_m2)
-    basal_area = plot_df.groupby('Year')['BasalArea'].sum().reset_index()
+    tree_ba = plot_df[DIAMETER_COL].apply(basal_area_m2).rename('BasalArea_m2')
+    basal_area = tree_ba.groupby(plot_df['Year']).sum().reset_index()
     basal_area['PlotID'] = plot_id if plot_id is not None else 'Plot'
-    basal_area = basal_area.rename(columns={'BasalArea': 'BasalArea_m2'})
 
     species = (
         plot_df.groupby(['Year', SPECIES_COL]).size().reset_index(name='Count')
@@ -72,30 +74,33 @@ def compute_plot_year_stats(df: pd.DataFrame, plot_id: str) -> Optional[dict]:
     }
 
 
-def compute_dbh_increments(df: pd.DataFrame, plot_id: str) -> Optional[np.ndarray]:
+def compute_dbh_increments(df: pd.DataFrame, plot_id: str, id_col: str = TREEID_COL) -> Optional[np.ndarray]:
     """Compute annual DBH increments for trees in a plot.
+
+    id_col identifies the same tree across censuses; pass MATCHED_ID_COL (see
+    stem_matching.with_matched_ids) when StandardIDs are missing or re-tagged.
     """
     if df is None:
         return None
     
     if plot_id is not None and PLOTID_COL in df.columns:
-        plot_df = df[df[PLOTID_COL] == plot_id].copy()
+        plot_df = df[df[PLOTID_COL] == plot_id]
     else:
-        plot_df = df.copy()
+        plot_df = df
     
     if plot_df.empty:
         return None
 
     if 'Year' not in plot_df.columns:
         if 'Date' in plot_df.columns:
-            plot_df['Year'] = pd.to_datetime(plot_df['Date'], errors='coerce').dt.year
+            plot_df = plot_df.assign(Year=pd.to_datetime(plot_df['Date'], errors='coerce').dt.year)
         elif 'YearInv' in plot_df.columns:
-            plot_df['Year'] = plot_df['YearInv']
+            plot_df = plot_df.assign(Year=plot_df['YearInv'])
         else:
             raise ValueError('DataFrame must contain Year, Date, or YearInv for increment computation')
 
     increments = []
-    for tree_id, group in plot_df.groupby(TREEID_COL):
+    for tree_id, group in plot_df.groupby(id_col):
         g = group.sort_values('Year')
         years = g['Year'].values
         dbhs = g[DIAMETER_COL].values
@@ -113,69 +118,69 @@ def compute_dbh_increments(df: pd.DataFrame, plot_id: str) -> Optional[np.ndarra
     return np.array(increments) if len(increments) > 0 else None
 
 """Count unique species in dataset."""
-def diversity(data: Optional[pd.DataFrame]) -> int:
+def diversity(data: Optional[pd.DataFrame], plot_id=None) -> int:
 
     if data is None or data.empty:
         return 0
+    if plot_id is not None and PLOTID_COL in data.columns:
+        data = data[data[PLOTID_COL] == plot_id]
     return len(data[SPECIES_COL].unique())
 
-"""Create pie chart of species diversity."""
-@st.cache_data
-def diversity_plot(species_counts: pd.Series, colourwheel: Dict) -> None:
-    fig, ax = plt.subplots(figsize=MATPLOTLIB_FIGSIZE_SQUARE)
+
+# Memoized variants keyed by dataset fingerprint, plot and parameters; safe to call
+# on every Streamlit rerun and from report jobs. Treat results as read-only.
+cached_plot_year_stats = memoize(name="compute_plot_year_stats")(compute_plot_year_stats)
+cached_dbh_increments = memoize(name="compute_dbh_increments")(compute_dbh_increments)
+cached_diversity = memoize(name="diversity")(diversity)
+
+def diversity_figure(species_counts: pd.Series, colourwheel: Dict) -> Figure:
+    """Create pie chart of species diversity."""
+    fig = Figure(figsize=MATPLOTLIB_FIGSIZE_SQUARE)
+    ax = fig.add_subplot()
     species_counts.plot(kind="pie", ax=ax, color=colourwheel)
     ax.set_title("Tree Species Diversity")
     ax.set_xlabel("Species")
-    plt.xticks(rotation=45, ha='right')
-    st.pyplot(fig)
+    for label in ax.get_xticklabels():
+        label.set_rotation(45)
+        label.set_horizontalalignment('right')
+    return fig
 
-    """Create histogram of DBH distribution by species."""
 
-def dbh_plot(df: pd.DataFrame, selected_species: List[str], numbins: int, 
-             colourwheel: Dict, colourtype: bool) -> None:
-    colors = plt.cm.tab20.colors
-    color_map = {sp: colors[i % len(colors)] for i, sp in enumerate(selected_species)}
-    fig, ax = plt.subplots(figsize=MATPLOTLIB_FIGSIZE_WIDE)
-    
-    for sp in selected_species:
-        subset = df[df[SPECIES_COL] == sp][DIAMETER_COL].dropna()
-        if len(subset) == 0:
-            continue
-        
-        if colourtype:
-            ax.hist(subset, bins=numbins, alpha=0.6, label=sp, color=colourwheel[sp])
-            ax.legend(title="Species")
-        else:
-            ax.hist(subset, bins=numbins, alpha=0.6, label=sp, color="black")
+def dbh_histogram(df: pd.DataFrame, selected_species: List[str], numbins) -> Tuple[Optional[np.ndarray], Dict[str, np.ndarray]]:
+    """Per-species DBH values and shared bin edges for the selected species.
 
-    ax.set_title("DBH Distribution by Species")
-    ax.set_xlabel(f"{DIAMETER_COL} (cm)")
-    ax.set_ylabel("Number of Trees")
-    st.pyplot(fig)
-
-import numpy as np
-import matplotlib.pyplot as plt
-from typing import List, Dict
-
-def dbh_plot(df: pd.DataFrame, selected_species: List[str], numbins: int, 
-             colourwheel: Dict, colourtype: bool) -> None:
-    
+    numbins may be a bin count or an array of edges, as for np.histogram_bin_edges.
+    Returns (None, {}) when none of the species have DBH data.
+    """
     # Prepare per-species arrays (preserve order of selected_species)
-    data_by_species = []
-    labels = []
+    data_by_species = {}
     for sp in selected_species:
         vals = df[df[SPECIES_COL] == sp][DIAMETER_COL].dropna().values
         if vals.size > 0:
-            data_by_species.append(vals)
-            labels.append(sp)
+            data_by_species[sp] = vals
 
     if not data_by_species:
-        st.warning("No DBH data for selected species.")
-        return
+        return None, {}
 
     # Shared bin edges computed from the combined selected data
-    all_dbh = np.concatenate(data_by_species)
+    all_dbh = np.concatenate(list(data_by_species.values()))
     bin_edges = np.histogram_bin_edges(all_dbh, bins=numbins)
+    return bin_edges, data_by_species
+
+
+def dbh_figure(df: pd.DataFrame, selected_species: List[str], numbins: int, 
+               colourwheel: Dict, colourtype: bool) -> Tuple[Optional[Figure], List[Notice]]:
+    """Create stacked histogram of DBH distribution by species."""
+    bin_edges, data_by_species = dbh_histogram(df, selected_species, numbins)
+    if bin_edges is None:
+        return None, [Notice("warning", "No DBH data for selected species.")]
+    counts = {sp: np.histogram(vals, bins=bin_edges)[0] for sp, vals in data_by_species.items()}
+    return dbh_counts_figure(bin_edges, counts, colourwheel, colourtype), []
+
+
+def dbh_counts_figure(bin_edges: np.ndarray, counts_by_species: Dict, colourwheel: Dict, colourtype: bool) -> Figure:
+    """Stacked DBH histogram from pre-binned counts (one array per species, aligned to bin_edges)."""
+    labels = list(counts_by_species.keys())
 
     # Build color list: use colourwheel if colourtype True, else black for all
     # Fallback palette if a species is missing in colourwheel
@@ -190,11 +195,15 @@ def dbh_plot(df: pd.DataFrame, selected_species: List[str], numbins: int,
     else:
         plot_colors = ["black"] * len(labels)
 
-    # Plot stacked histogram in one call so bars stack correctly
-    fig, ax = plt.subplots(figsize=MATPLOTLIB_FIGSIZE_WIDE)
+    # Plot stacked histogram in one call so bars stack correctly; each bin's count
+    # is placed at the bin centre as a weight
+    centres = (bin_edges[:-1] + bin_edges[1:]) / 2
+    fig = Figure(figsize=MATPLOTLIB_FIGSIZE_WIDE)
+    ax = fig.add_subplot()
     ax.hist(
-        data_by_species,
+        [centres] * len(labels),
         bins=bin_edges,
+        weights=[counts_by_species[sp] for sp in labels],
         stacked=True,
         label=labels,
         color=plot_colors,
@@ -208,5 +217,5 @@ def dbh_plot(df: pd.DataFrame, selected_species: List[str], numbins: int,
     ax.set_ylabel("Number of Trees")
     ax.legend(title="Species", bbox_to_anchor=(1.02, 1), loc="upper left")
 
-    plt.tight_layout()
-    st.pyplot(fig)
+    fig.tight_layout()
+    return fig